@@ -1,10 +1,13 @@
 from django.contrib import admin
-from .models import Wallet, Payment, Transaction
+from .models import (
+    Wallet, Payment, Transaction, WalletCheckpoint, PaymentArchive, TransactionArchive, SubPartnerJob, Notification,
+    Broadcast,
+)
 
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
-    list_display = ['user', 'balance', 'created_at', 'updated_at']
+    list_display = ['user', 'balance', 'transaction_count', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
     search_fields = ['user__telegram_full_name', 'user__telegram_username']
     readonly_fields = ['created_at', 'updated_at']
@@ -58,3 +61,90 @@ class TransactionAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('wallet__user')
+
+
+
+@admin.register(WalletCheckpoint)
+class WalletCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['wallet', 'balance', 'last_transaction_id', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['wallet__user__telegram_full_name', 'wallet__user__telegram_username']
+    readonly_fields = ['wallet', 'balance', 'last_transaction_id', 'created_at']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('wallet__user')
+
+
+@admin.register(PaymentArchive)
+class PaymentArchiveAdmin(admin.ModelAdmin):
+    list_display = ['payment_id', 'user', 'amount_usd', 'currency', 'status', 'created_at', 'archived_at']
+    list_filter = ['status', 'currency']
+    search_fields = ['payment_id', 'nowpayments_id', 'user__telegram_username']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+
+@admin.register(TransactionArchive)
+class TransactionArchiveAdmin(admin.ModelAdmin):
+    list_display = ['wallet', 'transaction_type', 'amount', 'balance_after', 'created_at', 'archived_at']
+    list_filter = ['transaction_type']
+    search_fields = ['wallet__user__telegram_full_name', 'wallet__user__telegram_username']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('wallet__user')
+
+
+@admin.register(SubPartnerJob)
+class SubPartnerJobAdmin(admin.ModelAdmin):
+    list_display = ['user', 'status', 'attempts', 'next_attempt_at', 'updated_at']
+    list_filter = ['status']
+    search_fields = ['user__telegram_full_name', 'user__telegram_username', 'user__telegram_id']
+    readonly_fields = ['created_at', 'updated_at', 'last_error']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ['user', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['user__telegram_full_name', 'user__telegram_username', 'chat_id']
+    readonly_fields = ['created_at', 'updated_at', 'sent_at', 'last_error']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'sent_count', 'failed_count', 'last_user_id', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['message']
+    readonly_fields = [
+        'status', 'last_user_id', 'sent_count', 'failed_count', 'created_at', 'updated_at', 'started_at', 'finished_at'
+    ]
+    actions = ['queue_broadcasts']
+
+    @admin.action(description='Queue selected broadcasts for sending')
+    def queue_broadcasts(self, request, queryset):
+        queued = queryset.filter(status='DRAFT').update(status='QUEUED')
+        self.message_user(
+            request,
+            f"{queued} broadcast(s) queued. They are sent by: python manage.py broadcast --queued"
+        )
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class AppBotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_bot'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .db import configure_sqlite_connection
+
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='app_bot_sqlite_pragmas')
+
+        if settings.QUERY_PROFILER_ENABLED:
+            from .query_profiler import enable_query_profiler
+
+            enable_query_profiler()
@@ -0,0 +1,159 @@
+import logging
+from decimal import Decimal
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+
+from .models import Payment, PaymentArchive, Transaction, TransactionArchive, WalletCheckpoint
+
+logger = logging.getLogger(__name__)
+
+# Payments in these states never change again and are safe to move out of the live table
+FINAL_PAYMENT_STATUSES = ['FINISHED', 'FAILED', 'EXPIRED', 'REFUNDED']
+
+PAYMENT_FIELDS = [
+    'id', 'payment_id', 'user_id', 'amount_usd', 'crypto_amount', 'currency', 'nowpayments_id',
+    'payment_address', 'payment_extra_id', 'status', 'created_at', 'updated_at', 'expires_at', 'is_processed',
+]
+TRANSACTION_FIELDS = [
+    'id', 'wallet_id', 'amount', 'transaction_type', 'description', 'balance_after', 'created_at',
+]
+
+
+def archivable_payments(cutoff):
+    """Payments older than cutoff that have reached a final state"""
+    return Payment.objects.filter(created_at__lt=cutoff).filter(
+        Q(status__in=['FAILED', 'EXPIRED', 'REFUNDED']) | Q(status='FINISHED', is_processed=True)
+    )
+
+
+def archive_payments(cutoff, batch_size=1000):
+    """
+    Move final payments older than cutoff into PaymentArchive in bulk batches
+    Returns: number of payments archived
+    """
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(archivable_payments(cutoff).order_by('id').values(*PAYMENT_FIELDS)[:batch_size])
+            if not rows:
+                break
+            PaymentArchive.objects.bulk_create(
+                [PaymentArchive(**row) for row in rows],
+                ignore_conflicts=True
+            )
+            Payment.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        archived += len(rows)
+        logger.info(f"Archived {archived} payments so far")
+    return archived
+
+
+def archive_wallet_transactions(wallet_id, cutoff, batch_size=1000):
+    """
+    Move one wallet's transactions older than cutoff into TransactionArchive.
+    The newest archived row stays in the live table as an OPENING entry carrying the
+    archived total forward, so the live ledger still sums to the wallet balance.
+    Returns: number of transactions archived
+    """
+    with transaction.atomic():
+        old = Transaction.objects.filter(wallet_id=wallet_id, created_at__lt=cutoff)
+        summary = old.aggregate(last_id=Max('id'))
+        if summary['last_id'] is None:
+            return 0
+
+        # Archive a prefix of the ledger by id so the opening entry precedes every live row
+        prefix = Transaction.objects.filter(wallet_id=wallet_id, id__lte=summary['last_id'])
+        if prefix.count() < 2:
+            return 0
+        total = prefix.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+
+        archived = 0
+        last_id = 0
+        while True:
+            # Earlier OPENING entries were already archived in full by a previous run
+            rows = list(
+                prefix.filter(id__gt=last_id, id__lt=summary['last_id'])
+                .order_by('id').values(*TRANSACTION_FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            TransactionArchive.objects.bulk_create(
+                [TransactionArchive(**row) for row in rows if row['transaction_type'] != 'OPENING'],
+                ignore_conflicts=True
+            )
+            Transaction.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            archived += len([row for row in rows if row['transaction_type'] != 'OPENING'])
+
+        opening = Transaction.objects.get(id=summary['last_id'])
+        if opening.transaction_type != 'OPENING':
+            TransactionArchive.objects.bulk_create(
+                [TransactionArchive(**{field: getattr(opening, field) for field in TRANSACTION_FIELDS})],
+                ignore_conflicts=True
+            )
+            archived += 1
+        Transaction.objects.filter(id=opening.id).update(
+            amount=total,
+            transaction_type='OPENING',
+            description=f"Opening balance carried forward from transactions before {cutoff:%Y-%m-%d}"
+        )
+
+        # Checkpoints inside the folded range would double count the opening entry
+        WalletCheckpoint.objects.filter(wallet_id=wallet_id, last_transaction_id__lt=opening.id).delete()
+
+    return archived
+
+
+def archive_transactions(cutoff, batch_size=1000):
+    """
+    Archive transactions older than cutoff for every wallet that has them
+    Returns: number of transactions archived
+    """
+    wallet_ids = (
+        Transaction.objects.filter(created_at__lt=cutoff)
+        .exclude(transaction_type='OPENING')
+        .order_by('wallet_id').values_list('wallet_id', flat=True).distinct()
+    )
+    archived = 0
+    for wallet_id in wallet_ids.iterator():
+        archived += archive_wallet_transactions(wallet_id, cutoff, batch_size)
+    return archived
+
+
+def get_payment(include_archived=False, **lookup):
+    """Get a payment from the live table, falling back to the archive when asked"""
+    try:
+        return Payment.objects.get(**lookup)
+    except Payment.DoesNotExist:
+        if not include_archived:
+            raise
+        try:
+            return PaymentArchive.objects.get(**lookup)
+        except PaymentArchive.DoesNotExist:
+            raise Payment.DoesNotExist(f"Payment matching {lookup} not found in live or archived payments")
+
+
+def get_payment_history(user, include_archived=False):
+    """User's payments newest first, optionally including archived ones"""
+    payments = Payment.objects.filter(user=user).order_by('-created_at')
+    if not include_archived:
+        return payments
+    archived = PaymentArchive.objects.filter(user=user).order_by('-created_at')
+    return sorted(chain(payments, archived), key=lambda payment: payment.created_at, reverse=True)
+
+
+def get_transaction_history(wallet, include_archived=False):
+    """
+    Wallet transactions newest first. With include_archived the archived rows replace
+    the OPENING entries that summarise them.
+    """
+    transactions = wallet.transactions.order_by('-created_at', '-id')
+    if not include_archived:
+        return transactions
+    archived = wallet.archived_transactions.order_by('-created_at', '-id')
+    return sorted(
+        chain(transactions.exclude(transaction_type='OPENING'), archived),
+        key=lambda item: (item.created_at, item.id),
+        reverse=True
+    )
@@ -0,0 +1,340 @@
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from decimal import Decimal
+from unittest import mock
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from telegram import User as TelegramUser
+
+from app_account.models import User
+from .loadtest import counting_queries, percentile
+from .models import Payment, Wallet
+from .services import NOWPaymentsService, PaymentProcessor
+from .user_cache import user_cache
+
+BENCHMARKS = {}
+
+# Median absolute deviations a median must move by before compare() believes the change
+NOISE_MADS = 3
+# Fewer timed calls than this give medians that drift more between runs than any threshold
+MIN_COMPARE_ITERATIONS = 100
+
+
+class BenchmarkError(Exception):
+    """A benchmarked call did not succeed, so its timing would be meaningless"""
+
+
+def expect(ok, message):
+    if not ok:
+        raise BenchmarkError(message)
+
+
+class Benchmark:
+    """
+    A named hot path. setup(context, count) prepares fixtures for count calls and
+    returns the zero-argument callable that is timed.
+    threshold overrides the allowed slowdown for noisy benchmarks.
+    """
+
+    def __init__(self, name, setup, threshold=None):
+        self.name = name
+        self.setup = setup
+        self.threshold = threshold
+        self.description = (setup.__doc__ or '').strip()
+
+
+def benchmark(name, threshold=None):
+    """Register a setup function in BENCHMARKS"""
+    def register(setup):
+        BENCHMARKS[name] = Benchmark(name, setup, threshold)
+        return setup
+    return register
+
+
+class BenchmarkContext:
+    """Fixtures shared by the benchmarks: the fake NOWPayments server and unique Telegram IDs"""
+
+    def __init__(self, server):
+        self.server = server
+        self._telegram_ids = itertools.count(30_000_000)
+
+    def telegram_user(self):
+        telegram_id = next(self._telegram_ids)
+        return TelegramUser(id=telegram_id, first_name='Bench', last_name=str(telegram_id), is_bot=False,
+                            username=f"bench_{telegram_id}")
+
+    def create_wallet(self, balance=Decimal('0.00'), sub_partner=False):
+        telegram_user = self.telegram_user()
+        user = User.objects.create(
+            username=f"user_{telegram_user.id}",
+            telegram_id=telegram_user.id,
+            telegram_username=telegram_user.username,
+            telegram_full_name=telegram_user.full_name,
+            nowpayments_sub_partner_id=self.server.account.create_sub_partner('bench')['id'] if sub_partner else None,
+        )
+        return Wallet.objects.create(user=user, balance=balance)
+
+    def create_payments(self, count, **fields):
+        """count payments for a fresh wallet, linked to NOWPayments IDs"""
+        wallet = self.create_wallet()
+        prefix = f"bench-{wallet.user.telegram_id}"
+        Payment.objects.bulk_create([
+            Payment(user=wallet.user, amount_usd=Decimal('25.00'), currency='btc', crypto_amount=Decimal('0.0004'),
+                    nowpayments_id=f"{prefix}-{i}", expires_at=timezone.now(), **fields)
+            for i in range(count)
+        ])
+        return [f"{prefix}-{i}" for i in range(count)]
+
+
+@benchmark('payment_webhook.finished')
+def bench_webhook_finished(context, count):
+    """PaymentProcessor.process_payment_webhook crediting a finished payment"""
+    payment_ids = iter(context.create_payments(count))
+    processor = PaymentProcessor()
+
+    def run():
+        success, _ = processor.process_payment_webhook({'payment_id': next(payment_ids), 'payment_status': 'finished'})
+        expect(success, 'Webhook was not processed')
+    return run
+
+
+@benchmark('payment_webhook.duplicate')
+def bench_webhook_duplicate(context, count):
+    """process_payment_webhook for a payment that was already credited"""
+    payment_id = context.create_payments(1, status='FINISHED', is_processed=True)[0]
+    processor = PaymentProcessor()
+    return lambda: processor.process_payment_webhook({'payment_id': payment_id, 'payment_status': 'finished'})
+
+
+@benchmark('wallet.add_funds')
+def bench_add_funds(context, count):
+    """Wallet.add_funds: balance update plus ledger row"""
+    wallet = context.create_wallet()
+    return lambda: wallet.add_funds(Decimal('1.00'))
+
+
+@benchmark('wallet.deduct_funds')
+def bench_deduct_funds(context, count):
+    """Wallet.deduct_funds with sufficient balance"""
+    wallet = context.create_wallet(balance=Decimal(count))
+    return lambda: wallet.deduct_funds(Decimal('1.00'))
+
+
+@benchmark('save_user.new')
+def bench_save_user_new(context, count):
+    """bot.save_user for a first-time user: user, wallet and provisioning job"""
+    from .bot import save_user
+    users = iter([context.telegram_user() for _ in range(count)])
+    return lambda: async_to_sync(save_user)(next(users))
+
+
+@benchmark('save_user.uncached')
+def bench_save_user_uncached(context, count):
+    """bot.save_user for a known user missing from the user cache"""
+    from .bot import save_user
+    telegram_user = context.telegram_user()
+    async_to_sync(save_user)(telegram_user)
+
+    def run():
+        user_cache.invalidate(telegram_user.id)
+        async_to_sync(save_user)(telegram_user)
+    return run
+
+
+@benchmark('save_user.cached')
+def bench_save_user_cached(context, count):
+    """bot.save_user served from the user cache"""
+    from .bot import save_user
+    telegram_user = context.telegram_user()
+    async_to_sync(save_user)(telegram_user)
+    return lambda: async_to_sync(save_user)(telegram_user)
+
+
+@benchmark('deposit.validate', threshold=0.5)
+def bench_validate_deposit(context, count):
+    """PaymentProcessor.validate_deposit_request: min-amount and estimate calls to the fake API"""
+    processor = PaymentProcessor()
+
+    def run():
+        is_valid, _, error = processor.validate_deposit_request(25.0, 'btc')
+        expect(is_valid, error)
+    return run
+
+
+@benchmark('deposit.create', threshold=0.5)
+def bench_create_deposit(context, count):
+    """PaymentProcessor.create_deposit_payment end to end against the fake API"""
+    user = context.create_wallet(sub_partner=True).user
+    processor = PaymentProcessor()
+
+    def run():
+        payment, _, error = processor.create_deposit_payment(user, 25.0, 'btc')
+        expect(payment is not None, error)
+    return run
+
+
+@benchmark('qr.generate_qr_code')
+def bench_generate_qr_code(context, count):
+    """NOWPaymentsService.generate_qr_code for a distinct address each call"""
+    service = NOWPaymentsService()
+    addresses = iter([f"bc1qbenchmark{i:030d}" for i in range(count)])
+    return lambda: service.generate_qr_code(next(addresses), '0.00041667', 'btc')
+
+
+@benchmark('views.payment_status')
+def bench_payment_status(context, count):
+    """PaymentStatusView.get through the test client"""
+    payment = Payment.objects.get(nowpayments_id=context.create_payments(1)[0])
+    client = Client()
+    url = reverse('bot:payment_status', args=[payment.payment_id])
+
+    def run():
+        response = client.get(url)
+        expect(response.status_code == 200, f"Payment status returned {response.status_code}")
+    return run
+
+
+def measure(run, iterations, warmup=0):
+    """
+    Time iterations calls of run after warmup untimed ones
+    Returns: dict of latency statistics in milliseconds and queries per call
+    """
+    for _ in range(warmup):
+        run()
+    samples = []
+    with counting_queries() as counter:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            run()
+            samples.append(time.perf_counter() - started)
+    samples = sorted(sample * 1000 for sample in samples)
+    mean = statistics.fmean(samples)
+    median = statistics.median(samples)
+    return {
+        'iterations': iterations,
+        'median_ms': median,
+        # Median absolute deviation: the run's noise, used by compare() as a floor
+        'mad_ms': statistics.median(abs(sample - median) for sample in samples),
+        'mean_ms': mean,
+        'p95_ms': percentile(samples, 95),
+        'min_ms': samples[0],
+        'max_ms': samples[-1],
+        'stdev_ms': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'ops_per_sec': 1000 / mean if mean else 0.0,
+        'queries': counter[0] / iterations,
+    }
+
+
+def select_benchmarks(patterns=None):
+    """Benchmarks whose name equals or starts with one of patterns (all when empty)"""
+    if not patterns:
+        return list(BENCHMARKS.values())
+    return [
+        bench for name, bench in BENCHMARKS.items()
+        if any(name == pattern or name.startswith(pattern.rstrip('.') + '.') for pattern in patterns)
+    ]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(benchmarks, server, iterations=200, warmup=10, progress=None):
+    """
+    Run benchmarks against the current database and the fake NOWPayments server
+    Returns: results document (metadata plus per-benchmark statistics)
+    """
+    context = BenchmarkContext(server)
+    credentials = {'NOWPAYMENTS_API_KEY': 'benchmark', 'NOWPAYMENTS_EMAIL': 'bench@example.com',
+                   'NOWPAYMENTS_PASSWORD': 'benchmark'}
+    results = {}
+    # The test client's host is only allowed by the test runner
+    allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+    with mock.patch.dict(os.environ, credentials), override_settings(ALLOWED_HOSTS=allowed_hosts):
+        for bench in benchmarks:
+            run = bench.setup(context, warmup + iterations)
+            results[bench.name] = measure(run, iterations, warmup)
+            if progress:
+                progress(bench.name, results[bench.name])
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connections['default'].vendor,
+            'machine': platform.node(),
+            'iterations': iterations,
+            'warmup': warmup,
+        },
+        'benchmarks': results,
+    }
+
+
+def compare(results, baseline, threshold=0.25, noise=NOISE_MADS):
+    """
+    Compare median latency and queries per call with a baseline document.
+    A benchmark regresses when its median is more than threshold (or its own
+    threshold) slower and the difference is also above the noise floor of noise
+    times the larger median absolute deviation of the two runs, or when it runs
+    more queries per call. Improvements use the same two tests.
+    Returns: list of comparison rows
+    """
+    rows = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            rows.append({'name': name, 'status': 'new', 'current_ms': current['median_ms']})
+            continue
+        bench = BENCHMARKS.get(name)
+        limit = bench.threshold if bench and bench.threshold is not None else threshold
+        ratio = current['median_ms'] / previous['median_ms'] if previous['median_ms'] else 1.0
+        floor = noise * max(current.get('mad_ms', 0.0), previous.get('mad_ms', 0.0))
+        beyond_noise = abs(current['median_ms'] - previous['median_ms']) > floor
+        more_queries = current['queries'] > previous.get('queries', current['queries'])
+        if (ratio > 1 + limit and beyond_noise) or more_queries:
+            status = 'regressed'
+        elif ratio < 1 - limit and beyond_noise:
+            status = 'improved'
+        else:
+            status = 'ok'
+        rows.append({
+            'name': name,
+            'status': status,
+            'baseline_ms': previous['median_ms'],
+            'current_ms': current['median_ms'],
+            'ratio': ratio,
+            'threshold': limit,
+            'noise_ms': floor,
+            'baseline_queries': previous.get('queries'),
+            'queries': current['queries'],
+        })
+    return rows
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
@@ -1,8 +1,10 @@
 import os
+import asyncio
 import django
 import logging
 from decimal import Decimal
 from dotenv import load_dotenv
+from django.conf import settings
 
 # Load environment variables
 load_dotenv()
@@ -16,11 +18,25 @@ except Exception:
 from app_account.models import User
 from app_bot.models import Wallet, Payment, Transaction
 from app_bot.services import PaymentProcessor, NOWPaymentsService
+from app_bot.pagination import payment_page, transaction_page
+from app_bot.notifications import claim_notifications, mark_failed, mark_sent
+from app_bot.provisioning import drain_sub_partner_jobs, enqueue_sub_partner, wait_for_sub_partner
 from telegram import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update, WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
-from asgiref.sync import sync_to_async
-import base64
-import io
+from telegram.error import BadRequest, Forbidden, TelegramError
+from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, TypeHandler
+from app_bot.db import db_sync_to_async, network_sync_to_async
+from app_bot.dispatch import PerUserUpdateProcessor
+from app_bot.executors import shutdown_executors
+from app_bot.routers import replica_reads, sticky_writes
+from app_bot.user_cache import user_cache
+from app_bot.qr import qr_renderer
+from app_bot.keyboards import CurrencyKeyboards, FALLBACK_CURRENCIES
+from app_bot.metrics import BOT_HANDLER_ERRORS, BOT_HANDLER_SECONDS, BOT_UPDATE_QUEUE
+from app_bot.persistence import DjangoPersistence
+from app_bot.query_profiler import profile_handler
+from app_bot.throttling import build_inbound_throttle, build_rate_limiter
+import functools
+import time
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 BASE_URL = os.getenv('BASE_URL')
@@ -36,13 +52,89 @@ logger = logging.getLogger(__name__)
 # Conversation states for payment flow
 CHOOSING_AMOUNT, CHOOSING_CURRENCY = range(2)
 
-@sync_to_async
-def save_user(user):
+# Long-running asyncio tasks started in post_init
+background_tasks = []
+
+currency_keyboards = CurrencyKeyboards(
+    popular=settings.BOT_POPULAR_CURRENCIES,
+    page_size=settings.BOT_CURRENCY_PAGE_SIZE,
+    ttl=settings.BOT_CURRENCY_CACHE_TTL
+)
+
+def observe_handler(handler):
+    """Record a handler's latency and errors in app_bot.metrics, labelled by its name"""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        BOT_UPDATE_QUEUE.set(context.application.update_queue.qsize())
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            BOT_HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            BOT_HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+    return wrapper
+
+def wrap_handler_callbacks(handlers, wrap):
+    """Replace every handler's callback with wrap(callback), including inside ConversationHandlers"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            wrap_handler_callbacks(handler.entry_points, wrap)
+            for state_handlers in handler.states.values():
+                wrap_handler_callbacks(state_handlers, wrap)
+            wrap_handler_callbacks(handler.fallbacks, wrap)
+        else:
+            handler.callback = wrap(handler.callback)
+
+def pins_user_writes(handler):
+    """Pin the user's replica reads to the primary after any write the handler makes"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        with sticky_writes(update.effective_user.id if update.effective_user else None):
+            return await handler(update, context)
+    return wrapper
+
+def reads_from_replica(handler):
+    """Serve a read-heavy handler from the read replica unless the user wrote recently"""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        sticky_key = update.effective_user.id if update.effective_user else None
+        with replica_reads(sticky_key):
+            return await handler(update, context)
+    return wrapper
+
+def profile_changed(theUser, user):
+    """Check whether the Telegram name or username differs from the stored user"""
+    return theUser.telegram_username != user.username or theUser.telegram_full_name != user.full_name
+
+async def save_user(user):
+    """Get or create the Django user for a Telegram user, skipping the DB when the cached copy is current"""
+    cached = user_cache.get(user.id)
+    if cached is not None and not profile_changed(cached, user):
+        return cached
+    return await store_user(user, cached)
+
+@db_sync_to_async
+def store_user(user, cached=None):
+    if cached is not None:
+        # Write the profile change through the cache to the DB
+        User.objects.filter(pk=cached.pk).update(
+            telegram_username=user.username,
+            telegram_full_name=user.full_name
+        )
+        cached.telegram_username = user.username
+        cached.telegram_full_name = user.full_name
+        user_cache.set(user.id, cached)
+        return cached
+
     # Try to find existing user by telegram_id first
     try:
         theUser = User.objects.get(telegram_id=user.id)
         # Update user info if it has changed
-        if theUser.telegram_username != user.username or theUser.telegram_full_name != user.full_name:
+        if profile_changed(theUser, user):
             theUser.telegram_username = user.username
             theUser.telegram_full_name = user.full_name
             theUser.save()
@@ -63,103 +155,126 @@ def save_user(user):
         # Create a wallet for the new user
         Wallet.objects.create(user=theUser, balance=Decimal('0.00'))
         
-        # Create NOWPayments sub-partner account
-        try:
-            nowpayments_service = NOWPaymentsService()
-            user_data = {
-                'telegram_id': user.id,
-                'telegram_username': user.username,
-                'telegram_full_name': user.full_name,
-                'email': f"user_{user.id}@telegram.com",
-                'name': user.full_name or f"User {user.id}"
-            }
-            
-            sub_partner_response = nowpayments_service.create_sub_partner_account(user_data)
-            
-            if sub_partner_response and 'result' in sub_partner_response and 'id' in sub_partner_response['result']:
-                # Update user with sub-partner ID
-                sub_partner_id = sub_partner_response['result']['id']
-                theUser.nowpayments_sub_partner_id = sub_partner_id
-                theUser.save()
-                logger.info(f"Created NOWPayments sub-partner account for user {user.id}: {sub_partner_id}")
-            else:
-                logger.warning(f"Failed to create NOWPayments sub-partner account for user {user.id}")
-                
-        except Exception as e:
-            logger.error(f"Error creating NOWPayments sub-partner account for user {user.id}: {e}")
+        # Sub-partner accounts are created in the background by the provisioning queue
+        enqueue_sub_partner(theUser)
     
+    user_cache.set(user.id, theUser)
     return theUser
 
-@sync_to_async
-def get_user_wallet(user):
-    """Get or create user wallet"""
-    wallet, created = Wallet.objects.get_or_create(user=user, defaults={'balance': Decimal('0.00')})
-    return wallet
+@db_sync_to_async
+def get_wallet_summary(user):
+    """Get balance and transaction count for the user's wallet in a single query"""
+    summary = Wallet.objects.filter(user=user).values('balance', 'transaction_count').first()
+    if summary is None:
+        wallet, created = Wallet.objects.get_or_create(user=user, defaults={'balance': Decimal('0.00')})
+        summary = {'balance': wallet.balance, 'transaction_count': wallet.transaction_count}
+    return summary
 
-@sync_to_async
+@network_sync_to_async
 def get_available_currencies():
     """Get available cryptocurrencies from NOWPayments"""
     service = NOWPaymentsService()
     return service.get_available_currencies()
 
-@sync_to_async
+async def get_currency_keyboards():
+    """Currency keyboard pages, fetching the merchant coin list only when the cache expires"""
+    pages = currency_keyboards.cached_pages()
+    if pages is not None:
+        return pages
+
+    currencies = await get_available_currencies()
+    if not currencies or not isinstance(currencies, list):
+        # Fallback currencies if API is not available
+        logger.warning("NOWPayments API not available, using fallback currencies")
+        currencies = FALLBACK_CURRENCIES
+    return currency_keyboards.pages(currencies)
+
+@network_sync_to_async
 def create_payment(user, amount, currency):
     """Create a payment for user following NOWPayments official flow"""
     processor = PaymentProcessor()
     return processor.create_deposit_payment(user, amount, currency)
 
-@sync_to_async
-def get_user_payments(user):
-    """Get user's payment history"""
-    return Payment.objects.filter(user=user).order_by('-created_at')
-
-@sync_to_async
-def get_user_transactions(user):
-    """Get user's transaction history"""
-    return user.wallet.transactions.all()[:10]  # Last 10 transactions
-
-@sync_to_async
-def get_user_transaction_count(user):
-    """Get user's transaction count"""
-    return user.wallet.transactions.count()
-
-@sync_to_async
-def ensure_sub_partner_account(user):
-    """Ensure user has a NOWPayments sub-partner account"""
-    if not user.nowpayments_sub_partner_id:
+@db_sync_to_async
+def get_payment_page(user, cursor=None, direction='next', page_size=None, include_archived=False):
+    """Get one keyset page of the user's payment history"""
+    return payment_page(user, cursor, direction, page_size, include_archived)
+
+@db_sync_to_async
+def get_transaction_page(user, cursor=None, direction='next', include_archived=False):
+    """Get one keyset page of the user's transaction history"""
+    return transaction_page(user, cursor, direction, include_archived=include_archived)
+
+@db_sync_to_async
+def queue_sub_partner_account(user):
+    """Queue NOWPayments sub-partner account creation for users without one"""
+    enqueue_sub_partner(user)
+
+async def ensure_sub_partner_account(user):
+    """Make sure the user has a NOWPayments sub-partner ID, creating it now if needed"""
+    if user.nowpayments_sub_partner_id:
+        return True
+    return bool(await network_sync_to_async(wait_for_sub_partner)(user))
+
+async def process_sub_partner_queue(interval):
+    """Drain the sub-partner provisioning queue in the background"""
+    while True:
         try:
-            nowpayments_service = NOWPaymentsService()
-            user_data = {
-                'telegram_id': user.telegram_id,
-                'telegram_username': user.telegram_username,
-                'telegram_full_name': user.telegram_full_name,
-                'email': f"user_{user.telegram_id}@telegram.com",
-                'name': user.telegram_full_name or f"User {user.telegram_id}"
-            }
-            
-            sub_partner_response = nowpayments_service.create_sub_partner_account(user_data)
-            
-            if sub_partner_response and 'result' in sub_partner_response and 'id' in sub_partner_response['result']:
-                # Update user with sub-partner ID
-                sub_partner_id = sub_partner_response['result']['id']
-                user.nowpayments_sub_partner_id = sub_partner_id
-                user.save()
-                logger.info(f"Created NOWPayments sub-partner account for existing user {user.telegram_id}: {sub_partner_id}")
-                return True
-            else:
-                logger.warning(f"Failed to create NOWPayments sub-partner account for existing user {user.telegram_id}")
-                return False
-                
+            await network_sync_to_async(drain_sub_partner_jobs)()
         except Exception as e:
-            logger.error(f"Error creating NOWPayments sub-partner account for existing user {user.telegram_id}: {e}")
-            return False
-    return True
+            logger.error(f"Error processing sub-partner queue: {e}")
+        await asyncio.sleep(interval)
+
+@db_sync_to_async
+def get_notification_batch():
+    """Claim the next batch of queued notifications"""
+    return claim_notifications(settings.BOT_NOTIFICATION_BATCH_SIZE)
+
+@db_sync_to_async
+def record_notification_results(sent_ids, failures):
+    """Mark sent notifications and requeue (or give up on) failed ones"""
+    if sent_ids:
+        mark_sent(sent_ids)
+    for notification, error, retry in failures:
+        mark_failed(notification['id'], notification['attempts'], error, retry)
+
+async def send_notification(bot, notification):
+    """
+    Send one queued notification
+    Returns: (error, retry) on failure, None when sent
+    """
+    try:
+        await bot.send_message(chat_id=notification['chat_id'], text=notification['message'])
+        return None
+    except (Forbidden, BadRequest) as e:
+        # The user blocked the bot or the chat is gone; retrying will not help
+        return e, False
+    except TelegramError as e:
+        return e, True
+
+async def process_notification_queue(application, interval):
+    """Send queued notifications in batches; the rate limiter paces the sends"""
+    while True:
+        batch = []
+        try:
+            batch = await get_notification_batch()
+            if batch:
+                results = await asyncio.gather(*[send_notification(application.bot, n) for n in batch])
+                sent_ids = [n['id'] for n, result in zip(batch, results) if result is None]
+                failures = [(n, *result) for n, result in zip(batch, results) if result is not None]
+                await record_notification_results(sent_ids, failures)
+        except Exception as e:
+            logger.error(f"Error processing notification queue: {e}")
+        # Keep draining without waiting while the queue is backed up
+        if len(batch) < settings.BOT_NOTIFICATION_BATCH_SIZE:
+            await asyncio.sleep(interval)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await save_user(update.effective_user)
     
-    # Ensure user has NOWPayments sub-partner account
-    await ensure_sub_partner_account(user)
+    # Queue a NOWPayments sub-partner account if the user has none yet
+    if not user.nowpayments_sub_partner_id:
+        await queue_sub_partner_account(user)
     
     welcome_message = f"""
 🚀 Welcome to CryptoPayment Bot, {user.telegram_full_name}! 🚀
@@ -171,6 +286,7 @@ Available commands:
 /deposit - Add funds to your wallet (cryptocurrency)
 /transactions - View transaction history
 /payments - View payment history
+/payments all, /transactions all - Include archived history
 /help - Show this help message
 
 Get started by checking your balance with /balance!
@@ -178,20 +294,21 @@ Get started by checking your balance with /balance!
     
     await update.message.reply_text(welcome_message)
 
+@reads_from_replica
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await save_user(update.effective_user)
     
-    # Ensure user has NOWPayments sub-partner account
-    await ensure_sub_partner_account(user)
+    # Queue a NOWPayments sub-partner account if the user has none yet
+    if not user.nowpayments_sub_partner_id:
+        await queue_sub_partner_account(user)
     
-    wallet = await get_user_wallet(user)
-    transaction_count = await get_user_transaction_count(user)
+    summary = await get_wallet_summary(user)
     
     balance_message = f"""
 💰 Wallet Balance 💰
 
-Current Balance: ${wallet.balance}
-Total Transactions: {transaction_count}
+Current Balance: ${summary['balance']}
+Total Transactions: {summary['transaction_count']}
 
 Use /transactions to view your transaction history.
 Use /deposit to add funds to your wallet.
@@ -222,44 +339,8 @@ async def amount_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         context.user_data['deposit_amount'] = amount
         
-        # Get available currencies
-        currencies = await get_available_currencies()
-        
-        # Fallback currencies if API is not available
-        if not currencies:
-            logger.warning("NOWPayments API not available, using fallback currencies")
-            currencies = ['BTC', 'ETH', 'USDT', 'USDC', 'LTC', 'DOGE', 'BNBBSC', 'ADA', 'XRP', 'SOL', 'DOT', 'MATIC']
-        
-        # Debug: Log available currencies
-        logger.info(f"Available currencies: {currencies}")
-        
-        # Handle the merchant coins response format
-        if isinstance(currencies, list):
-            # Convert currency codes to lowercase for consistency
-            available_currencies = [currency.lower() for currency in currencies]
-        else:
-            # Fallback to popular currencies if API response is unexpected
-            available_currencies = ['btc', 'eth', 'usdt', 'usdc', 'ltc', 'doge', 'bnbbsc', 'ada', 'xrp', 'sol', 'dot', 'matic']
-        
-        # Create keyboard with available currencies
-        keyboard = []
-        row = []
-        
-        # Add all available currencies to the keyboard
-        for currency in available_currencies:
-            row.append(InlineKeyboardButton(
-                currency.upper(), 
-                callback_data=f"currency_{currency}"
-            ))
-            if len(row) == 3:
-                keyboard.append(row)
-                row = []
-        
-        # Add any remaining currencies in the last row
-        if row:
-            keyboard.append(row)
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Cached keyboards for the merchant coin list, popular coins first
+        reply_markup = (await get_currency_keyboards())[0]
         
         await update.message.reply_text(
             f"💱 Select Payment Currency 💱\n\n"
@@ -273,13 +354,24 @@ async def amount_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Please enter a valid number!")
         return CHOOSING_AMOUNT
 
+async def currency_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show another page of the currency keyboard"""
+    query = update.callback_query
+    await query.answer()
+
+    pages = await get_currency_keyboards()
+    index = min(int(query.data.replace('curpage_', '')), len(pages) - 1)
+    await query.edit_message_reply_markup(reply_markup=pages[index])
+    return CHOOSING_CURRENCY
+
 async def currency_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle currency selection and create payment following NOWPayments official flow"""
     query = update.callback_query
     await query.answer()
     
     currency = query.data.replace('currency_', '')
-    amount = context.user_data.get('deposit_amount')
+    # Every path below ends the conversation, so drop the amount from the persisted user data
+    amount = context.user_data.pop('deposit_amount', None)
     
     if not amount:
         await query.edit_message_text("❌ Error: Amount not found. Please start over with /deposit")
@@ -301,10 +393,6 @@ async def currency_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(f"❌ {error_msg}")
         return ConversationHandler.END
     
-    # Generate QR code
-    processor = PaymentProcessor()
-    payment_info = processor.get_payment_info(payment)
-    
     # Create payment message with enhanced information
     payment_message = f"""
 💳 Payment Created Successfully! 💳
@@ -326,75 +414,133 @@ Use /payments to check payment status.
     
     await query.edit_message_text(payment_message, parse_mode='Markdown')
     
-    # Send QR code if available
-    if payment_info['qr_code']:
-        try:
-            qr_image = base64.b64decode(payment_info['qr_code'])
-            await context.bot.send_photo(
-                chat_id=query.from_user.id,
-                photo=io.BytesIO(qr_image),
-                caption="📱 Scan this QR code to pay"
-            )
-        except Exception as e:
-            logger.error(f"Error sending QR code: {e}")
+    # Render the QR code on the worker pool and send the PNG bytes as-is
+    try:
+        qr_image = await qr_renderer.render(payment.payment_address, payment.crypto_amount, payment.currency)
+        await context.bot.send_photo(
+            chat_id=query.from_user.id,
+            photo=qr_image,
+            caption="📱 Scan this QR code to pay"
+        )
+    except Exception as e:
+        logger.error(f"Error sending QR code: {e}")
     
     return ConversationHandler.END
 
+PAYMENT_STATUS_EMOJI = {
+    'PENDING': '⏳',
+    'CONFIRMING': '🔄',
+    'CONFIRMED': '✅',
+    'FINISHED': '✅',
+    'FAILED': '❌',
+    'EXPIRED': '⏰',
+    'REFUNDED': '↩️'
+}
+PAYMENT_STATUS_LABELS = dict(Payment.PAYMENT_STATUS)
+TRANSACTION_TYPE_LABELS = dict(Transaction.TRANSACTION_TYPES)
+
+def format_crypto_amount(row):
+    """Crypto amount with currency, or N/A before NOWPayments has quoted one"""
+    if row['crypto_amount'] is None:
+        return 'N/A'
+    return f"{row['crypto_amount']:.8f} {row['currency'].upper()}"
+
+def format_payment_page(rows):
+    message = "📊 Payment History 📊\n\n"
+    for payment in rows:
+        message += f"""
+{PAYMENT_STATUS_EMOJI.get(payment['status'], '❓')} Payment {payment['payment_id']}
+💰 Amount: ${payment['amount_usd']}
+🪙 Crypto: {format_crypto_amount(payment)}
+📊 Status: {PAYMENT_STATUS_LABELS.get(payment['status'], payment['status'])}
+📅 Date: {payment['created_at'].strftime('%Y-%m-%d %H:%M')}
+        """
+    return message
+
+def format_transaction_page(rows):
+    message = "📊 Transaction History 📊\n\n"
+    for transaction in rows:
+        emoji = "💰" if transaction['amount'] > 0 else "💸"
+        message += f"""
+{emoji} {TRANSACTION_TYPE_LABELS.get(transaction['transaction_type'], transaction['transaction_type'])}
+Amount: ${transaction['amount']}
+Balance After: ${transaction['balance_after']}
+Date: {transaction['created_at'].strftime('%Y-%m-%d %H:%M')}
+        """
+    return message
+
+def history_keyboard(kind, prev_cursor, next_cursor):
+    """Previous/next buttons carrying keyset cursors in their callback data"""
+    buttons = []
+    if prev_cursor:
+        buttons.append(InlineKeyboardButton("⬅️ Newer", callback_data=f"{kind}:prev:{prev_cursor}"))
+    if next_cursor:
+        buttons.append(InlineKeyboardButton("Older ➡️", callback_data=f"{kind}:next:{next_cursor}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def history_kind(history, include_archived):
+    """Callback data prefix of a history page; "_all" pages include archived rows"""
+    return f"{history}_all" if include_archived else history
+
+HISTORY_PAGES = {
+    'payments': (get_payment_page, format_payment_page),
+    'transactions': (get_transaction_page, format_transaction_page),
+}
+
+def wants_archived(context):
+    """True for "/payments all" and "/transactions all", which include archived history"""
+    return bool(context.args) and context.args[0].lower() == 'all'
+
+@reads_from_replica
 async def payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show user's payment history"""
     user = await save_user(update.effective_user)
-    payments = await get_user_payments(user)
+    include_archived = wants_archived(context)
+    rows, prev_cursor, next_cursor = await get_payment_page(user, include_archived=include_archived)
     
-    if not payments:
+    if not rows:
         await update.message.reply_text("No payment history found. Use /deposit to make your first payment!")
         return
     
-    message = "📊 Payment History 📊\n\n"
-    
-    for payment in payments[:5]:  # Show last 5 payments
-        status_emoji = {
-            'PENDING': '⏳',
-            'CONFIRMING': '🔄',
-            'CONFIRMED': '✅',
-            'FINISHED': '✅',
-            'FAILED': '❌',
-            'EXPIRED': '⏰',
-            'REFUNDED': '↩️'
-        }.get(payment.status, '❓')
-        
-        message += f"""
-{status_emoji} Payment {payment.payment_id}
-💰 Amount: ${payment.amount_usd}
-🪙 Crypto: {payment.crypto_amount:.8f} {payment.currency.upper()}
-📊 Status: {payment.get_status_display()}
-📅 Date: {payment.created_at.strftime('%Y-%m-%d %H:%M')}
-        """
-    
-    if len(payments) > 5:
-        message += f"\n... and {len(payments) - 5} more payments"
-    
-    await update.message.reply_text(message)
+    await update.message.reply_text(
+        format_payment_page(rows),
+        reply_markup=history_keyboard(history_kind('payments', include_archived), prev_cursor, next_cursor)
+    )
 
+@reads_from_replica
 async def transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await save_user(update.effective_user)
-    transactions = await get_user_transactions(user)
+    include_archived = wants_archived(context)
+    rows, prev_cursor, next_cursor = await get_transaction_page(user, include_archived=include_archived)
     
-    if not transactions:
+    if not rows:
         await update.message.reply_text("No transactions found.")
         return
     
-    message = "📊 Transaction History 📊\n\n"
+    await update.message.reply_text(
+        format_transaction_page(rows),
+        reply_markup=history_keyboard(history_kind('transactions', include_archived), prev_cursor, next_cursor)
+    )
+
+@reads_from_replica
+async def history_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle next/previous buttons on /payments and /transactions"""
+    query = update.callback_query
+    await query.answer()
     
-    for transaction in transactions:
-        emoji = "💰" if transaction.amount > 0 else "💸"
-        message += f"""
-{emoji} {transaction.get_transaction_type_display()}
-Amount: ${transaction.amount}
-Balance After: ${transaction.balance_after}
-Date: {transaction.created_at.strftime('%Y-%m-%d %H:%M')}
-        """
+    kind, direction, cursor = query.data.split(':', 2)
+    history, _, scope = kind.partition('_')
+    load_page, format_page = HISTORY_PAGES[history]
     
-    await update.message.reply_text(message)
+    user = await save_user(query.from_user)
+    rows, prev_cursor, next_cursor = await load_page(user, cursor, direction, include_archived=scope == 'all')
+    if not rows:
+        return
+    
+    await query.edit_message_text(
+        format_page(rows),
+        reply_markup=history_keyboard(kind, prev_cursor, next_cursor)
+    )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_message = """
@@ -406,6 +552,7 @@ Available Commands:
 /deposit - Add funds to your wallet (cryptocurrency)
 /transactions - View transaction history
 /payments - View payment history
+/payments all, /transactions all - Include archived history
 /status - Check recent payment status
 /help - Show this help message
 
@@ -422,46 +569,122 @@ Supported cryptocurrencies: BTC, ETH, USDT, USDC, LTC, DOGE, and more!
     
     await update.message.reply_text(help_message)
 
+@reads_from_replica
 async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check payment status manually (Step 8 of NOWPayments flow)"""
     user = await save_user(update.effective_user)
     
-    # Get user's recent payments
-    payments = await get_user_payments(user)
+    # Get user's 3 most recent payments
+    rows, _, _ = await get_payment_page(user, page_size=3)
     
-    if not payments:
+    if not rows:
         await update.message.reply_text("No payments found. Use /deposit to make your first payment!")
         return
     
-    # Show last 3 payments with status
     message = "📊 Recent Payment Status 📊\n\n"
     
-    for payment in payments[:3]:
-        status_emoji = {
-            'PENDING': '⏳',
-            'CONFIRMING': '🔄',
-            'CONFIRMED': '✅',
-            'FINISHED': '✅',
-            'FAILED': '❌',
-            'EXPIRED': '⏰',
-            'REFUNDED': '↩️'
-        }.get(payment.status, '❓')
-        
+    for payment in rows:
         message += f"""
-{status_emoji} Payment {str(payment.payment_id)[:8]}...
-💰 Amount: ${payment.amount_usd}
-🪙 Crypto: {payment.crypto_amount:.8f} {payment.currency.upper() if payment.crypto_amount else 'N/A'}
-📊 Status: {payment.get_status_display()}
-📅 Date: {payment.created_at.strftime('%Y-%m-%d %H:%M')}
+{PAYMENT_STATUS_EMOJI.get(payment['status'], '❓')} Payment {str(payment['payment_id'])[:8]}...
+💰 Amount: ${payment['amount_usd']}
+🪙 Crypto: {format_crypto_amount(payment)}
+📊 Status: {PAYMENT_STATUS_LABELS.get(payment['status'], payment['status'])}
+📅 Date: {payment['created_at'].strftime('%Y-%m-%d %H:%M')}
         """
     
     await update.message.reply_text(message)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the conversation"""
+    context.user_data.pop('deposit_amount', None)
     await update.message.reply_text("❌ Operation cancelled.")
     return ConversationHandler.END
 
+async def post_init(application: Application) -> None:
+    """Start background workers once the bot is initialised"""
+    if settings.SUB_PARTNER_WORKER_INTERVAL:
+        background_tasks.append(
+            asyncio.create_task(process_sub_partner_queue(settings.SUB_PARTNER_WORKER_INTERVAL))
+        )
+    if settings.BOT_NOTIFICATION_INTERVAL:
+        background_tasks.append(
+            asyncio.create_task(process_notification_queue(application, settings.BOT_NOTIFICATION_INTERVAL))
+        )
+
+async def post_shutdown(application: Application) -> None:
+    """Stop background workers"""
+    while background_tasks:
+        background_tasks.pop().cancel()
+    qr_renderer.shutdown()
+    shutdown_executors(wait=False)
+
+def build_application(polling: bool = True, persistence: DjangoPersistence = None, token: str = None,
+                      request=None, rate_limits: bool = True, update_processor=None) -> Application:
+    """
+    Create the bot Application with all handlers registered.
+    polling=False builds it without an Updater, for updates fed in by the webhook view
+    or a sharded bot worker. request replaces the HTTP client for Bot API calls (the
+    loadtest command uses a stub); rate_limits=False skips inbound and outbound throttling.
+    update_processor replaces the PerUserUpdateProcessor (the loadtest measures through one).
+    """
+    builder = (
+        Application.builder()
+        .token(token or BOT_TOKEN)
+        .persistence(persistence or DjangoPersistence())
+    )
+    if request is not None:
+        builder = builder.request(request)
+    if update_processor is None and settings.BOT_CONCURRENT_UPDATES > 1:
+        update_processor = PerUserUpdateProcessor(settings.BOT_CONCURRENT_UPDATES)
+    if update_processor is not None:
+        builder = builder.concurrent_updates(update_processor)
+    if rate_limits:
+        builder = builder.rate_limiter(build_rate_limiter())
+    if polling:
+        builder = builder.post_init(post_init).post_shutdown(post_shutdown)
+    else:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Create conversation handler for deposit flow
+    deposit_handler = ConversationHandler(
+        entry_points=[CommandHandler("deposit", deposit)],
+        states={
+            CHOOSING_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, amount_received)],
+            CHOOSING_CURRENCY: [
+                CallbackQueryHandler(currency_selected, pattern="^currency_"),
+                CallbackQueryHandler(currency_page, pattern=r"^curpage_\d+$")
+            ]
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="deposit",
+        persistent=True
+    )
+
+    # Drop floods and repeated taps before any handler touches the DB
+    if rate_limits:
+        application.add_handler(TypeHandler(Update, build_inbound_throttle()), group=-1)
+
+    # Add command handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("balance", balance))
+    application.add_handler(deposit_handler)
+    application.add_handler(CommandHandler("payments", payments))
+    application.add_handler(CommandHandler("transactions", transactions))
+    application.add_handler(CallbackQueryHandler(history_page, pattern="^(payments|transactions)(_all)?:(prev|next):"))
+    application.add_handler(CommandHandler("status", check_payment_status))
+    application.add_handler(CommandHandler("help", help_command))
+
+    # The throttle in group -1 is not a handler users see
+    for group, handlers in application.handlers.items():
+        if group >= 0:
+            # A deposit or a new account must show up in the user's next /payments or /balance
+            wrap_handler_callbacks(handlers, pins_user_writes)
+            wrap_handler_callbacks(handlers, observe_handler)
+            if settings.QUERY_PROFILER_ENABLED:
+                wrap_handler_callbacks(handlers, profile_handler)
+    return application
+
 def main() -> None:
     """Start the bot."""
     if not BOT_TOKEN:
@@ -470,26 +693,7 @@ def main() -> None:
     
     try:
         # Create the Application and pass it your bot's token.
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        # Create conversation handler for deposit flow
-        deposit_handler = ConversationHandler(
-            entry_points=[CommandHandler("deposit", deposit)],
-            states={
-                CHOOSING_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, amount_received)],
-                CHOOSING_CURRENCY: [CallbackQueryHandler(currency_selected, pattern="^currency_")]
-            },
-            fallbacks=[CommandHandler("cancel", cancel)]
-        )
-        
-        # Add command handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("balance", balance))
-        application.add_handler(deposit_handler)
-        application.add_handler(CommandHandler("payments", payments))
-        application.add_handler(CommandHandler("transactions", transactions))
-        application.add_handler(CommandHandler("status", check_payment_status))
-        application.add_handler(CommandHandler("help", help_command))
+        application = build_application()
 
         logger.info("CryptoPayment bot started successfully")
         # Run the bot until the user presses Ctrl-C
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import threading
+import time
+
+from django.db import connections
+from django.utils import timezone
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from app_account.models import User
+from .checkpoints import Watermark
+from .db import db_sync_to_async
+from .models import Broadcast
+
+logger = logging.getLogger(__name__)
+
+
+def broadcast_recipients(after_user_id=0):
+    """(pk, telegram_id) of active Telegram users after a checkpoint, in pk order"""
+    return (
+        User.objects.filter(pk__gt=after_user_id, is_active=True, telegram_id__isnull=False)
+        .order_by('pk').values_list('pk', 'telegram_id')
+    )
+
+
+@db_sync_to_async
+def save_progress(broadcast_id, last_user_id, sent, failed, done=False):
+    """Checkpoint a running broadcast"""
+    fields = {'last_user_id': last_user_id, 'sent_count': sent, 'failed_count': failed}
+    if done:
+        fields.update(status='DONE', finished_at=timezone.now())
+    Broadcast.objects.filter(pk=broadcast_id).update(updated_at=timezone.now(), **fields)
+
+
+class BroadcastRunner:
+    """
+    Sends a broadcast to all users: a thread streams recipients from the database
+    with .iterator() into a bounded queue, and async workers send through the bot's
+    rate limiter (per-chat and global limits, 429 retries). Progress is checkpointed
+    every report_interval seconds and reported through on_progress.
+    """
+
+    def __init__(self, broadcast, bot, concurrency=20, chunk_size=2000, report_interval=5.0, on_progress=None):
+        self.broadcast = broadcast
+        self.bot = bot
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.report_interval = report_interval
+        self.on_progress = on_progress
+        self.sent = broadcast.sent_count
+        self.failed = broadcast.failed_count
+        self.watermark = Watermark(broadcast.last_user_id)
+        self.started = time.monotonic()
+        self.sent_this_run = 0
+        self.producer_error = None
+
+    def stream_recipients(self, queue, loop):
+        """Producer thread; blocks while the queue is full"""
+        try:
+            for recipient in broadcast_recipients(self.broadcast.last_user_id).iterator(chunk_size=self.chunk_size):
+                asyncio.run_coroutine_threadsafe(queue.put(recipient), loop).result()
+        except Exception as e:
+            logger.error(f"Broadcast {self.broadcast.pk} stopped reading recipients: {e}")
+            self.producer_error = e
+        finally:
+            connections.close_all()
+            for _ in range(self.concurrency):
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+    async def send(self, chat_id):
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=self.broadcast.message)
+            return True
+        except (Forbidden, BadRequest):
+            # Blocked the bot or deleted the chat
+            return False
+        except TelegramError as e:
+            logger.warning(f"Broadcast {self.broadcast.pk} failed for chat {chat_id}: {e}")
+            return False
+
+    async def worker(self, queue):
+        while True:
+            recipient = await queue.get()
+            if recipient is None:
+                return
+            pk, chat_id = recipient
+            # Queue waiters are served in order, so this records recipients in pk order
+            self.watermark.dispatched(pk)
+            if await self.send(chat_id):
+                self.sent += 1
+                self.sent_this_run += 1
+            else:
+                self.failed += 1
+            self.watermark.finished(pk)
+
+    def progress(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'last_user_id': self.watermark.value,
+            'elapsed': elapsed,
+            'rate': self.sent_this_run / elapsed if elapsed else 0.0,
+        }
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            await save_progress(self.broadcast.pk, self.watermark.value, self.sent, self.failed)
+            if self.on_progress:
+                self.on_progress(self.progress())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        producer = threading.Thread(target=self.stream_recipients, args=(queue, loop), daemon=True)
+        producer.start()
+
+        reporter = asyncio.create_task(self.report())
+        finished = False
+        try:
+            await asyncio.gather(*[self.worker(queue) for _ in range(self.concurrency)])
+            finished = self.producer_error is None
+        finally:
+            reporter.cancel()
+            await save_progress(self.broadcast.pk, self.watermark.value, self.sent, self.failed, done=finished)
+        return self.progress()
@@ -0,0 +1,40 @@
+from collections import deque
+
+from .models import CommandCheckpoint
+
+
+class Watermark:
+    """
+    Highest primary key below which every dispatched row is finished, although
+    concurrent workers complete out of order; this is what gets checkpointed
+    """
+
+    def __init__(self, start):
+        self.value = start
+        self._dispatched = deque()
+        self._finished = set()
+
+    def dispatched(self, pk):
+        self._dispatched.append(pk)
+
+    def finished(self, pk):
+        self._finished.add(pk)
+        while self._dispatched and self._dispatched[0] in self._finished:
+            self.value = self._dispatched.popleft()
+            self._finished.discard(self.value)
+
+
+def load_checkpoint(name):
+    """Saved (position, data) for a command, (0, {}) if it has none"""
+    checkpoint = CommandCheckpoint.objects.filter(name=name).first()
+    if checkpoint is None:
+        return 0, {}
+    return checkpoint.position, checkpoint.data
+
+
+def save_checkpoint(name, position, data=None):
+    CommandCheckpoint.objects.update_or_create(name=name, defaults={'position': position, 'data': data or {}})
+
+
+def clear_checkpoint(name):
+    CommandCheckpoint.objects.filter(name=name).delete()
@@ -0,0 +1,83 @@
+import functools
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .executors import get_executor
+
+
+def sqlite_pragma_statements(pragmas):
+    """Build PRAGMA statements from a {name: value} mapping"""
+    return [f"PRAGMA {name} = {value}" for name, value in pragmas.items()]
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    connection_created hook that applies settings.SQLITE_PRAGMAS to every new SQLite
+    connection, so the bot and web processes share the same concurrency profile
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if not pragmas:
+        return
+    for statement in sqlite_pragma_statements(pragmas):
+        connection.connection.execute(statement)
+
+
+def recycle_connections():
+    """
+    Like django.db.close_old_connections(), but never closes a connection inside an
+    atomic block (e.g. when bot helpers are called from a test case's transaction).
+    Unpooled connections with CONN_MAX_AGE=0 (the SQLite profile) would otherwise be
+    reopened, PRAGMAs and all, on every call; the bot's long-lived threads keep them
+    for BOT_DB_CONN_MAX_AGE seconds instead, closing them early only after an error.
+    """
+    for conn in connections.all(initialized_only=True):
+        if conn.in_atomic_block:
+            continue
+        if conn.settings_dict['CONN_MAX_AGE'] == 0 and not conn.settings_dict['OPTIONS'].get('pool'):
+            # With CONN_MAX_AGE=0, close_at is the time the connection was opened
+            if conn.connection is not None and (
+                conn.errors_occurred or time.monotonic() >= conn.close_at + settings.BOT_DB_CONN_MAX_AGE
+            ):
+                conn.close()
+            continue
+        conn.close_if_unusable_or_obsolete()
+
+
+def pooled_sync_to_async(func, pool):
+    """
+    sync_to_async that runs func on one of the bot's thread pools (app_bot.executors).
+    Every pool thread keeps its own Django connection, so stale or broken connections
+    are closed and pooled ones returned around every call (see recycle_connections);
+    Django only does this around web requests.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recycle_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            recycle_connections()
+
+    @functools.wraps(func)
+    async def run(*args, **kwargs):
+        executor = get_executor(pool)
+        if executor is None:
+            return await sync_to_async(wrapper)(*args, **kwargs)
+        return await sync_to_async(wrapper, thread_sensitive=False, executor=executor)(*args, **kwargs)
+
+    return run
+
+
+def db_sync_to_async(func):
+    """sync_to_async for ORM work from the bot, run on the BOT_DB_WORKERS pool"""
+    return pooled_sync_to_async(func, 'db')
+
+
+def network_sync_to_async(func):
+    """sync_to_async for blocking NOWPayments calls, run on the BOT_NETWORK_WORKERS pool"""
+    return pooled_sync_to_async(func, 'network')
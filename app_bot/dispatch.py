@@ -0,0 +1,43 @@
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+
+def update_owner(update):
+    """ID of the user an update belongs to (its chat when there is no user), or None"""
+    owner = getattr(update, 'effective_user', None) or getattr(update, 'effective_chat', None)
+    return owner.id if owner else None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Handles up to max_concurrent_updates updates at once, but one user's updates one at a
+    time and in arrival order, so ConversationHandler states and per-user data never race.
+    A user's queued updates hold a slot while they wait for that user's previous update.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # owner -> [lock, updates holding or waiting for it]
+        self._locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        owner = update_owner(update)
+        if owner is None:
+            await coroutine
+            return
+        entry = self._locks.setdefault(owner, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[owner]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
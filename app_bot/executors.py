@@ -0,0 +1,41 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executors = {}
+_lock = threading.Lock()
+
+# name -> (setting with the pool size, thread name prefix)
+POOLS = {
+    'db': ('BOT_DB_WORKERS', 'bot-db'),
+    'network': ('BOT_NETWORK_WORKERS', 'bot-net'),
+}
+
+
+def get_executor(name):
+    """
+    Shared thread pool for bot work of one kind ('db' or 'network').
+    Returns None when its size setting is 0, meaning run on asgiref's single
+    thread-sensitive thread as before.
+    """
+    setting, prefix = POOLS[name]
+    workers = getattr(settings, setting, 0)
+    if not workers:
+        return None
+    executor = _executors.get(name)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=prefix)
+    return executor
+
+
+def shutdown_executors(wait=True):
+    """Stop the bot's thread pools"""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,405 @@
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import random
+import re
+import secrets
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from .throttling import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# USD price of each coin the fake merchant accepts
+RATES = {
+    'btc': Decimal('60000'), 'eth': Decimal('3000'), 'usdt': Decimal('1'), 'usdc': Decimal('1'),
+    'ltc': Decimal('80'), 'doge': Decimal('0.15'), 'bnbbsc': Decimal('600'), 'ada': Decimal('0.45'),
+    'xrp': Decimal('0.6'), 'sol': Decimal('150'), 'dot': Decimal('7'), 'matic': Decimal('0.7'),
+}
+# Smallest accepted deposit in USD, converted to coin units by /min-amount
+MIN_AMOUNT_USD = Decimal('1')
+# (method, path under /v1, handler) for the endpoints NOWPaymentsService calls
+ROUTES = [
+    ('POST', r'auth', 'auth'),
+    ('GET', r'merchant/coins', 'merchant_coins'),
+    ('GET', r'currencies/(?P<currency>[^/]+)', 'currency'),
+    ('GET', r'min-amount', 'min_amount'),
+    ('GET', r'estimate', 'estimate'),
+    ('POST', r'sub-partner(/balance)?', 'create_sub_partner'),
+    ('GET', r'sub-partner/balance/(?P<sub_partner_id>[^/]+)', 'sub_partner_balance'),
+    ('POST', r'sub-partner/payment', 'create_payment'),
+    ('GET', r'payment/(?P<payment_id>[^/]+)', 'payment'),
+    ('GET', r'payment', 'payments'),
+]
+# Order in which payments move when IPN auto-completion is on
+STATUS_FLOW = ['confirming', 'confirmed', 'finished']
+
+
+def ipn_signature(payload, secret):
+    """NOWPayments x-nowpayments-sig: HMAC-SHA512 of the key-sorted JSON body"""
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hmac.new(secret.encode(), body.encode(), hashlib.sha512).hexdigest()
+
+
+def coin_amount(amount_usd, currency):
+    """USD amount converted to coin units at the fake rate"""
+    return (Decimal(str(amount_usd)) / RATES[currency]).quantize(Decimal('0.00000001'))
+
+
+class FaultInjector:
+    """
+    Latency, random 500s and a global request rate limit (429 with Retry-After)
+    applied to every API request the fake serves
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+        return self.latency + jitter
+
+    def fault(self):
+        """
+        Injected failure for the next request, if any
+        Returns: (status, body, headers) or None
+        """
+        with self._lock:
+            if self.bucket and not self.bucket.try_take(time.monotonic()):
+                return 429, {'statusCode': 429, 'code': 'TOO_MANY_REQUESTS', 'message': 'Rate limit exceeded'}, \
+                    {'Retry-After': '1'}
+            if self.error_rate and self._random.random() < self.error_rate:
+                return 500, {'statusCode': 500, 'code': 'INTERNAL_ERROR', 'message': 'Injected failure'}, {}
+        return None
+
+
+class FakeNOWPayments:
+    """
+    In-memory NOWPayments account: sub-partners, payments and JWT tokens.
+    Status changes are posted to ipn_url like the real IPN callbacks.
+    """
+
+    def __init__(self, api_key=None, ipn_url=None, ipn_secret=None, ipn_delay=None):
+        self.api_key = api_key
+        self.ipn_url = ipn_url
+        self.ipn_secret = ipn_secret
+        self.ipn_delay = ipn_delay
+        self.tokens = set()
+        self.sub_partners = {}
+        self.payments = {}
+        self.ipn_sent = 0
+        self.ipn_failed = 0
+        self._ids = itertools.count(5_000_000_000)
+        self._lock = threading.Lock()
+
+    def issue_token(self):
+        token = secrets.token_hex(24)
+        with self._lock:
+            self.tokens.add(token)
+        return token
+
+    def create_sub_partner(self, name):
+        with self._lock:
+            sub_partner_id = str(next(self._ids))
+            self.sub_partners[sub_partner_id] = {'id': sub_partner_id, 'name': name, 'balances': {}}
+        return self.sub_partners[sub_partner_id]
+
+    def create_payment(self, currency, amount, sub_partner_id):
+        """Payment for amount coins; returns the API's 'result' object"""
+        with self._lock:
+            payment_id = str(next(self._ids))
+            payment = {
+                'payment_id': payment_id,
+                'payment_status': 'waiting',
+                'pay_address': f"fake{currency}{secrets.token_hex(16)}",
+                'payin_extra_id': None,
+                'price_amount': str((Decimal(amount) * RATES[currency]).quantize(Decimal('0.01'))),
+                'price_currency': 'usd',
+                'pay_amount': float(amount),
+                'actually_paid': 0,
+                'pay_currency': currency,
+                'sub_partner_id': sub_partner_id,
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+            }
+            self.payments[payment_id] = payment
+        if self.ipn_url and self.ipn_delay is not None:
+            self.schedule_completion(payment_id)
+        return dict(payment)
+
+    def set_status(self, payment_id, status):
+        """Move a payment to status and send its IPN; returns the payment or None"""
+        with self._lock:
+            payment = self.payments.get(payment_id)
+            if payment is None:
+                return None
+            payment['payment_status'] = status
+            if status in ('confirmed', 'finished'):
+                payment['actually_paid'] = payment['pay_amount']
+            payment = dict(payment)
+        self.send_ipn(payment)
+        return payment
+
+    def schedule_completion(self, payment_id):
+        """Walk a new payment through STATUS_FLOW, ipn_delay seconds per step"""
+        def run():
+            for status in STATUS_FLOW:
+                time.sleep(self.ipn_delay)
+                self.set_status(payment_id, status)
+        threading.Thread(target=run, daemon=True, name=f"fake-ipn-{payment_id}").start()
+
+    def send_ipn(self, payment):
+        """POST a payment's state to ipn_url"""
+        if not self.ipn_url:
+            return False
+        headers = {'Content-Type': 'application/json'}
+        if self.ipn_secret:
+            headers['x-nowpayments-sig'] = ipn_signature(payment, self.ipn_secret)
+        try:
+            response = requests.post(self.ipn_url, json=payment, headers=headers, timeout=10)
+            delivered = response.status_code < 300
+        except requests.RequestException as e:
+            logger.warning(f"IPN for payment {payment['payment_id']} failed: {e}")
+            delivered = False
+        with self._lock:
+            if delivered:
+                self.ipn_sent += 1
+            else:
+                self.ipn_failed += 1
+        return delivered
+
+
+class FakeNOWPaymentsHandler(BaseHTTPRequestHandler):
+    """Routes the /v1 endpoints NOWPaymentsService uses, plus /_fake control endpoints"""
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def account(self):
+        return self.server.account
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.body = self.read_body()
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts[:1] == ['_fake']:
+            return self.control(method, parts[1:])
+        if parts[:1] != ['v1']:
+            return self.respond(404, {'message': 'Not found'})
+
+        fault = self.server.faults.fault()
+        delay = self.server.faults.delay()
+        if delay:
+            time.sleep(delay)
+        if fault:
+            return self.respond(*fault)
+
+        path = '/'.join(parts[1:])
+        for route_method, pattern, name in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                return getattr(self, name)(**match.groupdict())
+        self.respond(404, {'message': f"Unknown endpoint {method} {url.path}"})
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if not raw:
+            return {}
+        if 'application/json' in (self.headers.get('Content-Type') or ''):
+            try:
+                return json.loads(raw)
+            except ValueError:
+                return {}
+        return {key: values[-1] for key, values in parse_qs(raw.decode()).items()}
+
+    def respond(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def api_key_ok(self):
+        key = self.headers.get('x-api-key')
+        if not key or (self.account.api_key and key != self.account.api_key):
+            self.respond(403, {'statusCode': 403, 'code': 'INVALID_API_KEY', 'message': 'Invalid api key'})
+            return False
+        return True
+
+    def bearer_ok(self):
+        header = self.headers.get('Authorization') or ''
+        if header.startswith('Bearer ') and header[7:] in self.account.tokens:
+            return True
+        self.respond(401, {'statusCode': 401, 'code': 'AUTH_REQUIRED', 'message': 'Authorization header is required'})
+        return False
+
+    def auth(self):
+        if not self.body.get('email') or not self.body.get('password'):
+            return self.respond(400, {'message': 'email and password are required'})
+        self.respond(200, {'token': self.account.issue_token()})
+
+    def merchant_coins(self):
+        if self.api_key_ok():
+            self.respond(200, {'selectedCurrencies': [currency.upper() for currency in RATES]})
+
+    def currency(self, currency):
+        if not self.api_key_ok():
+            return
+        currency = currency.lower()
+        if currency not in RATES:
+            return self.respond(404, {'message': f"Currency {currency} not found"})
+        self.respond(200, {'currency': {'code': currency.upper(), 'name': currency.upper(), 'enable': True}})
+
+    def min_amount(self):
+        if not self.api_key_ok():
+            return
+        currency = self.query.get('currency_from', '').lower()
+        if currency not in RATES:
+            return self.respond(400, {'message': f"Currency {currency} is not supported"})
+        self.respond(200, {
+            'currency_from': currency,
+            'currency_to': self.query.get('currency_to', currency).lower(),
+            'min_amount': float(coin_amount(MIN_AMOUNT_USD, currency)),
+            'fiat_equivalent': float(MIN_AMOUNT_USD),
+        })
+
+    def estimate(self):
+        if not self.api_key_ok():
+            return
+        currency = self.query.get('currency_to', '').lower()
+        try:
+            amount = Decimal(self.query.get('amount', ''))
+        except ArithmeticError:
+            return self.respond(400, {'message': 'amount must be a number'})
+        if currency not in RATES:
+            return self.respond(400, {'message': f"Currency {currency} is not supported"})
+        self.respond(200, {
+            'currency_from': self.query.get('currency_from', 'usd'),
+            'amount_from': float(amount),
+            'currency_to': currency,
+            'estimated_amount': str(coin_amount(amount, currency)),
+        })
+
+    def create_sub_partner(self):
+        if not self.bearer_ok():
+            return
+        name = self.body.get('name')
+        if not name:
+            return self.respond(400, {'message': 'name is required'})
+        self.respond(200, {'result': self.account.create_sub_partner(name)})
+
+    def sub_partner_balance(self, sub_partner_id):
+        if not self.bearer_ok():
+            return
+        sub_partner = self.account.sub_partners.get(sub_partner_id)
+        if sub_partner is None:
+            return self.respond(404, {'message': 'Sub-partner not found'})
+        self.respond(200, {'result': {'subPartnerId': sub_partner['id'], 'balances': sub_partner['balances']}})
+
+    def create_payment(self):
+        if not self.api_key_ok():
+            return
+        currency = (self.body.get('currency') or '').lower()
+        if currency not in RATES:
+            return self.respond(400, {'message': f"Currency {currency} is not supported"})
+        if self.body.get('sub_partner_id') not in self.account.sub_partners:
+            return self.respond(400, {'message': 'Unknown sub_partner_id'})
+        try:
+            amount = Decimal(self.body.get('amount', ''))
+        except ArithmeticError:
+            return self.respond(400, {'message': 'amount must be a number'})
+        self.respond(201, {'result': self.account.create_payment(currency, amount, self.body['sub_partner_id'])})
+
+    def payment(self, payment_id):
+        if not self.api_key_ok():
+            return
+        payment = self.account.payments.get(payment_id)
+        if payment is None:
+            return self.respond(404, {'message': 'Payment not found'})
+        self.respond(200, payment)
+
+    def payments(self):
+        if not self.api_key_ok():
+            return
+        limit = int(self.query.get('limit', 10))
+        offset = int(self.query.get('offset', 0))
+        payments = list(self.account.payments.values())
+        self.respond(200, {'data': payments[offset:offset + limit], 'limit': limit, 'total': len(payments)})
+
+    def control(self, method, parts):
+        """
+        POST /_fake/payments/<id>/<status> moves a payment and sends its IPN;
+        GET /_fake/stats reports counts
+        """
+        if method == 'POST' and len(parts) == 3 and parts[0] == 'payments':
+            payment = self.account.set_status(parts[1], parts[2])
+            if payment is None:
+                return self.respond(404, {'message': 'Payment not found'})
+            return self.respond(200, payment)
+        if method == 'GET' and parts == ['stats']:
+            return self.respond(200, {
+                'payments': len(self.account.payments),
+                'sub_partners': len(self.account.sub_partners),
+                'ipn_sent': self.account.ipn_sent,
+                'ipn_failed': self.account.ipn_failed,
+            })
+        self.respond(404, {'message': 'Not found'})
+
+
+class FakeNOWPaymentsServer(ThreadingHTTPServer):
+    """
+    Local stand-in for api.nowpayments.io. Point NOWPAYMENTS_BASE_URL at .url
+    (ends in /v1). start() serves on a daemon thread for tests and benchmarks.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, account=None, faults=None):
+        super().__init__((host, port), FakeNOWPaymentsHandler)
+        self.account = account or FakeNOWPayments()
+        self.faults = faults or FaultInjector()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name='fake-nowpayments')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,72 @@
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Used when the merchant coin list is unavailable
+FALLBACK_CURRENCIES = ['btc', 'eth', 'usdt', 'usdc', 'ltc', 'doge', 'bnbbsc', 'ada', 'xrp', 'sol', 'dot', 'matic']
+
+
+class CurrencyKeyboards:
+    """
+    Deposit currency keyboards, built once per version of the merchant coin list and
+    reused by identity until the list changes. The first page pins the popular coins;
+    long lists are split into pages with prev/next buttons (curpage_<n> callbacks),
+    staying well inside Telegram's inline keyboard limits.
+    """
+
+    def __init__(self, popular=(), page_size=24, columns=3, ttl=300):
+        self.popular = [currency.lower() for currency in popular]
+        self.page_size = page_size
+        self.columns = columns
+        self.ttl = ttl
+        self._version = None
+        self._pages = None
+        self._expires_at = 0.0
+
+    @staticmethod
+    def version(currencies):
+        """Normalised coin list; keyboards are rebuilt only when this changes"""
+        return tuple(currency.lower() for currency in currencies)
+
+    def cached_pages(self):
+        """Keyboards for the current coin list, or None once the list should be fetched again"""
+        if self._pages is None or time.monotonic() >= self._expires_at:
+            return None
+        return self._pages
+
+    def pages(self, currencies):
+        """Keyboard pages for a coin list"""
+        version = self.version(currencies)
+        if version != self._version:
+            self._pages = self.build(version)
+            self._version = version
+        self._expires_at = time.monotonic() + self.ttl
+        return self._pages
+
+    def build(self, currencies):
+        pinned = [currency for currency in self.popular if currency in currencies]
+        others = [currency for currency in currencies if currency not in pinned]
+        if len(currencies) <= self.page_size:
+            chunks = [pinned + others]
+        else:
+            chunks = [pinned] if pinned else []
+            chunks += [others[i:i + self.page_size] for i in range(0, len(others), self.page_size)]
+        return [self.markup(chunk, index, len(chunks)) for index, chunk in enumerate(chunks)]
+
+    def markup(self, currencies, index, total):
+        keyboard = [
+            [
+                InlineKeyboardButton(currency.upper(), callback_data=f"currency_{currency}")
+                for currency in currencies[i:i + self.columns]
+            ]
+            for i in range(0, len(currencies), self.columns)
+        ]
+        navigation = []
+        if index > 0:
+            navigation.append(InlineKeyboardButton("⬅️ Back", callback_data=f"curpage_{index - 1}"))
+        if index < total - 1:
+            label = "More coins ➡️" if index == 0 else "Next ➡️"
+            navigation.append(InlineKeyboardButton(label, callback_data=f"curpage_{index + 1}"))
+        if navigation:
+            keyboard.append(navigation)
+        return InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,282 @@
+import asyncio
+import contextvars
+import copy
+import itertools
+import json
+import math
+import os
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from unittest import mock
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from telegram import Update
+from telegram.request import BaseRequest
+
+from .dispatch import PerUserUpdateProcessor
+from .services import NOWPaymentsService
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'LoadTestBot', 'username': 'loadtest_bot'}
+
+# (label, update kind, text or callback data) for one pass of a virtual user
+SCENARIO = [
+    ('/start', 'message', '/start'),
+    ('/balance', 'message', '/balance'),
+    ('/deposit', 'message', '/deposit'),
+    ('amount', 'message', '25'),
+    ('currency', 'callback', 'currency_btc'),
+    ('/payments', 'message', '/payments'),
+    ('/transactions', 'message', '/transactions'),
+]
+
+# Mutable [count] of the update being handled; copied into sync_to_async threads
+_query_counter = contextvars.ContextVar('loadtest_query_counter', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Database execute wrapper attributing queries to the update being handled"""
+    counter = _query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    """connection_created hook adding count_queries to every new connection"""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+@contextmanager
+def counting_queries():
+    """Count the queries run in this context, including sync_to_async threads it starts; yields [count]"""
+    counter = [0]
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+@contextmanager
+def throwaway_database(name='loadtest'):
+    """
+    Run against a freshly created test database with the query counter installed.
+    SQLite uses a temporary file so the bot's DB threads share it. Replica routing is
+    turned off inside, since only 'default' is swapped and the replica would be the real one.
+    """
+    settings_dict = connections.settings['default']
+    original = copy.deepcopy(settings_dict)
+    settings_dict['CONN_MAX_AGE'] = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        if settings_dict['ENGINE'].endswith('sqlite3'):
+            settings_dict['TEST'] = dict(settings_dict.get('TEST', {}), NAME=os.path.join(tmp, f"{name}.sqlite3"))
+
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        connection_created.connect(install_query_counter, dispatch_uid='loadtest_query_counter')
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection=connection)
+        try:
+            with override_settings(DATABASE_READ_REPLICA=None):
+                yield
+        finally:
+            connection_created.disconnect(dispatch_uid='loadtest_query_counter')
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+            settings_dict.clear()
+            settings_dict.update(original)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+class StubTelegramRequest(BaseRequest):
+    """Bot API client that answers every call locally, optionally after a simulated latency"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return 5.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data else {}
+        return 200, json.dumps({'ok': True, 'result': self.result(endpoint, parameters)}).encode()
+
+    def result(self, endpoint, parameters):
+        if endpoint == 'getMe':
+            return BOT_USER
+        if endpoint.startswith(('send', 'edit')) and 'chat_id' in parameters:
+            return {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(parameters['chat_id']), 'type': 'private'},
+                'from': BOT_USER,
+                'text': parameters.get('text', ''),
+            }
+        return True
+
+
+@contextmanager
+def stub_nowpayments(latency=0.0):
+    """Replace the NOWPayments API calls used by the bot with canned responses"""
+    def respond(result):
+        def call(self, *args, **kwargs):
+            if latency:
+                time.sleep(latency)
+            return result(*args, **kwargs) if callable(result) else result
+        return call
+
+    payment_ids = itertools.count(1)
+    with mock.patch.multiple(
+        NOWPaymentsService,
+        get_available_currencies=respond(['btc', 'eth', 'usdt', 'ltc']),
+        get_minimum_payment_amount=respond({'min_amount': 0.0001}),
+        get_estimated_price=respond({'estimated_amount': 0.0005}),
+        create_payment=respond(lambda **kwargs: {
+            'payment_id': f"load-{next(payment_ids)}", 'pay_address': 'bc1qloadtestaddress', 'pay_amount': 0.0005,
+        }),
+        create_sub_partner_account=respond(lambda user_data: {'result': {'id': f"sp-{user_data['telegram_id']}"}}),
+    ):
+        yield
+
+
+class MeasuredUpdateProcessor(PerUserUpdateProcessor):
+    """PerUserUpdateProcessor that reports each handled update and its query count to on_done"""
+
+    def __init__(self, max_concurrent_updates, on_done=None):
+        super().__init__(max_concurrent_updates)
+        self.on_done = on_done
+
+    async def do_process_update(self, update, coroutine):
+        with counting_queries() as counter:
+            try:
+                await super().do_process_update(update, coroutine)
+            finally:
+                if self.on_done is not None:
+                    self.on_done(update, counter[0])
+
+
+class LoadTest:
+    """
+    Virtual Telegram users walking through SCENARIO against the real Application
+    handlers. Updates go through the Application's update queue and update processor,
+    as they do in the bot, so each step's latency includes waiting for a free slot.
+    Build the Application with update_processor=MeasuredUpdateProcessor(...).
+    """
+
+    def __init__(self, application, users=50, iterations=1, think_time=0.0, first_user_id=10_000_000):
+        if not isinstance(application.update_processor, MeasuredUpdateProcessor):
+            raise ValueError('Build the application with update_processor=MeasuredUpdateProcessor(...)')
+        application.update_processor.on_done = self.finished
+        self.application = application
+        self.users = users
+        self.iterations = iterations
+        self.think_time = think_time
+        self.first_user_id = first_user_id
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = 0
+        self._update_ids = itertools.count(1)
+        self._pending = {}
+
+    def message_update(self, user_id, text):
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'Load {user_id}'}
+        message = {
+            'message_id': next(self._update_ids), 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'}, 'from': user, 'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def callback_update(self, user_id, data):
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'Load {user_id}'}
+        message = {
+            'message_id': next(self._update_ids), 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'}, 'from': BOT_USER, 'text': 'Choose a currency',
+        }
+        return {'update_id': next(self._update_ids), 'callback_query': {
+            'id': str(next(self._update_ids)), 'from': user, 'chat_instance': str(user_id),
+            'data': data, 'message': message,
+        }}
+
+    async def on_error(self, update, context):
+        self.errors += 1
+
+    def finished(self, update, queries):
+        done = self._pending.pop(update.update_id, None)
+        if done is not None:
+            done.set_result(queries)
+
+    async def step(self, user_id, label, kind, payload):
+        data = self.message_update(user_id, payload) if kind == 'message' else self.callback_update(user_id, payload)
+        update = Update.de_json(data, self.application.bot)
+        done = self._pending[update.update_id] = asyncio.get_running_loop().create_future()
+
+        started = time.perf_counter()
+        await self.application.update_queue.put(update)
+        queries = await done
+        self.latencies[label].append(time.perf_counter() - started)
+        self.queries[label].append(queries)
+
+    async def virtual_user(self, user_id):
+        for _ in range(self.iterations):
+            for label, kind, payload in SCENARIO:
+                await self.step(user_id, label, kind, payload)
+                if self.think_time:
+                    await asyncio.sleep(self.think_time)
+
+    async def run(self):
+        """
+        Run every virtual user through the started Application (initialize it first)
+        Returns: seconds taken
+        """
+        self.application.add_error_handler(self.on_error)
+        await self.application.start()
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*[self.virtual_user(self.first_user_id + i) for i in range(self.users)])
+            return time.perf_counter() - started
+        finally:
+            await self.application.stop()
+
+    def report(self):
+        """Per-step latency percentiles (ms) and mean queries, in scenario order"""
+        rows = []
+        for label, _, _ in SCENARIO:
+            latencies = sorted(self.latencies[label])
+            queries = self.queries[label]
+            rows.append({
+                'step': label,
+                'count': len(latencies),
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'max': (latencies[-1] if latencies else 0) * 1000,
+                'queries': sum(queries) / len(queries) if queries else 0,
+            })
+        return rows
@@ -0,0 +1,63 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app_bot.archive import archivable_payments, archive_payments, archive_transactions
+from app_bot.models import Transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Move old transactions and final payments out of the live tables into the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=180,
+            help='Retention window in days; older rows are archived (default: 180)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows moved per bulk batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--skip-payments',
+            action='store_true',
+            help='Do not archive payments',
+        )
+        parser.add_argument(
+            '--skip-transactions',
+            action='store_true',
+            help='Do not archive wallet transactions',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be archived without making changes',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+
+        self.stdout.write(f"Archiving rows created before {cutoff:%Y-%m-%d %H:%M}")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+            if not options['skip_payments']:
+                self.stdout.write(f"Payments to archive: {archivable_payments(cutoff).count()}")
+            if not options['skip_transactions']:
+                old = Transaction.objects.filter(created_at__lt=cutoff).exclude(transaction_type='OPENING')
+                self.stdout.write(f"Transactions to archive: {old.count()}")
+            return
+
+        if not options['skip_payments']:
+            count = archive_payments(cutoff, batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Archived {count} payments"))
+
+        if not options['skip_transactions']:
+            count = archive_transactions(cutoff, batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Archived {count} transactions"))
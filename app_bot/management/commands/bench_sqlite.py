@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app_bot.db import sqlite_pragma_statements
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = {'pragmas': {}, 'timeout': 5.0, 'begin': 'BEGIN'}
+
+
+def tuned_profile():
+    """Profile matching the settings applied to Django connections"""
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None) or {}
+    timeout = pragmas.get('busy_timeout', 20000) / 1000
+    return {'pragmas': pragmas, 'timeout': timeout, 'begin': 'BEGIN IMMEDIATE'}
+
+
+def setup_database(path, wallets):
+    """Create a wallet/transaction schema shaped like app_bot's tables"""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE wallet (id INTEGER PRIMARY KEY, balance NUMERIC NOT NULL);
+        CREATE TABLE txn (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            wallet_id INTEGER NOT NULL,
+            amount NUMERIC NOT NULL,
+            balance_after NUMERIC NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX txn_wallet ON txn (wallet_id, id);
+    """)
+    conn.executemany("INSERT INTO wallet (id, balance) VALUES (?, 0)", [(i,) for i in range(1, wallets + 1)])
+    conn.commit()
+    conn.close()
+
+
+def write_worker(path, profile, writes, wallets, worker_id, results):
+    """Credit wallets the way Wallet.add_funds does: update the balance, read it back, insert a row"""
+    conn = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None)
+    for statement in sqlite_pragma_statements(profile['pragmas']):
+        conn.execute(statement)
+
+    committed = 0
+    locked = 0
+    for i in range(writes):
+        wallet_id = (worker_id * writes + i) % wallets + 1
+        try:
+            conn.execute(profile['begin'])
+            conn.execute("UPDATE wallet SET balance = balance + 1 WHERE id = ?", (wallet_id,))
+            balance = conn.execute("SELECT balance FROM wallet WHERE id = ?", (wallet_id,)).fetchone()[0]
+            conn.execute(
+                "INSERT INTO txn (wallet_id, amount, balance_after, created_at) VALUES (?, 1, ?, datetime('now'))",
+                (wallet_id, balance)
+            )
+            conn.execute("COMMIT")
+            committed += 1
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if 'locked' in str(e) or 'busy' in str(e):
+                locked += 1
+            else:
+                raise
+    conn.close()
+    results.put((committed, locked))
+
+
+def run_profile(profile, processes, writes, wallets):
+    """Run concurrent writers against a fresh database file; returns (committed, locked, seconds)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.sqlite3')
+        setup_database(path, wallets)
+
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue()
+        workers = [
+            ctx.Process(target=write_worker, args=(path, profile, writes, wallets, worker_id, results))
+            for worker_id in range(processes)
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+    committed = sum(c for c, _ in outcomes)
+    locked = sum(l for _, l in outcomes)
+    return committed, locked, elapsed
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent multi-process SQLite writes with default vs tuned settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=4,
+            help='Number of concurrent writer processes (default: 4)',
+        )
+        parser.add_argument(
+            '--writes',
+            type=int,
+            default=500,
+            help='Write transactions per process (default: 500)',
+        )
+        parser.add_argument(
+            '--wallets',
+            type=int,
+            default=100,
+            help='Number of wallet rows written to (default: 100)',
+        )
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        writes = options['writes']
+        wallets = options['wallets']
+
+        self.stdout.write(
+            f"Running {processes} writer processes x {writes} transactions against a temporary SQLite file"
+        )
+
+        report = {}
+        for name, profile in (('default', DEFAULT_PROFILE), ('tuned', tuned_profile())):
+            committed, locked, elapsed = run_profile(profile, processes, writes, wallets)
+            throughput = committed / elapsed if elapsed else 0
+            report[name] = throughput
+            self.stdout.write(
+                f"  {name:<8} committed={committed:<6} locked={locked:<6} "
+                f"elapsed={elapsed:.2f}s throughput={throughput:.0f} tx/s"
+            )
+
+        if report['default']:
+            self.stdout.write(
+                self.style.SUCCESS(f"Tuned profile throughput: {report['tuned'] / report['default']:.2f}x default")
+            )
@@ -0,0 +1,166 @@
+import os
+from contextlib import redirect_stdout
+from io import StringIO
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from app_bot.benchmarks import (
+    BENCHMARKS, MIN_COMPARE_ITERATIONS, NOISE_MADS, BenchmarkError, compare, load_results, run_benchmarks, save_results, select_benchmarks
+)
+from app_bot.executors import shutdown_executors
+from app_bot.fake_nowpayments import FakeNOWPaymentsServer, FaultInjector
+from app_bot.loadtest import throwaway_database
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark payment, wallet, user and view hot paths and compare them with a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'benchmarks',
+            nargs='*',
+            help='Benchmark names or group prefixes to run, e.g. wallet or deposit.create (default: all)',
+        )
+        parser.add_argument(
+            '--list',
+            action='store_true',
+            help='List the available benchmarks and exit',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Timed calls per benchmark (default: 200)',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=10,
+            help='Untimed calls before timing starts (default: 10)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Write the results as JSON to this file',
+        )
+        parser.add_argument(
+            '--baseline',
+            type=str,
+            default=DEFAULT_BASELINE,
+            help='Baseline JSON to compare with (default: benchmarks/baseline.json)',
+        )
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='Store these results as the new baseline instead of comparing',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.25,
+            help='Allowed median slowdown before a benchmark counts as regressed (default: 0.25 = 25%%)',
+        )
+        parser.add_argument(
+            '--noise',
+            type=float,
+            default=NOISE_MADS,
+            help='A median must also move by this many median absolute deviations to count as '
+                 f'a change (default: {NOISE_MADS})',
+        )
+        parser.add_argument(
+            '--payments-latency-ms',
+            type=float,
+            default=0,
+            help='Latency of the local fake NOWPayments API in milliseconds (default: 0)',
+        )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, bench in BENCHMARKS.items():
+                self.stdout.write(f"{name:<28}{bench.description}")
+            return
+
+        if options['save_baseline'] and options['iterations'] < MIN_COMPARE_ITERATIONS:
+            raise CommandError(f"A baseline needs at least {MIN_COMPARE_ITERATIONS} iterations per benchmark")
+
+        benchmarks = select_benchmarks(options['benchmarks'])
+        if not benchmarks:
+            raise CommandError(f"No benchmarks match {' '.join(options['benchmarks'])}; see --list")
+
+        server = FakeNOWPaymentsServer(faults=FaultInjector(latency=options['payments_latency_ms'] / 1000)).start()
+        self.stdout.write('Creating test database...')
+        try:
+            with throwaway_database('benchmark'), override_settings(NOWPAYMENTS_BASE_URL=server.url):
+                # The payment services print debug output and log every call
+                logging.disable(logging.INFO)
+                try:
+                    with redirect_stdout(StringIO()):
+                        results = run_benchmarks(
+                            benchmarks, server, options['iterations'], options['warmup'], progress=self.progress
+                        )
+                except BenchmarkError as e:
+                    raise CommandError(f"Benchmark failed: {e}")
+                finally:
+                    logging.disable(logging.NOTSET)
+                    shutdown_executors()
+        finally:
+            server.stop()
+
+        if options['output']:
+            save_results(results, options['output'])
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['save_baseline']:
+            save_results(results, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(self.style.WARNING(
+                f"No baseline at {options['baseline']}; run with --save-baseline to create one"
+            ))
+            return
+
+        if options['iterations'] < MIN_COMPARE_ITERATIONS:
+            self.stdout.write(self.style.WARNING(
+                f"Not comparing with the baseline: {options['iterations']} iterations are too few to tell a "
+                f"regression from noise (use at least {MIN_COMPARE_ITERATIONS})"
+            ))
+            return
+
+        baseline = load_results(options['baseline'])
+        rows = compare(results, baseline, options['threshold'], options['noise'])
+        self.report(rows, baseline)
+        regressed = [row['name'] for row in rows if row['status'] == 'regressed']
+        if regressed:
+            raise CommandError(f"{len(regressed)} benchmark(s) regressed: {', '.join(regressed)}")
+        self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    def progress(self, name, stats):
+        self.stdout.write(
+            f"  {name:<28}median={stats['median_ms']:8.3f}ms  p95={stats['p95_ms']:8.3f}ms  "
+            f"{stats['ops_per_sec']:9.1f} ops/s  queries={stats['queries']:.1f}"
+        )
+
+    def report(self, rows, baseline):
+        meta = baseline.get('meta', {})
+        self.stdout.write("\n" + "="*50)
+        self.stdout.write(f"COMPARED WITH BASELINE {meta.get('git_revision') or ''} ({meta.get('created_at', '?')})")
+        self.stdout.write("="*50)
+        self.stdout.write(f"{'benchmark':<28}{'baseline ms':>12}{'current ms':>12}{'change':>9}{'queries':>10}  status")
+        for row in rows:
+            if row['status'] == 'new':
+                self.stdout.write(f"{row['name']:<28}{'-':>12}{row['current_ms']:>12.3f}{'-':>9}{'-':>10}  new")
+                continue
+            style = {'regressed': self.style.ERROR, 'improved': self.style.SUCCESS}.get(row['status'], str)
+            queries = f"{row['baseline_queries'] or 0:g}->{row['queries']:g}"
+            self.stdout.write(style(
+                f"{row['name']:<28}{row['baseline_ms']:>12.3f}{row['current_ms']:>12.3f}"
+                f"{(row['ratio'] - 1) * 100:>+8.1f}%{queries:>10}  {row['status']}"
+            ))
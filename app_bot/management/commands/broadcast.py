@@ -0,0 +1,123 @@
+import asyncio
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from telegram.ext import ExtBot
+from app_bot.broadcast import BroadcastRunner
+from app_bot.models import Broadcast
+from app_bot.throttling import FloodRateLimiter
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Send a message to every bot user within Telegram rate limits (resumable)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'message',
+            nargs='?',
+            help='Message text for a new broadcast',
+        )
+        parser.add_argument(
+            '--resume',
+            type=int,
+            metavar='ID',
+            help='Resume an interrupted broadcast from its checkpoint',
+        )
+        parser.add_argument(
+            '--queued',
+            action='store_true',
+            help='Send all broadcasts queued from the admin',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=20,
+            help='Concurrent sends (default: 20)',
+        )
+        parser.add_argument(
+            '--rate',
+            type=int,
+            default=settings.BOT_BROADCAST_RATE,
+            help=f'Messages per second overall; the live bot is limited to TELEGRAM_GLOBAL_RATE minus '
+                 f'BOT_BROADCAST_RATE, so more than that share risks flood limits (default: {settings.BOT_BROADCAST_RATE})',
+        )
+        parser.add_argument(
+            '--report-interval',
+            type=float,
+            default=5.0,
+            help='Seconds between progress reports and checkpoints (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        token = os.getenv('BOT_TOKEN')
+        if not token:
+            raise CommandError('BOT_TOKEN not found in environment variables')
+        if sum(bool(option) for option in (options['message'], options['resume'], options['queued'])) != 1:
+            raise CommandError('Pass a message, --resume ID or --queued')
+        if options['rate'] + settings.BOT_OUTBOUND_RATE > settings.TELEGRAM_GLOBAL_RATE:
+            self.stdout.write(self.style.WARNING(
+                f"--rate {options['rate']} plus the live bot's BOT_OUTBOUND_RATE {settings.BOT_OUTBOUND_RATE} exceeds "
+                f"Telegram's {settings.TELEGRAM_GLOBAL_RATE} msg/s; expect 429 responses while the bot is busy"
+            ))
+
+        if options['message']:
+            broadcasts = [Broadcast.objects.create(message=options['message'])]
+        elif options['resume']:
+            broadcasts = list(Broadcast.objects.filter(pk=options['resume']).exclude(status='DONE'))
+            if not broadcasts:
+                raise CommandError(f"No unfinished broadcast with ID {options['resume']}")
+        else:
+            broadcasts = list(Broadcast.objects.filter(status='QUEUED').order_by('id'))
+            if not broadcasts:
+                self.stdout.write('No queued broadcasts')
+                return
+
+        for broadcast in broadcasts:
+            Broadcast.objects.filter(pk=broadcast.pk).update(
+                status='RUNNING', started_at=broadcast.started_at or timezone.now()
+            )
+            self.stdout.write(
+                f"Broadcast {broadcast.pk}: starting after user {broadcast.last_user_id} "
+                f"({broadcast.sent_count} already sent)"
+            )
+            try:
+                result = asyncio.run(self.run_broadcast(token, broadcast, options))
+            except KeyboardInterrupt:
+                self.stdout.write(self.style.WARNING(
+                    f"Interrupted; resume with: python manage.py broadcast --resume {broadcast.pk}"
+                ))
+                return
+
+            self.stdout.write("\n" + "="*50)
+            self.stdout.write(f"BROADCAST {broadcast.pk} SUMMARY")
+            self.stdout.write("="*50)
+            self.stdout.write(f"Sent: {result['sent']}")
+            self.stdout.write(f"Failed (blocked or unreachable): {result['failed']}")
+            self.stdout.write(f"Elapsed: {result['elapsed']:.1f}s ({result['rate']:.1f} msg/s)")
+            self.stdout.write(self.style.SUCCESS(f"Broadcast {broadcast.pk} finished"))
+
+    async def run_broadcast(self, token, broadcast, options):
+        rate_limiter = FloodRateLimiter(
+            overall_rate=options['rate'],
+            chat_rate=settings.BOT_OUTBOUND_CHAT_RATE,
+            group_rate_per_minute=settings.BOT_OUTBOUND_GROUP_RATE_PER_MINUTE,
+            max_retries=settings.BOT_OUTBOUND_MAX_RETRIES,
+        )
+        async with ExtBot(token, rate_limiter=rate_limiter) as bot:
+            runner = BroadcastRunner(
+                broadcast, bot,
+                concurrency=options['concurrency'],
+                report_interval=options['report_interval'],
+                on_progress=self.report
+            )
+            return await runner.run()
+
+    def report(self, progress):
+        self.stdout.write(
+            f"  sent={progress['sent']} failed={progress['failed']} "
+            f"checkpoint=user {progress['last_user_id']} rate={progress['rate']:.1f} msg/s"
+        )
@@ -0,0 +1,113 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from app_bot.fake_nowpayments import FakeNOWPayments, FakeNOWPaymentsServer, FaultInjector
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Serve a local fake of the NOWPayments API for offline development and benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--host',
+            type=str,
+            default='127.0.0.1',
+            help='Host to bind to (default: 127.0.0.1)',
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8090,
+            help='Port to listen on (default: 8090)',
+        )
+        parser.add_argument(
+            '--latency-ms',
+            type=float,
+            default=0,
+            help='Delay added to every API response (default: 0)',
+        )
+        parser.add_argument(
+            '--jitter-ms',
+            type=float,
+            default=0,
+            help='Random extra delay of up to this many milliseconds (default: 0)',
+        )
+        parser.add_argument(
+            '--error-rate',
+            type=float,
+            default=0,
+            help='Fraction of API requests answered with a 500 (default: 0)',
+        )
+        parser.add_argument(
+            '--rate-limit',
+            type=float,
+            default=0,
+            help='Requests per second before answering 429; 0 for no limit (default: 0)',
+        )
+        parser.add_argument(
+            '--api-key',
+            type=str,
+            default=None,
+            help='Only accept this x-api-key (default: accept any key)',
+        )
+        parser.add_argument(
+            '--ipn-url',
+            type=str,
+            default=None,
+            help='Where to POST IPN callbacks (default: BASE_URL + the payment webhook route)',
+        )
+        parser.add_argument(
+            '--ipn-delay',
+            type=float,
+            default=None,
+            help='Complete new payments automatically, sending an IPN every this many seconds',
+        )
+        parser.add_argument(
+            '--ipn-secret',
+            type=str,
+            default=os.getenv('NOWPAYMENTS_IPN_SECRET'),
+            help='Sign IPN callbacks with this secret (x-nowpayments-sig)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Random seed for reproducible error injection',
+        )
+
+    def handle(self, *args, **options):
+        ipn_url = options['ipn_url'] or os.getenv('BASE_URL', 'http://localhost:8000').rstrip('/') + reverse(
+            'bot:payment_webhook'
+        )
+        account = FakeNOWPayments(
+            api_key=options['api_key'],
+            ipn_url=ipn_url,
+            ipn_secret=options['ipn_secret'],
+            ipn_delay=options['ipn_delay'],
+        )
+        faults = FaultInjector(
+            latency=options['latency_ms'] / 1000,
+            jitter=options['jitter_ms'] / 1000,
+            error_rate=options['error_rate'],
+            rate_limit=options['rate_limit'],
+            seed=options['seed'],
+        )
+        server = FakeNOWPaymentsServer(options['host'], options['port'], account=account, faults=faults)
+
+        self.stdout.write(self.style.SUCCESS(f'Fake NOWPayments API listening on {server.url}'))
+        self.stdout.write(f'Set NOWPAYMENTS_BASE_URL={server.url} for the web server and bot')
+        self.stdout.write(f'IPN callbacks go to {ipn_url}')
+        if settings.NOWPAYMENTS_BASE_URL != server.url:
+            self.stdout.write(self.style.WARNING(f'NOWPAYMENTS_BASE_URL is currently {settings.NOWPAYMENTS_BASE_URL}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Fake NOWPayments server stopped by user'))
+        finally:
+            server.server_close()
+            self.stdout.write(
+                f'Payments created: {len(account.payments)}, IPNs sent: {account.ipn_sent}, failed: {account.ipn_failed}'
+            )
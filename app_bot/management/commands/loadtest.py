@@ -0,0 +1,124 @@
+import asyncio
+from contextlib import ExitStack, redirect_stdout
+from io import StringIO
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from app_bot.executors import shutdown_executors
+from app_bot.loadtest import (
+    LoadTest, MeasuredUpdateProcessor, StubTelegramRequest, stub_nowpayments, throwaway_database,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Synthetic users must never create sub-partner accounts or invoices on the real service
+PRODUCTION_API_HOST = 'api.nowpayments.io'
+
+
+class Command(BaseCommand):
+    help = 'Load test the bot handlers with simulated Telegram users against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=50,
+            help='Concurrent virtual users (default: 50)',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=1,
+            help='Scenario passes per virtual user (default: 1)',
+        )
+        parser.add_argument(
+            '--think-ms',
+            type=float,
+            default=0,
+            help='Pause between a virtual user\'s updates in milliseconds (default: 0)',
+        )
+        parser.add_argument(
+            '--telegram-latency-ms',
+            type=float,
+            default=0,
+            help='Simulated Bot API latency in milliseconds (default: 0)',
+        )
+        parser.add_argument(
+            '--live-payments',
+            action='store_true',
+            help='Call the configured NOWPAYMENTS_BASE_URL (a sandbox or fake_nowpayments server) '
+                 'instead of answering NOWPayments calls locally; refused for the production API',
+        )
+        parser.add_argument(
+            '--payments-latency-ms',
+            type=float,
+            default=0,
+            help='Simulated NOWPayments latency of the local stub in milliseconds (default: 0)',
+        )
+        parser.add_argument(
+            '--rate-limits',
+            action='store_true',
+            help='Keep inbound throttling and outbound flood limits (off by default to measure raw handler cost)',
+        )
+
+    def handle(self, *args, **options):
+        if options['live_payments'] and urlsplit(settings.NOWPAYMENTS_BASE_URL).hostname == PRODUCTION_API_HOST:
+            raise CommandError(
+                f"--live-payments would create real accounts and invoices on {settings.NOWPAYMENTS_BASE_URL}; "
+                "point NOWPAYMENTS_BASE_URL at a sandbox or python manage.py fake_nowpayments"
+            )
+        self.stdout.write('Creating test database...')
+        with throwaway_database('loadtest'):
+            try:
+                self.run_load_test(options)
+            finally:
+                shutdown_executors()
+
+    def run_load_test(self, options):
+        from app_bot.bot import build_application
+        from app_bot.qr import qr_renderer
+
+        request = StubTelegramRequest(latency=options['telegram_latency_ms'] / 1000)
+        application = build_application(
+            polling=False, token='123456:LOADTEST', request=request, rate_limits=options['rate_limits'],
+            update_processor=MeasuredUpdateProcessor(settings.BOT_CONCURRENT_UPDATES),
+        )
+        load_test = LoadTest(
+            application,
+            users=options['users'],
+            iterations=options['iterations'],
+            think_time=options['think_ms'] / 1000,
+        )
+
+        self.stdout.write(f"Running {options['users']} virtual users x {options['iterations']} iteration(s)...")
+        with ExitStack() as stack:
+            if not options['live_payments']:
+                stack.enter_context(stub_nowpayments(options['payments_latency_ms'] / 1000))
+            # The payment services print debug output on every call
+            stack.enter_context(redirect_stdout(StringIO()))
+            elapsed = asyncio.run(self.run_application(application, load_test))
+        qr_renderer.shutdown()
+
+        rows = load_test.report()
+        updates = sum(row['count'] for row in rows)
+
+        self.stdout.write("\n" + "="*50)
+        self.stdout.write("LOAD TEST SUMMARY")
+        self.stdout.write("="*50)
+        self.stdout.write(f"{'step':<14}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'queries':>9}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['step']:<14}{row['count']:>7}{row['p50']:>9.1f}{row['p95']:>9.1f}"
+                f"{row['p99']:>9.1f}{row['max']:>9.1f}{row['queries']:>9.1f}"
+            )
+        self.stdout.write(f"Updates handled: {updates} in {elapsed:.2f}s ({updates / elapsed:.1f} updates/s)")
+        self.stdout.write(f"Bot API calls: {sum(request.calls.values())} {dict(request.calls)}")
+        if load_test.errors:
+            self.stdout.write(self.style.ERROR(f"Handler errors: {load_test.errors}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No handler errors"))
+
+    async def run_application(self, application, load_test):
+        async with application:
+            return await load_test.run()
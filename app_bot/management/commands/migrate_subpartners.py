@@ -1,11 +1,21 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connections, transaction
 from app_account.models import User
+from app_bot.checkpoints import Watermark, clear_checkpoint, load_checkpoint, save_checkpoint
+from app_bot.models import SubPartnerJob
+from app_bot.provisioning import request_sub_partner_id
 from app_bot.services import NOWPaymentsService
+from app_bot.throttling import BlockingRateLimiter
 import logging
 
 logger = logging.getLogger(__name__)
 
+CHECKPOINT_NAME = 'migrate_subpartners'
+
+
 class Command(BaseCommand):
     help = 'Migrate existing users to NOWPayments sub-partner accounts'
 
@@ -20,6 +30,29 @@ class Command(BaseCommand):
             type=int,
             help='Migrate specific user by ID',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Concurrent NOWPayments API calls (default: 8)',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=10.0,
+            help='Maximum API calls per second across all workers (default: 10)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Sub-partner IDs saved per transaction and checkpoint (default: 100)',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue after the last checkpoint instead of starting over',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
@@ -27,12 +60,18 @@ class Command(BaseCommand):
         
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+
+        start = 0
+        if options['resume'] and not user_id:
+            start, _ = load_checkpoint(CHECKPOINT_NAME)
+            self.stdout.write(f"Resuming after user {start}")
         
-        # Get users without sub-partner IDs
+        # Get users without sub-partner IDs; users the provisioning worker is handling are left to it
+        users = User.objects.filter(pk__gt=start, nowpayments_sub_partner_id__isnull=True).exclude(
+            sub_partner_job__status='RUNNING'
+        )
         if user_id:
-            users = User.objects.filter(id=user_id, nowpayments_sub_partner_id__isnull=True)
-        else:
-            users = User.objects.filter(nowpayments_sub_partner_id__isnull=True)
+            users = users.filter(id=user_id)
         
         total_users = users.count()
         self.stdout.write(f"Found {total_users} users without NOWPayments sub-partner IDs")
@@ -40,64 +79,129 @@ class Command(BaseCommand):
         if total_users == 0:
             self.stdout.write(self.style.SUCCESS('All users already have sub-partner IDs'))
             return
-        
-        nowpayments_service = NOWPaymentsService()
-        success_count = 0
-        error_count = 0
-        
-        for user in users:
-            try:
-                self.stdout.write(f"Processing user {user.id}: {user.telegram_full_name}")
-                
-                if dry_run:
-                    self.stdout.write(f"  Would create sub-partner account for user {user.id}")
-                    continue
-                
-                # Create sub-partner account
-                user_data = {
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
-                    'telegram_full_name': user.telegram_full_name,
-                    'email': f"user_{user.telegram_id}@telegram.com",
-                    'name': user.telegram_full_name or f"User {user.telegram_id}"
-                }
-                
-                sub_partner_response = nowpayments_service.create_sub_partner_account(user_data)
-                
-                if sub_partner_response and 'result' in sub_partner_response and 'id' in sub_partner_response['result']:
-                    # Update user with sub-partner ID
-                    sub_partner_id = sub_partner_response['result']['id']
-                    with transaction.atomic():
-                        user.nowpayments_sub_partner_id = sub_partner_id
-                        user.save()
-                    
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f"  ✓ Created sub-partner account: {sub_partner_id}"
-                        )
-                    )
-                    success_count += 1
-                else:
-                    self.stdout.write(
-                        self.style.ERROR(f"  ✗ Failed to create sub-partner account for user {user.id}")
-                    )
-                    error_count += 1
-                    
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f"  ✗ Error processing user {user.id}: {e}")
-                )
-                error_count += 1
+
+        if dry_run:
+            for user in users.order_by('pk').only('id', 'telegram_full_name').iterator(chunk_size=2000):
+                self.stdout.write(f"  Would create sub-partner account for user {user.id}: {user.telegram_full_name}")
+            self.stdout.write(self.style.WARNING("This was a dry run - no changes were made"))
+            return
+
+        started = time.monotonic()
+        success_count, error_count, taken_count = self.migrate(users.order_by('pk'), start, total_users, options)
+        if not user_id:
+            clear_checkpoint(CHECKPOINT_NAME)
+        elapsed = time.monotonic() - started
         
         # Summary
         self.stdout.write("\n" + "="*50)
         self.stdout.write("MIGRATION SUMMARY")
         self.stdout.write("="*50)
-        self.stdout.write(f"Total users processed: {total_users}")
+        processed = success_count + error_count + taken_count
+        self.stdout.write(f"Total users processed: {processed}")
         self.stdout.write(f"Successful migrations: {success_count}")
         self.stdout.write(f"Failed migrations: {error_count}")
-        
-        if dry_run:
-            self.stdout.write(self.style.WARNING("This was a dry run - no changes were made"))
-        else:
-            self.stdout.write(self.style.SUCCESS("Migration completed!")) 
\ No newline at end of file
+        self.stdout.write(f"Provisioned elsewhere during the run: {taken_count}")
+        self.stdout.write(f"Elapsed: {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} users/s)")
+        if error_count:
+            self.stdout.write(self.style.WARNING("Run the command again (without --resume) to retry failed users"))
+        self.stdout.write(self.style.SUCCESS("Migration completed!"))
+
+    def migrate(self, users, start, total_users, options):
+        """
+        Stream users into a bounded thread pool, saving IDs and checkpointing every batch
+        Returns: (success_count, error_count, taken_count)
+        """
+        # NOWPaymentsService keeps its JWT on the instance, so each thread logs in with its own
+        local = threading.local()
+        limiter = BlockingRateLimiter(options['rate'])
+        workers = options['workers']
+        batch_size = options['batch_size']
+        checkpoint = not options.get('user_id')
+
+        watermark = Watermark(start)
+        created = []
+        success_count = error_count = taken_count = 0
+
+        def create_account(user):
+            limiter.wait()
+            try:
+                if not hasattr(local, 'service'):
+                    local.service = NOWPaymentsService()
+                return request_sub_partner_id(local.service, user), None
+            except Exception as e:
+                return None, e
+            finally:
+                connections.close_all()
+
+        def flush():
+            nonlocal success_count, taken_count
+            if created:
+                # The provisioning worker may have stored an ID for the user meanwhile; keep it
+                with transaction.atomic():
+                    saved = [
+                        user.pk for user in created
+                        if User.objects.filter(pk=user.pk, nowpayments_sub_partner_id__isnull=True).update(
+                            nowpayments_sub_partner_id=user.nowpayments_sub_partner_id
+                        )
+                    ]
+                    SubPartnerJob.objects.filter(
+                        user_id__in=saved, status__in=['PENDING', 'FAILED']
+                    ).update(status='DONE', last_error='')
+                for user in created:
+                    if user.pk not in saved:
+                        logger.warning(
+                            f"User {user.id} got a sub-partner account elsewhere during the migration; "
+                            f"unused account {user.nowpayments_sub_partner_id}"
+                        )
+                success_count += len(saved)
+                taken_count += len(created) - len(saved)
+                created.clear()
+            # Only checkpoint IDs that are saved
+            if checkpoint:
+                save_checkpoint(CHECKPOINT_NAME, watermark.value)
+
+        def collect(done):
+            nonlocal success_count, error_count
+            for future in done:
+                user = pending.pop(future)
+                sub_partner_id, error = future.result()
+                if sub_partner_id:
+                    user.nowpayments_sub_partner_id = sub_partner_id
+                    created.append(user)
+                    if options['verbosity'] >= 2:
+                        self.stdout.write(self.style.SUCCESS(f"  ✓ User {user.id}: sub-partner account {sub_partner_id}"))
+                else:
+                    error_count += 1
+                    reason = error or 'unexpected response'
+                    self.stdout.write(
+                        self.style.ERROR(f"  ✗ Failed to create sub-partner account for user {user.id}: {reason}")
+                    )
+                watermark.finished(user.pk)
+
+                processed = success_count + error_count + taken_count + len(created)
+                if len(created) >= batch_size:
+                    flush()
+                if processed % 500 == 0:
+                    self.stdout.write(f"  {processed}/{total_users} users processed")
+
+        pending = {}
+        fields = ['id', 'telegram_id', 'telegram_username', 'telegram_full_name', 'nowpayments_sub_partner_id']
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='subpartner') as executor:
+            try:
+                for user in users.only(*fields).iterator(chunk_size=2000):
+                    # Bound the users held in memory to a few per worker
+                    while len(pending) >= workers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    watermark.dispatched(user.pk)
+                    pending[executor.submit(create_account, user)] = user
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            finally:
+                # On Ctrl-C, save what finished so --resume continues from there
+                executor.shutdown(wait=True, cancel_futures=True)
+                collect([future for future in list(pending) if future.done() and not future.cancelled()])
+                flush()
+
+        return success_count, error_count, taken_count
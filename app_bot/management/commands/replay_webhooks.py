@@ -0,0 +1,100 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from app_bot.webhook_capture import WebhookReplayer, read_capture
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Replay captured payment webhooks against a server at real, accelerated or maximum speed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'capture',
+            type=str,
+            help='Capture file written with WEBHOOK_CAPTURE_PATH',
+        )
+        parser.add_argument(
+            '--url',
+            type=str,
+            default=None,
+            help='Webhook URL to send to (default: BASE_URL + the payment webhook route)',
+        )
+        parser.add_argument(
+            '--speed',
+            type=str,
+            default='1',
+            help='Replay speed: 1 for the captured pace, N for N times faster, or max (default: 1)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Maximum requests in flight (default: 8)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Replay only the first N captured requests',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help='Per-request timeout in seconds (default: 30)',
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['capture']):
+            raise CommandError(f"Capture file {options['capture']} not found")
+        speed = options['speed'].lower()
+        try:
+            speed = 0.0 if speed == 'max' else float(speed.removesuffix('x'))
+        except ValueError:
+            raise CommandError(f"Invalid --speed {options['speed']}; use a number or max")
+        if speed < 0 or options['concurrency'] < 1:
+            raise CommandError('--speed must not be negative and --concurrency must be at least 1')
+
+        url = options['url'] or os.getenv('BASE_URL', 'http://localhost:8000').rstrip('/') + reverse(
+            'bot:payment_webhook'
+        )
+        records = list(read_capture(options['capture'], options['limit']))
+        if not records:
+            self.stdout.write(self.style.WARNING('Capture file is empty'))
+            return
+        captured_span = records[-1]['ts'] - records[0]['ts']
+
+        self.stdout.write(
+            f"Replaying {len(records)} webhooks ({captured_span:.1f}s captured) to {url} "
+            f"at {'max speed' if not speed else f'{speed:g}x'} with concurrency {options['concurrency']}..."
+        )
+        replayer = WebhookReplayer(url, speed=speed, concurrency=options['concurrency'], timeout=options['timeout'])
+        try:
+            elapsed = replayer.run(records)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Replay interrupted by user'))
+            return
+        report = replayer.report()
+
+        self.stdout.write("\n" + "="*50)
+        self.stdout.write("WEBHOOK REPLAY SUMMARY")
+        self.stdout.write("="*50)
+        self.stdout.write(f"Requests: {report['requests']} in {elapsed:.2f}s ({report['requests'] / elapsed:.1f}/s)")
+        self.stdout.write(
+            f"Acceptance latency ms: p50={report['latency_p50']:.1f} p95={report['latency_p95']:.1f} "
+            f"p99={report['latency_p99']:.1f} max={report['latency_max']:.1f}"
+        )
+        self.stdout.write(
+            f"Lag behind schedule ms: p50={report['lag_p50']:.1f} p95={report['lag_p95']:.1f} "
+            f"max={report['lag_max']:.1f}"
+        )
+        self.stdout.write(f"Status codes: {dict(sorted(report['statuses'].items()))}")
+        if report['errors']:
+            self.stdout.write(self.style.ERROR(
+                f"Errors: {sum(report['errors'].values())} {dict(sorted(report['errors'].items()))}"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("No errors"))
@@ -0,0 +1,52 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app_bot.provisioning import drain_sub_partner_jobs
+from app_bot.services import NOWPaymentsService
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Process the NOWPayments sub-partner provisioning queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=settings.SUB_PARTNER_WORKER_INTERVAL or 5,
+            help='Seconds to sleep when the queue is empty',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='Maximum jobs processed per pass (default: 20)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process due jobs once and exit',
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        batch_size = options['batch_size']
+
+        self.stdout.write(self.style.SUCCESS('Starting sub-partner provisioning worker...'))
+        service = NOWPaymentsService()
+        try:
+            while True:
+                try:
+                    processed = drain_sub_partner_jobs(limit=batch_size, service=service)
+                except Exception as e:
+                    processed = 0
+                    logger.error(f'Error processing sub-partner queue: {e}')
+                if processed:
+                    self.stdout.write(f'Processed {processed} sub-partner jobs')
+                if options['once']:
+                    break
+                if processed < batch_size:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Worker stopped by user'))
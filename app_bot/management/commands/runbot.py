@@ -1,5 +1,7 @@
-from django.core.management.base import BaseCommand
+import os
+from django.core.management.base import BaseCommand, CommandError
 from app_bot.bot import main
+from app_bot.sharding import ShardedBot
 import logging
 
 logger = logging.getLogger(__name__)
@@ -7,12 +9,30 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Run the Telegram bot'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Bot worker processes; updates are routed to them by Telegram user ID (default: 1)',
+        )
+
     def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
+        token = os.getenv('BOT_TOKEN')
+        if workers > 1 and not token:
+            raise CommandError('BOT_TOKEN not found in environment variables')
+
         self.stdout.write(
-            self.style.SUCCESS('Starting Telegram bot...')
+            self.style.SUCCESS(f'Starting Telegram bot with {workers} worker(s)...')
         )
         try:
-            main()
+            if workers == 1:
+                main()
+            else:
+                ShardedBot(token, workers).run()
         except KeyboardInterrupt:
             self.stdout.write(
                 self.style.WARNING('Bot stopped by user')
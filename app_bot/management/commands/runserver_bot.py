@@ -3,13 +3,13 @@ import time
 import os
 import sys
 import signal
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Run both Django server and Telegram bot simultaneously'
+    help = 'Run both Django server and Telegram bot simultaneously (development; use supervise in production)'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -24,11 +24,19 @@ class Command(BaseCommand):
             default='127.0.0.1',
             help='Host to run Django server on (default: 127.0.0.1)'
         )
+        parser.add_argument(
+            '--webhook',
+            action='store_true',
+            help='Serve bot updates through the /telegram/webhook/ route under uvicorn instead of a polling process'
+        )
 
     def handle(self, *args, **options):
         host = options['host']
         port = options['port']
 
+        if options['webhook']:
+            return self.run_webhook(host, port)
+
         self.stdout.write(
             self.style.SUCCESS('Starting Django server and Telegram bot...')
         )
@@ -36,7 +44,7 @@ class Command(BaseCommand):
         # Start the bot in a separate process
         bot_process = subprocess.Popen([
             sys.executable, 'manage.py', 'runbot'
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        ])
 
         # Give the bot a moment to start
         time.sleep(3)
@@ -61,4 +69,17 @@ class Command(BaseCommand):
             # Clean up bot process
             if bot_process.poll() is None:
                 bot_process.terminate()
-                bot_process.wait() 
\ No newline at end of file
+                bot_process.wait() 
+
+    def run_webhook(self, host, port):
+        """Run the ASGI app under uvicorn in one worker; the bot starts inside it at server startup"""
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError('Webhook mode needs an ASGI server: pip install uvicorn')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Starting Django ASGI server with the Telegram webhook on {host}:{port}')
+        )
+        self.stdout.write('Register the webhook URL with: python manage.py setwebhook')
+        uvicorn.run('lottolite.asgi:application', host=host, port=port, lifespan='on')
@@ -0,0 +1,70 @@
+import asyncio
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from telegram import Bot, Update
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Point Telegram at the /telegram/webhook/ route (or switch back to polling with --delete)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            type=str,
+            help='Public webhook URL (default: TELEGRAM_WEBHOOK_URL, or BASE_URL plus the webhook path)',
+        )
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            help='Remove the webhook so the bot can use polling again',
+        )
+        parser.add_argument(
+            '--drop-pending-updates',
+            action='store_true',
+            help='Discard updates Telegram has queued for the bot',
+        )
+
+    def handle(self, *args, **options):
+        token = os.getenv('BOT_TOKEN')
+        if not token:
+            raise CommandError('BOT_TOKEN not found in environment variables')
+
+        if options['delete']:
+            asyncio.run(self.delete_webhook(token, options['drop_pending_updates']))
+            self.stdout.write(self.style.SUCCESS('Webhook removed; run the bot with runbot to poll'))
+            return
+
+        if not settings.TELEGRAM_WEBHOOK_SECRET:
+            raise CommandError('Set TELEGRAM_WEBHOOK_SECRET before enabling webhook mode')
+
+        url = options['url'] or settings.TELEGRAM_WEBHOOK_URL
+        if not url:
+            base_url = os.getenv('BASE_URL')
+            if not base_url:
+                raise CommandError('Pass --url or set TELEGRAM_WEBHOOK_URL or BASE_URL')
+            url = base_url.rstrip('/') + reverse('bot:telegram_webhook')
+
+        info = asyncio.run(self.set_webhook(token, url, options['drop_pending_updates']))
+        self.stdout.write(self.style.SUCCESS(f'Webhook set to {info.url}'))
+        self.stdout.write(f'Pending updates: {info.pending_update_count}')
+        if info.last_error_message:
+            self.stdout.write(self.style.WARNING(f'Last delivery error: {info.last_error_message}'))
+
+    async def set_webhook(self, token, url, drop_pending_updates):
+        async with Bot(token) as bot:
+            await bot.set_webhook(
+                url,
+                secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=drop_pending_updates
+            )
+            return await bot.get_webhook_info()
+
+    async def delete_webhook(self, token, drop_pending_updates):
+        async with Bot(token) as bot:
+            await bot.delete_webhook(drop_pending_updates=drop_pending_updates)
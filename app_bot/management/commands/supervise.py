@@ -0,0 +1,225 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from app_bot.metrics import clear_multiprocess_dir
+from app_bot.sharding import POLL_TIMEOUT
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A child that stays up this long counts as stable again and its backoff resets
+STABLE_SECONDS = 60
+# Default shutdown grace: a bot worker may be inside a getUpdates long poll when SIGTERM arrives
+DEFAULT_GRACE = POLL_TIMEOUT + 15
+
+
+class Child:
+    """A supervised process whose output is forwarded line by line with a name prefix"""
+
+    def __init__(self, name, argv, write, pass_fds=()):
+        self.name = name
+        self.argv = argv
+        self.write = write
+        self.pass_fds = pass_fds
+        self.process = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = None
+
+    def start(self):
+        env = dict(os.environ, PYTHONUNBUFFERED='1', DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'lottolite.settings'
+        ))
+        self.process = subprocess.Popen(
+            self.argv,
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            pass_fds=self.pass_fds,
+            # Signals come from the supervisor only, not straight from the terminal
+            start_new_session=True,
+        )
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        # Drain the pipe continuously so a chatty child never blocks on a full buffer
+        threading.Thread(target=self.forward_output, args=(self.process,), daemon=True).start()
+        self.write(f"[{self.name}] started (pid {self.process.pid})")
+
+    def forward_output(self, process):
+        for line in iter(process.stdout.readline, b''):
+            self.write(f"[{self.name}] {line.decode(errors='replace').rstrip()}")
+        process.stdout.close()
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def signal(self, sig):
+        """
+        Signal the child's whole process group (it leads its own session), so processes it
+        started itself, such as runbot's shard workers, are reached too
+        """
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+
+class Command(BaseCommand):
+    help = 'Run web workers, the Telegram bot and background workers as supervised processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--host',
+            type=str,
+            default='127.0.0.1',
+            help='Host to bind the web workers to (default: 127.0.0.1)',
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8000,
+            help='Port to bind the web workers to (default: 8000)',
+        )
+        parser.add_argument(
+            '--web-workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='uvicorn worker processes sharing the listening socket (default: CPU count)',
+        )
+        parser.add_argument(
+            '--bot-workers',
+            type=int,
+            default=1,
+            help='Polling bot worker processes, 0 when Telegram uses the webhook route (default: 1)',
+        )
+        parser.add_argument(
+            '--provisioning-workers',
+            type=int,
+            default=0,
+            help='run_provisioning_worker processes (default: 0, the bot drains the queue itself)',
+        )
+        parser.add_argument(
+            '--max-backoff',
+            type=float,
+            default=60.0,
+            help='Longest delay between restarts of a crashing process in seconds (default: 60)',
+        )
+        parser.add_argument(
+            '--grace',
+            type=float,
+            default=DEFAULT_GRACE,
+            help=f'Seconds to wait for processes to exit on shutdown before killing them; keep it longer '
+                 f'than the bot\'s {POLL_TIMEOUT}s long poll (default: {DEFAULT_GRACE})',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            raise CommandError('The web workers need uvicorn: pip install uvicorn')
+        if settings.TELEGRAM_WEBHOOK_SECRET and options['web_workers'] > 1:
+            raise CommandError(
+                'Webhook mode serves Telegram updates from a single web worker; use --web-workers 1, '
+                'or unset TELEGRAM_WEBHOOK_SECRET and run polling --bot-workers'
+            )
+
+        self.output_lock = threading.Lock()
+        self.stopping = False
+
+        if settings.METRICS_MULTIPROC_DIR:
+            # Otherwise counters left by the previous run's processes add to this run's
+            os.makedirs(settings.METRICS_MULTIPROC_DIR, exist_ok=True)
+            clear_multiprocess_dir()
+
+        # One listening socket shared by every web worker; the kernel spreads connections
+        listener = socket.create_server((options['host'], options['port']), backlog=2048)
+        listener.set_inheritable(True)
+        fd = listener.fileno()
+
+        manage = str(settings.BASE_DIR / 'manage.py')
+        children = [
+            Child(f'web-{i + 1}', [
+                sys.executable, '-m', 'uvicorn', 'lottolite.asgi:application', '--fd', str(fd), '--lifespan', 'on'
+            ], self.write, pass_fds=(fd,))
+            for i in range(options['web_workers'])
+        ]
+        if options['bot_workers']:
+            children.append(Child('bot', [
+                sys.executable, manage, 'runbot', '--workers', str(options['bot_workers'])
+            ], self.write))
+        children += [
+            Child(f'provisioning-{i + 1}', [sys.executable, manage, 'run_provisioning_worker'], self.write)
+            for i in range(options['provisioning_workers'])
+        ]
+
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Supervising {len(children)} processes; web workers on {options['host']}:{options['port']}"
+        ))
+        for child in children:
+            child.start()
+
+        try:
+            while not self.stopping:
+                self.check_children(children, options['max_backoff'])
+                time.sleep(0.5)
+        finally:
+            self.shutdown(children, options['grace'])
+            listener.close()
+
+    def write(self, line):
+        with self.output_lock:
+            self.stdout.write(line)
+            self.stdout.flush()
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def check_children(self, children, max_backoff):
+        """
+        Restart exited children, backing off exponentially while they keep crashing.
+        This only notices processes that exit; a hung but running process is left alone.
+        """
+        now = time.monotonic()
+        for child in children:
+            if child.running():
+                continue
+            if child.restart_at is None:
+                code = child.process.returncode
+                # Processes the exited child started must not keep running next to its replacement
+                child.signal(signal.SIGKILL)
+                child.failures = 0 if now - child.started_at >= STABLE_SECONDS else child.failures + 1
+                delay = min(2 ** child.failures - 1, max_backoff)
+                child.restart_at = now + delay
+                self.write(self.style.ERROR(f"[{child.name}] exited with code {code}, restarting in {delay:.0f}s"))
+            elif now >= child.restart_at:
+                child.start()
+
+    def shutdown(self, children, grace):
+        """Forward SIGTERM to every process group, then kill whatever is still running after the grace period"""
+        self.write(self.style.WARNING('Shutting down...'))
+        for child in children:
+            child.signal(signal.SIGTERM)
+        deadline = time.monotonic() + grace
+        for child in children:
+            if child.process is None:
+                continue
+            try:
+                child.process.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                self.write(self.style.ERROR(f"[{child.name}] did not stop in {grace:.0f}s, killing it"))
+            # Also reaches members of the group left behind by a child that did exit
+            child.signal(signal.SIGKILL)
+            child.process.wait()
+        self.write(self.style.SUCCESS('All processes stopped'))
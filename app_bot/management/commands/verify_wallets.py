@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand, CommandError
+from app_bot.models import Wallet, WalletCheckpoint
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Verify wallet balances against the transaction ledger since each wallet\'s last checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of wallets verified per query (default: 500)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            action='store_true',
+            help='Record a new checkpoint for every verified wallet with new transactions',
+        )
+        parser.add_argument(
+            '--wallet-id',
+            type=int,
+            help='Verify a specific wallet by ID',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        write_checkpoints = options['checkpoint']
+
+        wallets = Wallet.objects.all()
+        if options.get('wallet_id'):
+            wallets = wallets.filter(id=options['wallet_id'])
+
+        verified_count = 0
+        mismatch_count = 0
+        checkpoint_count = 0
+        last_id = 0
+
+        while True:
+            # Keyset batches keep every query bounded regardless of table size
+            batch = list(
+                wallets.filter(id__gt=last_id).order_by('id').with_ledger()[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            checkpoints = []
+            for wallet in batch:
+                if wallet.balance != wallet.ledger_balance:
+                    # Re-check under a row lock in case a credit landed between the two reads
+                    is_valid, ledger_balance = wallet.verify_balance()
+                    if not is_valid:
+                        mismatch_count += 1
+                        self.stdout.write(
+                            self.style.ERROR(
+                                f"  ✗ Wallet {wallet.id} (user {wallet.user_id}): "
+                                f"balance ${wallet.balance} != ledger ${ledger_balance}"
+                            )
+                        )
+                        logger.error(f"Wallet {wallet.id} balance mismatch: {wallet.balance} != {ledger_balance}")
+                        continue
+                    if write_checkpoints:
+                        checkpoints.append(wallet.create_checkpoint())
+                    verified_count += 1
+                    continue
+
+                verified_count += 1
+                if write_checkpoints and wallet.ledger_last_transaction_id != wallet.checkpoint_transaction_id:
+                    checkpoints.append(WalletCheckpoint(
+                        wallet=wallet,
+                        balance=wallet.ledger_balance,
+                        last_transaction_id=wallet.ledger_last_transaction_id
+                    ))
+
+            WalletCheckpoint.objects.bulk_create([c for c in checkpoints if c.pk is None])
+            checkpoint_count += len(checkpoints)
+            self.stdout.write(f"Verified wallets up to ID {last_id}")
+
+        # Summary
+        self.stdout.write("\n" + "="*50)
+        self.stdout.write("WALLET AUDIT SUMMARY")
+        self.stdout.write("="*50)
+        self.stdout.write(f"Wallets verified: {verified_count}")
+        self.stdout.write(f"Balance mismatches: {mismatch_count}")
+        if write_checkpoints:
+            self.stdout.write(f"Checkpoints created: {checkpoint_count}")
+
+        if mismatch_count:
+            raise CommandError(f"{mismatch_count} wallet(s) do not match their ledger")
+        self.stdout.write(self.style.SUCCESS("All wallet balances match their ledger"))
@@ -0,0 +1,356 @@
+import atexit
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    """Base for metrics keyed by a tuple of label values; every update takes one short lock"""
+
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        """{label values: value} copy for rendering and multi-process files"""
+        with self._lock:
+            return {key: self.copy(value) for key, value in self._values.items()}
+
+    def copy(self, value):
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.touch()
+
+    @staticmethod
+    def merge(values):
+        return sum(values)
+
+
+class Gauge(Metric):
+    """
+    Gauge set by the process, or computed at scrape time by function() returning
+    {label values tuple: value} (such gauges are not written to multi-process files)
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, documentation, labelnames=(), function=None):
+        super().__init__(registry, name, documentation, labelnames)
+        self.function = function
+        self._failing = False
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = value
+        self.registry.touch()
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.touch()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def snapshot(self):
+        if self.function is None:
+            return super().snapshot()
+        try:
+            values = {tuple(str(value) for value in key): value for key, value in self.function().items()}
+        except Exception as e:
+            # Logged once per outage rather than on every scrape (e.g. before migrations run)
+            if not self._failing:
+                logger.error(f"Could not compute gauge {self.name}: {e}")
+            self._failing = True
+            return {}
+        if self._failing:
+            logger.info(f"Gauge {self.name} computed again")
+            self._failing = False
+        return values
+
+    @staticmethod
+    def merge(values):
+        return sum(values)
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; each value is [bucket counts..., sum, count]"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+        self.registry.touch()
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def copy(self, value):
+        return list(value)
+
+    @staticmethod
+    def merge(values):
+        return [sum(column) for column in zip(*values)]
+
+
+class MetricsRegistry:
+    """
+    Process-wide metrics rendered in the Prometheus text format.
+    With a multiprocess_dir each process writes its values to <dir>/<pid>.json every
+    flush_interval seconds (and at exit); render() merges the files of all processes,
+    keeping counters and histograms of exited processes but only live processes' gauges.
+    """
+
+    def __init__(self, prefix='lottolite', multiprocess_dir=None, flush_interval=5.0):
+        self.prefix = prefix
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def register(self, metric_class, name, documentation, labelnames=(), **kwargs):
+        name = f"{self.prefix}_{name}"
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(self, name, documentation, labelnames, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge, name, documentation, labelnames, function=function)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def touch(self):
+        """Start the flush thread on the first update in multi-process mode"""
+        if self._flusher is None and self.multiprocess_dir:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self.flush_forever, daemon=True, name='metrics-flush')
+                    self._flusher.start()
+                    atexit.register(self.flush)
+
+    def snapshot(self, include_functions=True):
+        return {
+            name: metric.snapshot() for name, metric in self.metrics.items()
+            if include_functions or getattr(metric, 'function', None) is None
+        }
+
+    def flush(self):
+        """Write this process's values to the multi-process directory"""
+        if not self.multiprocess_dir:
+            return
+        data = {
+            name: [[list(key), value] for key, value in values.items()]
+            for name, values in self.snapshot(include_functions=False).items()
+        }
+        try:
+            os.makedirs(self.multiprocess_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.multiprocess_dir, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp, os.path.join(self.multiprocess_dir, f"{os.getpid()}.json"))
+        except OSError as e:
+            logger.error(f"Could not write metrics to {self.multiprocess_dir}: {e}")
+
+    def flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def process_snapshots(self):
+        """Values written by other processes: {pid: {metric name: {label values: value}}}"""
+        snapshots = {}
+        for path in glob.glob(os.path.join(self.multiprocess_dir, '*.json')):
+            pid = int(os.path.basename(path)[:-5])
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots[pid] = {name: {tuple(key): value for key, value in values} for name, values in data.items()}
+        return snapshots
+
+    def collect(self):
+        """{metric name: {label values: value}} for this process, merged with the others in multi-process mode"""
+        local = self.snapshot()
+        if not self.multiprocess_dir or not os.path.isdir(self.multiprocess_dir):
+            return local
+
+        merged = {name: {key: [value] for key, value in values.items()} for name, values in local.items()}
+        for pid, snapshot in self.process_snapshots().items():
+            alive = pid_alive(pid)
+            for name, values in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                for key, value in values.items():
+                    merged.setdefault(name, {}).setdefault(key, []).append(value)
+        return {
+            name: {key: self.metrics[name].merge(parts) for key, parts in values.items()}
+            for name, values in merged.items()
+        }
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        collected = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(collected.get(name, {}).items()):
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{format_labels(metric.labelnames, key)} {format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    labels = format_labels(metric.labelnames + ('le',), key + (format_value(bound),))
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                labels = format_labels(metric.labelnames, key)
+                lines.append(f"{name}_sum{labels} {format_value(value[-2])}")
+                lines.append(f"{name}_count{labels} {value[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def clear_multiprocess_dir(path=None):
+    """Remove the files of previous runs; call before starting the processes that share the directory"""
+    for name in glob.glob(os.path.join(path or settings.METRICS_MULTIPROC_DIR, '*.json')):
+        os.remove(name)
+
+
+registry = MetricsRegistry(
+    multiprocess_dir=settings.METRICS_MULTIPROC_DIR or None,
+    flush_interval=settings.METRICS_FLUSH_INTERVAL,
+)
+
+
+def queue_depths():
+    """Pending work per background queue, computed from the database at scrape time"""
+    from .models import Broadcast, Notification, SubPartnerJob
+
+    return {
+        ('notifications',): Notification.objects.filter(status__in=['PENDING', 'SENDING']).count(),
+        ('sub_partner_jobs',): SubPartnerJob.objects.filter(status__in=['PENDING', 'RUNNING']).count(),
+        ('broadcasts',): Broadcast.objects.filter(status__in=['QUEUED', 'RUNNING']).count(),
+    }
+
+
+WEBHOOK_SECONDS = registry.histogram(
+    'payment_webhook_seconds', 'Payment webhook handling time by outcome', ['outcome']
+)
+NOWPAYMENTS_SECONDS = registry.histogram(
+    'nowpayments_request_seconds', 'NOWPayments API call latency by endpoint', ['endpoint']
+)
+NOWPAYMENTS_ERRORS = registry.counter(
+    'nowpayments_request_errors_total', 'Failed NOWPayments API calls by endpoint and reason', ['endpoint', 'reason']
+)
+BOT_HANDLER_SECONDS = registry.histogram(
+    'bot_handler_seconds', 'Bot handler latency by handler', ['handler']
+)
+BOT_HANDLER_ERRORS = registry.counter(
+    'bot_handler_errors_total', 'Bot handlers that raised, by handler', ['handler']
+)
+BOT_UPDATE_QUEUE = registry.gauge(
+    'bot_update_queue_size', 'Telegram updates fetched but not yet handled'
+)
+DEPOSITS_CREATED = registry.counter(
+    'deposits_created_total', 'Deposit payments created with NOWPayments by currency', ['currency']
+)
+WALLET_CREDITS = registry.counter(
+    'wallet_credits_total', 'Wallet credits by transaction type', ['type']
+)
+WALLET_CREDITED_USD = registry.counter(
+    'wallet_credited_usd_total', 'USD credited to wallets by transaction type', ['type']
+)
+QUEUE_DEPTH = registry.gauge(
+    'queue_depth', 'Items waiting in background queues', ['queue'], function=queue_depths
+)
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bot', '0002_wallet_checkpoints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=models.CharField(choices=[('DEPOSIT', 'Deposit'), ('PURCHASE', 'Purchase'), ('WINNING', 'Winnings'), ('REFUND', 'Refund'), ('WITHDRAWAL', 'Withdrawal'), ('OPENING', 'Opening Balance')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='PaymentArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('payment_id', models.UUIDField(unique=True)),
+                ('amount_usd', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('crypto_amount', models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True)),
+                ('currency', models.CharField(max_length=10)),
+                ('nowpayments_id', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('payment_address', models.CharField(blank=True, max_length=255, null=True)),
+                ('payment_extra_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('CONFIRMING', 'Confirming'), ('CONFIRMED', 'Confirmed'), ('SENDING', 'Sending'), ('PARTIALLY_PAID', 'Partially Paid'), ('FINISHED', 'Finished'), ('FAILED', 'Failed'), ('EXPIRED', 'Expired'), ('REFUNDED', 'Refunded')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('is_processed', models.BooleanField(default=False)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_payments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at'], name='payment_archive_user_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TransactionArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('transaction_type', models.CharField(choices=[('DEPOSIT', 'Deposit'), ('PURCHASE', 'Purchase'), ('WINNING', 'Winnings'), ('REFUND', 'Refund'), ('WITHDRAWAL', 'Withdrawal'), ('OPENING', 'Opening Balance')], max_length=20)),
+                ('description', models.TextField(blank=True)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_transactions', to='app_bot.wallet')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['wallet', '-created_at'], name='transaction_archive_wallet_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:04
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_transaction_count(apps, schema_editor):
+    """Count live transactions (excluding carried-forward OPENING entries) plus archived ones"""
+    Wallet = apps.get_model('app_bot', 'Wallet')
+    Transaction = apps.get_model('app_bot', 'Transaction')
+    TransactionArchive = apps.get_model('app_bot', 'TransactionArchive')
+
+    def count_of(queryset):
+        counts = queryset.filter(wallet=OuterRef('pk')).order_by().values('wallet').annotate(n=Count('id')).values('n')
+        return Coalesce(Subquery(counts), Value(0))
+
+    Wallet.objects.update(
+        transaction_count=count_of(Transaction.objects.exclude(transaction_type='OPENING'))
+        + count_of(TransactionArchive.objects.all())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bot', '0004_sub_partner_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='transaction_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_transaction_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:11
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bot', '0006_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('USER', 'User data'), ('CHAT', 'Chat data'), ('BOT', 'Bot data'), ('CONVERSATION', 'Conversation state')], max_length=20)),
+                ('key', models.CharField(max_length=255)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'key'), name='bot_state_kind_key_uniq')],
+            },
+        ),
+    ]
@@ -1,16 +1,61 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import ExpressionWrapper, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from app_account.models import User
+from .metrics import WALLET_CREDITED_USD, WALLET_CREDITS
 import uuid
 from decimal import Decimal
+from django.utils import timezone
+
+
+def record_credit(amount, transaction_type):
+    """Count a committed wallet credit in app_bot.metrics"""
+    WALLET_CREDITS.inc(type=transaction_type)
+    WALLET_CREDITED_USD.inc(float(amount), type=transaction_type)
+
+
+class WalletQuerySet(models.QuerySet):
+    def with_ledger(self):
+        """
+        Annotate each wallet with the balance implied by its latest checkpoint plus the
+        transactions recorded after it (ledger_balance, ledger_last_transaction_id)
+        """
+        checkpoints = WalletCheckpoint.objects.filter(wallet=OuterRef('pk')).order_by('-last_transaction_id', '-id')
+        zero = Value(Decimal('0.00'), output_field=models.DecimalField(max_digits=10, decimal_places=2))
+        wallets = self.annotate(
+            checkpoint_balance=Coalesce(Subquery(checkpoints.values('balance')[:1]), zero),
+            checkpoint_transaction_id=Coalesce(Subquery(checkpoints.values('last_transaction_id')[:1]), Value(0)),
+        )
+        recent = Transaction.objects.filter(
+            wallet=OuterRef('pk'),
+            id__gt=OuterRef('checkpoint_transaction_id'),
+        ).order_by().values('wallet')
+        return wallets.annotate(
+            ledger_total=Coalesce(Subquery(recent.annotate(total=Sum('amount')).values('total')), zero),
+            ledger_last_transaction_id=Coalesce(
+                Subquery(recent.annotate(last=Max('id')).values('last')),
+                'checkpoint_transaction_id',
+            ),
+        ).annotate(
+            ledger_balance=ExpressionWrapper(
+                F('checkpoint_balance') + F('ledger_total'),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
 
 
 class Wallet(models.Model):
     """User wallet for managing funds"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='wallet')
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    # Maintained by add_funds/deduct_funds so /balance never has to COUNT(*) the history
+    transaction_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = WalletQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.telegram_full_name}'s Wallet - ${self.balance}"
 
@@ -20,20 +65,23 @@ class Wallet(models.Model):
 
     def add_funds(self, amount, transaction_type="DEPOSIT"):
         """Add funds to wallet and create transaction record"""
-        self.balance += amount
-        self.save()
-        Transaction.objects.create(
-            wallet=self,
-            amount=amount,
-            transaction_type=transaction_type,
-            balance_after=self.balance
-        )
+        with transaction.atomic():
+            self._apply(Wallet.objects.filter(pk=self.pk), amount)
+            Transaction.objects.create(
+                wallet=self,
+                amount=amount,
+                transaction_type=transaction_type,
+                balance_after=self.balance
+            )
+            transaction.on_commit(lambda: record_credit(amount, transaction_type))
 
     def deduct_funds(self, amount, transaction_type="PURCHASE"):
         """Deduct funds from wallet and create transaction record"""
-        if self.can_afford(amount):
-            self.balance -= amount
-            self.save()
+        with transaction.atomic():
+            # The balance check and the deduction happen in one UPDATE
+            if not self._apply(Wallet.objects.filter(pk=self.pk, balance__gte=amount), -amount):
+                self.refresh_from_db(fields=['balance', 'transaction_count'])
+                return False
             Transaction.objects.create(
                 wallet=self,
                 amount=-amount,
@@ -41,7 +89,52 @@ class Wallet(models.Model):
                 balance_after=self.balance
             )
             return True
-        return False
+
+    def _apply(self, wallets, amount):
+        """Atomically change the balance and bump the transaction counter; returns whether a row changed"""
+        updated = wallets.update(
+            balance=F('balance') + amount,
+            transaction_count=F('transaction_count') + 1,
+            updated_at=timezone.now()
+        )
+        if updated:
+            # The row is locked until commit, so this is the balance our transaction produced
+            self.refresh_from_db(fields=['balance', 'transaction_count', 'updated_at'])
+        return updated == 1
+
+    def latest_checkpoint(self):
+        """Most recent balance checkpoint for this wallet"""
+        return self.checkpoints.order_by('-last_transaction_id', '-id').first()
+
+    def ledger_state(self):
+        """
+        Balance implied by the latest checkpoint plus the transactions after it
+        Returns: (ledger_balance, last_transaction_id)
+        """
+        checkpoint = self.latest_checkpoint()
+        opening = checkpoint.balance if checkpoint else Decimal('0.00')
+        since = checkpoint.last_transaction_id if checkpoint else 0
+        recent = self.transactions.filter(id__gt=since).aggregate(total=Sum('amount'), last=Max('id'))
+        return opening + (recent['total'] or Decimal('0.00')), recent['last'] or since
+
+    def verify_balance(self):
+        """
+        Check the stored balance against the ledger since the last checkpoint
+        Returns: (is_valid, ledger_balance)
+        """
+        with transaction.atomic():
+            balance = Wallet.objects.select_for_update().values_list('balance', flat=True).get(pk=self.pk)
+            ledger_balance, _ = self.ledger_state()
+        return balance == ledger_balance, ledger_balance
+
+    def create_checkpoint(self):
+        """Record the current ledger balance so later audits only sum newer transactions"""
+        ledger_balance, last_transaction_id = self.ledger_state()
+        return WalletCheckpoint.objects.create(
+            wallet=self,
+            balance=ledger_balance,
+            last_transaction_id=last_transaction_id
+        )
 
 
 class Payment(models.Model):
@@ -77,6 +170,9 @@ class Payment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='payment_user_history_idx'),
+        ]
 
 
 class Transaction(models.Model):
@@ -87,6 +183,7 @@ class Transaction(models.Model):
         ('WINNING', 'Winnings'),
         ('REFUND', 'Refund'),
         ('WITHDRAWAL', 'Withdrawal'),
+        ('OPENING', 'Opening Balance'),
     ]
 
     wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='transactions')
@@ -101,3 +198,188 @@ class Transaction(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['wallet', 'id'], name='transaction_wallet_id_idx'),
+            models.Index(fields=['wallet', '-created_at', '-id'], name='transaction_history_idx'),
+        ]
+
+
+class WalletCheckpoint(models.Model):
+    """Audited wallet balance up to and including a given transaction"""
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='checkpoints')
+    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    last_transaction_id = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Checkpoint for wallet {self.wallet_id} at transaction {self.last_transaction_id} - ${self.balance}"
+
+    class Meta:
+        ordering = ['-last_transaction_id']
+        indexes = [
+            models.Index(fields=['wallet', '-last_transaction_id'], name='checkpoint_wallet_txn_idx'),
+        ]
+
+
+class PaymentArchive(models.Model):
+    """Payments in a final state moved out of the live Payment table"""
+    id = models.BigIntegerField(primary_key=True)
+    payment_id = models.UUIDField(unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_payments')
+    amount_usd = models.DecimalField(max_digits=10, decimal_places=2)
+    crypto_amount = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    currency = models.CharField(max_length=10)
+    nowpayments_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    payment_address = models.CharField(max_length=255, null=True, blank=True)
+    payment_extra_id = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=Payment.PAYMENT_STATUS)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    expires_at = models.DateTimeField(null=True, blank=True)
+    is_processed = models.BooleanField(default=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived payment {self.payment_id} - ${self.amount_usd}"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='payment_archive_user_idx'),
+        ]
+
+
+class TransactionArchive(models.Model):
+    """Wallet transactions moved out of the live Transaction table"""
+    id = models.BigIntegerField(primary_key=True)
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='archived_transactions')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    transaction_type = models.CharField(max_length=20, choices=Transaction.TRANSACTION_TYPES)
+    description = models.TextField(blank=True)
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived transaction {self.id} - {self.get_transaction_type_display()} - ${self.amount}"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['wallet', '-created_at'], name='transaction_archive_wallet_idx'),
+        ]
+
+
+class SubPartnerJob(models.Model):
+    """Queued NOWPayments sub-partner account creation for a user"""
+    JOB_STATUS = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='sub_partner_job')
+    status = models.CharField(max_length=20, choices=JOB_STATUS, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sub-partner job for {self.user} - {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='subpartner_job_due_idx'),
+        ]
+
+
+class BotState(models.Model):
+    """Persisted bot state (user/chat/bot data and conversation states) shared by bot workers"""
+    STATE_KINDS = [
+        ('USER', 'User data'),
+        ('CHAT', 'Chat data'),
+        ('BOT', 'Bot data'),
+        ('CONVERSATION', 'Conversation state'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=STATE_KINDS)
+    # User/chat ID, conversation "<name>:<key>" or "" for bot data
+    key = models.CharField(max_length=255)
+    data = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.key}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key'], name='bot_state_kind_key_uniq'),
+        ]
+
+
+class Notification(models.Model):
+    """Outbound Telegram message queued for the bot, e.g. a deposit confirmation"""
+    NOTIFICATION_STATUS = [
+        ('PENDING', 'Pending'),
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications')
+    chat_id = models.CharField(max_length=255)
+    message = models.TextField()
+    status = models.CharField(max_length=20, choices=NOTIFICATION_STATUS, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Notification to {self.user} - {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='notification_queue_idx'),
+        ]
+
+
+class Broadcast(models.Model):
+    """Message sent to every bot user, with a checkpoint so an interrupted run resumes"""
+    BROADCAST_STATUS = [
+        ('DRAFT', 'Draft'),
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+    ]
+
+    message = models.TextField()
+    status = models.CharField(max_length=20, choices=BROADCAST_STATUS, default='DRAFT')
+    # Every user with a lower or equal pk has been sent to
+    last_user_id = models.BigIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Broadcast {self.id} - {self.status}"
+
+
+class CommandCheckpoint(models.Model):
+    """Progress of a resumable management command"""
+    name = models.CharField(max_length=100, unique=True)
+    # Highest primary key below which every row has been handled
+    position = models.BigIntegerField(default=0)
+    data = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.position}"
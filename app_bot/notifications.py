@@ -0,0 +1,72 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+# A SENDING notification not touched for this long belongs to a bot that died mid-batch
+SENDING_LEASE = timedelta(minutes=5)
+
+
+def deposit_message(payment, wallet):
+    """Confirmation text for a credited deposit"""
+    return (
+        f"✅ Deposit Confirmed!\n\n"
+        f"💰 ${payment.amount_usd:.2f} has been added to your wallet.\n"
+        f"💼 New balance: ${wallet.balance:.2f}\n\n"
+        f"Use /balance or /transactions for details."
+    )
+
+
+def enqueue_deposit_notification(payment, wallet):
+    """Queue a deposit confirmation for the bot to send"""
+    return Notification.objects.create(
+        user=payment.user,
+        payment=payment,
+        chat_id=payment.user.telegram_id,
+        message=deposit_message(payment, wallet)
+    )
+
+
+def claim_notifications(limit=50):
+    """
+    Atomically mark a batch of due notifications SENDING so only one bot sends them
+    Returns: list of {'id', 'chat_id', 'message', 'attempts'} dicts
+    """
+    now = timezone.now()
+    due = Q(status='PENDING') | Q(status='SENDING', updated_at__lt=now - SENDING_LEASE)
+    ids = list(Notification.objects.filter(due).order_by('id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    Notification.objects.filter(due, id__in=ids).update(status='SENDING', updated_at=now)
+    # Another bot may have claimed some of them between the two queries
+    return list(
+        Notification.objects.filter(id__in=ids, status='SENDING', updated_at=now)
+        .values('id', 'chat_id', 'message', 'attempts')
+    )
+
+
+def mark_sent(ids):
+    """Record delivered notifications"""
+    now = timezone.now()
+    Notification.objects.filter(id__in=ids).update(
+        status='SENT', attempts=F('attempts') + 1, last_error='', sent_at=now, updated_at=now
+    )
+
+
+def mark_failed(notification_id, attempts, error, retry=True):
+    """Put a notification back in the queue, or give up after BOT_NOTIFICATION_MAX_ATTEMPTS"""
+    attempts += 1
+    failed = not retry or attempts >= settings.BOT_NOTIFICATION_MAX_ATTEMPTS
+    Notification.objects.filter(id=notification_id).update(
+        status='FAILED' if failed else 'PENDING',
+        attempts=attempts,
+        last_error=str(error),
+        updated_at=timezone.now()
+    )
+    logger.warning(f"Failed to send notification {notification_id} (attempt {attempts}): {error}")
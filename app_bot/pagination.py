@@ -0,0 +1,85 @@
+from datetime import datetime, timezone as dt_timezone
+from itertools import chain
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Payment, PaymentArchive, Transaction, TransactionArchive
+
+PAYMENT_FIELDS = ['id', 'payment_id', 'amount_usd', 'crypto_amount', 'currency', 'status', 'created_at']
+TRANSACTION_FIELDS = ['id', 'amount', 'transaction_type', 'balance_after', 'created_at']
+
+
+def encode_cursor(row):
+    """Compact (created_at, id) cursor that fits in Telegram's 64-byte callback data"""
+    created_at = row['created_at']
+    micros = int(created_at.timestamp()) * 1_000_000 + created_at.microsecond
+    return f"{micros}.{row['id']}"
+
+
+def decode_cursor(token):
+    micros, pk = token.split('.')
+    seconds, micro = divmod(int(micros), 1_000_000)
+    created_at = datetime.fromtimestamp(seconds, tz=dt_timezone.utc).replace(microsecond=micro)
+    return created_at, int(pk)
+
+
+def ordered_rows(querysets, fields, order, limit):
+    """
+    The first limit rows of several querysets in (created_at, id) order.
+    Archived rows keep their live id, so (created_at, id) stays unique across the tables.
+    """
+    rows = chain.from_iterable(queryset.order_by(*order).values(*fields)[:limit] for queryset in querysets)
+    return sorted(rows, key=lambda row: (row['created_at'], row['id']), reverse=order[0].startswith('-'))[:limit]
+
+
+def keyset_page(queryset, fields, cursor=None, direction='next', page_size=None, archive=None):
+    """
+    One page of queryset, newest first, keyed on (created_at, id) so every page is a
+    single bounded index range scan however long the history is.
+    cursor is the encoded first/last row of the page being paged from. archive is an
+    archive table queryset merged into the same order (one more range scan per page).
+    Returns: (rows, prev_cursor, next_cursor)
+    """
+    page_size = page_size or settings.BOT_HISTORY_PAGE_SIZE
+    querysets = [queryset] if archive is None else [queryset, archive]
+
+    if cursor and direction == 'prev':
+        created_at, pk = decode_cursor(cursor)
+        newer = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        rows = ordered_rows([qs.filter(newer) for qs in querysets], fields, ('created_at', 'id'), page_size + 1)
+        if len(rows) > page_size:
+            rows = rows[:page_size][::-1]
+            return rows, encode_cursor(rows[0]), encode_cursor(rows[-1])
+        # Reached the newest rows: show a full first page instead of a short one
+        return keyset_page(queryset, fields, page_size=page_size, archive=archive)
+
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        older = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        querysets = [qs.filter(older) for qs in querysets]
+    rows = ordered_rows(querysets, fields, ('-created_at', '-id'), page_size + 1)
+    has_older = len(rows) > page_size
+    rows = rows[:page_size]
+    prev_cursor = encode_cursor(rows[0]) if cursor and rows else None
+    next_cursor = encode_cursor(rows[-1]) if has_older else None
+    return rows, prev_cursor, next_cursor
+
+
+def payment_page(user, cursor=None, direction='next', page_size=None, include_archived=False):
+    """Page of the user's payments with only the columns the bot displays, optionally with archived ones"""
+    archive = PaymentArchive.objects.filter(user=user) if include_archived else None
+    return keyset_page(Payment.objects.filter(user=user), PAYMENT_FIELDS, cursor, direction, page_size, archive)
+
+
+def transaction_page(user, cursor=None, direction='next', page_size=None, include_archived=False):
+    """
+    Page of the user's wallet transactions with only the columns the bot displays.
+    With include_archived the archived rows replace the OPENING entry that summarises them.
+    """
+    transactions = Transaction.objects.filter(wallet__user=user)
+    archive = None
+    if include_archived:
+        transactions = transactions.exclude(transaction_type='OPENING')
+        archive = TransactionArchive.objects.filter(wallet__user=user)
+    return keyset_page(transactions, TRANSACTION_FIELDS, cursor, direction, page_size, archive)
@@ -0,0 +1,121 @@
+import json
+import logging
+from copy import deepcopy
+
+from django.conf import settings
+from telegram.ext import BasePersistence, PersistenceInput
+
+from .db import db_sync_to_async
+from .models import BotState
+
+logger = logging.getLogger(__name__)
+
+
+def conversation_key(name, key):
+    """BotState key for one ConversationHandler entry, e.g. 'deposit:[1001, 1001]'"""
+    return f"{name}:{json.dumps(list(key))}"
+
+
+def conversation_owner(key):
+    """
+    The user a ConversationHandler key belongs to, for sharding: the second element of
+    the default (chat_id, user_id[, message_id]) key, or the only ID of a one-element key
+    """
+    return key[1] if len(key) > 1 else key[0]
+
+
+@db_sync_to_async
+def load_states(kind, key_prefix=''):
+    """{key: data} for all stored states of one kind"""
+    states = BotState.objects.filter(kind=kind)
+    if key_prefix:
+        states = states.filter(key__startswith=key_prefix)
+    return dict(states.values_list('key', 'data'))
+
+
+@db_sync_to_async
+def save_state(kind, key, data):
+    """Store one state; empty data deletes it so the table only holds live state"""
+    if data is None or data == {}:
+        BotState.objects.filter(kind=kind, key=key).delete()
+    else:
+        BotState.objects.update_or_create(kind=kind, key=key, defaults={'data': data})
+
+
+class DjangoPersistence(BasePersistence):
+    """
+    Stores the bot's user/chat/bot data and conversation states in the BotState table,
+    so a restarted bot worker picks up users in the middle of a conversation.
+    shard=(index, count) loads only the users and chats routed to that worker.
+    Data must be JSON serialisable.
+    """
+
+    def __init__(self, shard=None, store_data=None, update_interval=None):
+        super().__init__(
+            store_data=store_data or PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval or settings.BOT_PERSISTENCE_INTERVAL
+        )
+        self.shard = shard
+
+    def in_shard(self, key):
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return int(key) % count == index
+
+    async def get_user_data(self):
+        states = await load_states('USER')
+        return {int(key): data for key, data in states.items() if self.in_shard(key)}
+
+    async def get_chat_data(self):
+        states = await load_states('CHAT')
+        return {int(key): data for key, data in states.items() if self.in_shard(key)}
+
+    async def get_bot_data(self):
+        states = await load_states('BOT')
+        return states.get('', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        states = await load_states('CONVERSATION', f"{name}:")
+        conversations = {tuple(json.loads(key[len(name) + 1:])): state for key, state in states.items()}
+        return {key: state for key, state in conversations.items() if self.in_shard(conversation_owner(key))}
+
+    async def update_conversation(self, name, key, new_state):
+        await save_state('CONVERSATION', conversation_key(name, key), new_state)
+
+    async def update_user_data(self, user_id, data):
+        await save_state('USER', str(user_id), deepcopy(data))
+
+    async def update_chat_data(self, chat_id, data):
+        await save_state('CHAT', str(chat_id), deepcopy(data))
+
+    async def update_bot_data(self, data):
+        await save_state('BOT', '', deepcopy(data))
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await save_state('USER', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        await save_state('CHAT', str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        # PTB hands changes to the update_* methods every update_interval seconds and once
+        # more in Application.shutdown() (just before this), and each is written straight
+        # to the database, so there is nothing left to flush. A worker killed without a
+        # clean shutdown loses up to one interval of state.
+        pass
@@ -0,0 +1,170 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from app_account.models import User
+from .db import recycle_connections
+from .models import SubPartnerJob
+from .services import NOWPaymentsService
+from .user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+# A RUNNING job not touched for this long belongs to a worker that died
+RUNNING_LEASE = timedelta(minutes=5)
+
+
+def build_sub_partner_data(user):
+    """NOWPayments sub-partner payload for a Django user"""
+    return {
+        'telegram_id': user.telegram_id,
+        'telegram_username': user.telegram_username,
+        'telegram_full_name': user.telegram_full_name,
+        'email': f"user_{user.telegram_id}@telegram.com",
+        'name': user.telegram_full_name or f"User {user.telegram_id}"
+    }
+
+
+def request_sub_partner_id(service, user):
+    """Create a sub-partner account through the API; returns its ID or None"""
+    response = service.create_sub_partner_account(build_sub_partner_data(user))
+    if response and 'result' in response and 'id' in response['result']:
+        return str(response['result']['id'])
+    return None
+
+
+def remember_sub_partner_id(user, sub_partner_id):
+    """Set the ID on user and its user_cache entry, so /start and /balance stop looking it up"""
+    user.nowpayments_sub_partner_id = sub_partner_id
+    user_cache.update(user.telegram_id, nowpayments_sub_partner_id=sub_partner_id)
+
+
+def stored_sub_partner_id(user):
+    """Sub-partner ID from the database, refreshing a possibly stale (cached) user"""
+    if not user.nowpayments_sub_partner_id:
+        sub_partner_id = User.objects.filter(pk=user.pk).values_list(
+            'nowpayments_sub_partner_id', flat=True
+        ).first()
+        if sub_partner_id:
+            remember_sub_partner_id(user, sub_partner_id)
+    return user.nowpayments_sub_partner_id
+
+
+def enqueue_sub_partner(user):
+    """Queue sub-partner creation for a user that does not have an account yet"""
+    if stored_sub_partner_id(user):
+        return None
+    job, created = SubPartnerJob.objects.get_or_create(user=user)
+    if created:
+        logger.info(f"Queued NOWPayments sub-partner account for user {user.telegram_id}")
+    return job
+
+
+def retry_delay(attempts):
+    """Exponential backoff between attempts, capped at SUB_PARTNER_RETRY_MAX_SECONDS"""
+    delay = settings.SUB_PARTNER_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, settings.SUB_PARTNER_RETRY_MAX_SECONDS))
+
+
+def claim_job(job_id, force=False):
+    """
+    Atomically mark a job RUNNING so only one worker processes it.
+    force claims PENDING/FAILED jobs before their retry time (a user is waiting on them).
+    """
+    now = timezone.now()
+    claimable = Q(status='RUNNING', updated_at__lt=now - RUNNING_LEASE)
+    if force:
+        claimable |= Q(status__in=['PENDING', 'FAILED'])
+    else:
+        claimable |= Q(status='PENDING', next_attempt_at__lte=now)
+    return SubPartnerJob.objects.filter(claimable, pk=job_id).update(status='RUNNING', updated_at=now) == 1
+
+
+def run_job(job, service):
+    """Create the sub-partner account for a claimed job, scheduling a retry on failure"""
+    user = job.user
+    error = ''
+    try:
+        sub_partner_id = stored_sub_partner_id(user) or request_sub_partner_id(service, user)
+    except Exception as e:
+        sub_partner_id = None
+        error = str(e)
+
+    if sub_partner_id:
+        User.objects.filter(pk=user.pk).update(nowpayments_sub_partner_id=sub_partner_id)
+        remember_sub_partner_id(user, sub_partner_id)
+        SubPartnerJob.objects.filter(pk=job.pk).update(
+            status='DONE', attempts=job.attempts + 1, last_error='', updated_at=timezone.now()
+        )
+        logger.info(f"Created NOWPayments sub-partner account for user {user.telegram_id}: {sub_partner_id}")
+        return sub_partner_id
+
+    attempts = job.attempts + 1
+    failed = attempts >= settings.SUB_PARTNER_MAX_ATTEMPTS
+    SubPartnerJob.objects.filter(pk=job.pk).update(
+        status='FAILED' if failed else 'PENDING',
+        attempts=attempts,
+        next_attempt_at=timezone.now() + retry_delay(attempts),
+        last_error=error or 'Unexpected response from NOWPayments',
+        updated_at=timezone.now()
+    )
+    logger.warning(
+        f"Failed to create NOWPayments sub-partner account for user {user.telegram_id} "
+        f"(attempt {attempts}{', giving up' if failed else ''})"
+    )
+    return None
+
+
+def drain_sub_partner_jobs(limit=20, service=None):
+    """
+    Process due jobs from the provisioning queue
+    Returns: number of jobs processed
+    """
+    recycle_connections()
+    try:
+        now = timezone.now()
+        due = SubPartnerJob.objects.filter(
+            Q(status='PENDING', next_attempt_at__lte=now) | Q(status='RUNNING', updated_at__lt=now - RUNNING_LEASE)
+        ).order_by('next_attempt_at').values_list('pk', flat=True)[:limit]
+
+        processed = 0
+        for job_id in list(due):
+            if not claim_job(job_id):
+                continue
+            service = service or NOWPaymentsService()
+            run_job(SubPartnerJob.objects.select_related('user').get(pk=job_id), service)
+            processed += 1
+        return processed
+    finally:
+        recycle_connections()
+
+
+def wait_for_sub_partner(user, timeout=None):
+    """
+    Return the user's sub-partner ID, creating the account now if nobody else is.
+    Used when a deposit actually needs the ID; waits for a worker already running the job.
+    """
+    recycle_connections()
+    try:
+        job = enqueue_sub_partner(user)
+        if job is None:
+            return user.nowpayments_sub_partner_id
+
+        deadline = time.monotonic() + (timeout or settings.SUB_PARTNER_WAIT_TIMEOUT)
+        while True:
+            if claim_job(job.pk, force=True):
+                job.refresh_from_db()
+                job.user = user
+                return run_job(job, NOWPaymentsService())
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.5)
+            user.nowpayments_sub_partner_id = None
+            if stored_sub_partner_id(user):
+                return user.nowpayments_sub_partner_id
+    finally:
+        recycle_connections()
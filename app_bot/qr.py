@@ -0,0 +1,110 @@
+import asyncio
+import io
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import qrcode
+from django.conf import settings
+
+
+def qr_payload(payment_address, amount=None, currency=None):
+    """Data encoded in a payment QR code"""
+    if amount and currency:
+        # Round amount to 8 decimal places for QR code
+        rounded_amount = round(float(amount), 8)
+        return f"{currency}:{payment_address}?amount={rounded_amount}"
+    return payment_address
+
+
+def render_qr_png(payment_address, amount=None, currency=None):
+    """Render a payment QR code as PNG bytes (runs inside the worker pool)"""
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(qr_payload(payment_address, amount, currency))
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class QRRenderer:
+    """
+    Renders payment QR codes on a worker pool so PNG encoding never blocks the event loop.
+    Results are kept in a bounded LRU cache keyed by (address, amount, currency), and
+    concurrent requests for the same key share one render.
+    """
+
+    def __init__(self, max_workers=2, cache_size=256, use_processes=True):
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self.use_processes = use_processes
+        self._executor = None
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.use_processes:
+                # spawn: forking a process that runs an event loop and DB threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='qr')
+        return self._executor
+
+    @staticmethod
+    def cache_key(payment_address, amount=None, currency=None):
+        return payment_address, qr_payload(payment_address, amount, currency)
+
+    def cached(self, key):
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+            return png
+
+    def store(self, key, png):
+        with self._lock:
+            self._cache[key] = png
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def render(self, payment_address, amount=None, currency=None):
+        """PNG bytes for a payment QR code"""
+        key = self.cache_key(payment_address, amount, currency)
+        png = self.cached(key)
+        if png is not None:
+            return png
+
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(self.executor, render_qr_png, payment_address, amount, currency)
+            self._pending[key] = pending
+            try:
+                png = await pending
+                self.store(key, png)
+                return png
+            finally:
+                self._pending.pop(key, None)
+        return await asyncio.shield(pending)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+qr_renderer = QRRenderer(
+    max_workers=getattr(settings, 'BOT_QR_WORKERS', 2),
+    cache_size=getattr(settings, 'BOT_QR_CACHE_SIZE', 256),
+    use_processes=getattr(settings, 'BOT_QR_USE_PROCESSES', True),
+)
@@ -0,0 +1,172 @@
+import contextvars
+import functools
+import logging
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Profile of the request or update being handled; copied into sync_to_async threads
+_active_profile = contextvars.ContextVar('query_profile', default=None)
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+VALUES_LIST = re.compile(r'VALUES (?:\((?:%s, )*%s\), )*\((?:%s, )*%s\)')
+WHITESPACE = re.compile(r'\s+')
+SELECT_COLUMNS = re.compile(r'^SELECT (?:DISTINCT )?.+? FROM ')
+
+
+def query_shape(sql):
+    """SQL with parameter lists collapsed, so queries differing only in values match"""
+    sql = IN_LIST.sub('IN (...)', sql)
+    sql = VALUES_LIST.sub('VALUES (...)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def source_stack():
+    """Stack frames inside the project (no libraries, no profiler), outermost first"""
+    base_dir = str(settings.BASE_DIR)
+    return [
+        frame for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+
+
+class QueryProfile:
+    """Queries run while handling one request or update, grouped by shape"""
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.stacks = {}
+
+    def record(self, sql, seconds):
+        shape = query_shape(sql)
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[shape] += 1
+        if shape not in self.stacks:
+            # Only the first run of a shape pays for the stack walk
+            self.stacks[shape] = source_stack()
+
+    def repeated(self, limit):
+        """(shape, count) for shapes run more than limit times, most frequent first"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > limit]
+
+    def over_budget(self, max_queries, max_ms, max_repeats):
+        """Descriptions of the budgets this profile exceeds"""
+        problems = []
+        if max_queries and self.count > max_queries:
+            problems.append(f"{self.count} queries (budget {max_queries})")
+        if max_ms and self.seconds * 1000 > max_ms:
+            problems.append(f"{self.seconds * 1000:.1f} ms in SQL (budget {max_ms})")
+        if max_repeats and self.repeated(max_repeats):
+            problems.append(f"repeated queries (more than {max_repeats} of one shape)")
+        return problems
+
+    def where(self, shape):
+        stack = self.stacks.get(shape)
+        if not stack:
+            return 'unknown source'
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+    def report(self, problems, max_repeats):
+        lines = [f"Query budget exceeded for {self.label}: {', '.join(problems)}"]
+        for shape, count in self.shapes.most_common(5):
+            # Column lists push the table and WHERE clause out of view
+            summary = SELECT_COLUMNS.sub('SELECT ... FROM ', shape, count=1)
+            lines.append(f"  {count}x {summary[:200]}\n      at {self.where(shape)}")
+        worst = (self.repeated(max_repeats) or self.shapes.most_common(1))[0][0]
+        lines.append("Stack of the most repeated query:")
+        lines.extend(line.rstrip() for line in traceback.format_list(self.stacks.get(worst, [])))
+        return '\n'.join(lines)
+
+
+def profile_execute(execute, sql, params, many, context):
+    """Database execute wrapper recording queries into the active QueryProfile"""
+    profile = _active_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record(sql, time.perf_counter() - started)
+
+
+def install_query_profiler(sender=None, connection=None, **kwargs):
+    """connection_created hook adding profile_execute to every new connection"""
+    if profile_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_execute)
+
+
+def enable_query_profiler():
+    """Profile queries on every connection, including ones already open"""
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(install_query_profiler, dispatch_uid='app_bot_query_profiler')
+    for connection in connections.all(initialized_only=True):
+        install_query_profiler(connection=connection)
+
+
+@contextmanager
+def profile_queries(label):
+    """
+    Record the queries run in this context and log them with a stack trace when
+    they exceed the QUERY_PROFILER_* budgets
+    Returns: the QueryProfile (as the context value)
+    """
+    profile = QueryProfile(label)
+    token = _active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _active_profile.reset(token)
+        max_repeats = settings.QUERY_PROFILER_MAX_REPEATS
+        problems = profile.over_budget(
+            settings.QUERY_PROFILER_MAX_QUERIES, settings.QUERY_PROFILER_MAX_TIME_MS, max_repeats
+        )
+        if problems:
+            logger.warning(profile.report(problems, max_repeats))
+
+
+def profile_handler(handler):
+    """Profile the queries of a bot handler; see profile_queries"""
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        with profile_queries(f"bot handler {handler.__name__}"):
+            return await handler(update, context)
+    return wrapper
+
+
+class QueryProfilerMiddleware:
+    """Profile the queries of each request; enabled with QUERY_PROFILER_ENABLED"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        with profile_queries(f"{request.method} {request.path}"):
+            return self.get_response(request)
+
+    async def acall(self, request):
+        with profile_queries(f"{request.method} {request.path}"):
+            return await self.get_response(request)
@@ -0,0 +1,78 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Set by replica_reads(); contextvars follow the handler into sync_to_async threads
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+_sticky_key = contextvars.ContextVar('replica_sticky_key', default=None)
+
+
+def _pin_cache_key(sticky_key):
+    return f"replica-pin:{sticky_key}"
+
+
+def pin_to_primary(sticky_key):
+    """
+    Keep sticky_key's reads on the primary for DATABASE_REPLICA_STICKY_SECONDS.
+    The pin lives in the Django cache, so a shared cache backend also pins reads in other
+    processes (e.g. the bot after a webhook credit in the web process).
+    """
+    if sticky_key is None or not getattr(settings, 'DATABASE_READ_REPLICA', None):
+        return
+    cache.set(_pin_cache_key(sticky_key), True, settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def is_pinned_to_primary(sticky_key):
+    return sticky_key is not None and cache.get(_pin_cache_key(sticky_key)) is not None
+
+
+@contextmanager
+def sticky_writes(sticky_key):
+    """
+    Pin sticky_key (usually the Telegram ID) to the primary after any write inside the
+    block, so their next replica_reads() see it. Writes happen outside replica_reads() too.
+    """
+    token = _sticky_key.set(None if sticky_key is None else str(sticky_key))
+    try:
+        yield
+    finally:
+        _sticky_key.reset(token)
+
+
+@contextmanager
+def replica_reads(sticky_key=None):
+    """
+    Route ORM reads inside the block to the read replica. sticky_key (usually the Telegram
+    ID) identifies whose writes should pin subsequent reads back to the primary.
+    """
+    reads_token = _replica_reads.set(True)
+    try:
+        with sticky_writes(sticky_key):
+            yield
+    finally:
+        _replica_reads.reset(reads_token)
+
+
+class PrimaryReplicaRouter:
+    """Send reads inside replica_reads() to DATABASE_READ_REPLICA and everything else to default"""
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(settings, 'DATABASE_READ_REPLICA', None)
+        if not replica or not _replica_reads.get():
+            return None
+        if is_pinned_to_primary(_sticky_key.get()):
+            return 'default'
+        return replica
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary(_sticky_key.get())
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
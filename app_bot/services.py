@@ -1,12 +1,15 @@
 import os
 import requests
-import qrcode
-import io
 import base64
 from decimal import Decimal
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
+from .metrics import DEPOSITS_CREATED, NOWPAYMENTS_ERRORS, NOWPAYMENTS_SECONDS
+from .notifications import enqueue_deposit_notification
+from .qr import render_qr_png
+from .routers import pin_to_primary
 
 
 class NOWPaymentsService:
@@ -14,11 +17,10 @@ class NOWPaymentsService:
     
     def __init__(self):
         self.api_key = os.getenv('NOWPAYMENTS_API_KEY')
-        self.base_url = 'https://api.nowpayments.io/v1'
+        self.base_url = settings.NOWPAYMENTS_BASE_URL
         self.jwt_token = None
         
         # Get NOWPayments settings from Django settings
-        from django.conf import settings
         self.currency_from = getattr(settings, 'currency_from', 'BNBBSC')
         self.currency_to = getattr(settings, 'currency_to', 'BNBBSC')
         self.fiat_to = getattr(settings, 'fiat_to', 'USD')
@@ -40,6 +42,22 @@ class NOWPaymentsService:
         
         print(f"API Key Headers: {self.api_key_headers}")
     
+    def request(self, method, path, endpoint=None, **kwargs):
+        """
+        HTTP call to the API, timed and counted per endpoint in app_bot.metrics
+        endpoint is the metric label for paths with IDs in them, e.g. /payment/{id}
+        """
+        endpoint = endpoint or path
+        try:
+            with NOWPAYMENTS_SECONDS.time(endpoint=endpoint):
+                response = requests.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.RequestException as e:
+            NOWPAYMENTS_ERRORS.inc(endpoint=endpoint, reason=type(e).__name__)
+            raise
+        if response.status_code >= 400:
+            NOWPAYMENTS_ERRORS.inc(endpoint=endpoint, reason=str(response.status_code))
+        return response
+
     def get_jwt_token(self):
         """Get JWT token for Bearer authentication"""
         if self.jwt_token:
@@ -65,7 +83,7 @@ class NOWPaymentsService:
             }
             
             print(f"Logging in with email: {email}")
-            response = requests.post(f"{self.base_url}/auth", json=login_data, headers=headers)
+            response = self.request('POST', '/auth', json=login_data, headers=headers)
             print(f"Login response status: {response.status_code}")
             print(f"Login response: {response.text}")
             
@@ -101,7 +119,7 @@ class NOWPaymentsService:
     def get_available_currencies(self):
         """Get list of available cryptocurrencies from merchant coins endpoint"""
         try:
-            response = requests.get(f"{self.base_url}/merchant/coins", headers=self.api_key_headers)
+            response = self.request('GET', '/merchant/coins', headers=self.api_key_headers)
             response.raise_for_status()
             data = response.json()
             
@@ -119,7 +137,7 @@ class NOWPaymentsService:
     def get_currency_info(self, currency):
         """Get information about a specific currency"""
         try:
-            response = requests.get(f"{self.base_url}/currencies/{currency}", headers=self.api_key_headers)
+            response = self.request('GET', f"/currencies/{currency}", endpoint='/currencies/{currency}', headers=self.api_key_headers)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -135,7 +153,7 @@ class NOWPaymentsService:
                 'currency_to': currency_to,
             }
             print(f"Estimated price API call parameters: {params}")
-            response = requests.get(f"{self.base_url}/estimate", params=params, headers=self.api_key_headers)
+            response = self.request('GET', '/estimate', params=params, headers=self.api_key_headers)
             response.raise_for_status()
             result = response.json()
             print(f"Estimated price API response: {result}")
@@ -156,7 +174,7 @@ class NOWPaymentsService:
             print(f"Creating payment with payload: {payload}")
             print(f"API URL: {self.base_url}/sub-partner/payment")
             
-            response = requests.post(f"{self.base_url}/sub-partner/payment", data=payload, headers=self.api_key_headers)
+            response = self.request('POST', '/sub-partner/payment', data=payload, headers=self.api_key_headers)
             
             print(f"Payment creation response status: {response.status_code}")
             print(f"Payment creation response content: {response.text}")
@@ -175,7 +193,7 @@ class NOWPaymentsService:
     def get_payment_status(self, payment_id):
         """Get payment status"""
         try:
-            response = requests.get(f"{self.base_url}/payment/{payment_id}", headers=self.api_key_headers)
+            response = self.request('GET', f"/payment/{payment_id}", endpoint='/payment/{id}', headers=self.api_key_headers)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -193,7 +211,7 @@ class NOWPaymentsService:
                 'is_fee_paid_by_user': str(self.is_fee_paid_by_user).lower()
             }
             print(f"Minimum amount API call parameters: {params}")
-            response = requests.get(f"{self.base_url}/min-amount", params=params, headers=self.api_key_headers)
+            response = self.request('GET', '/min-amount', params=params, headers=self.api_key_headers)
             response.raise_for_status()
             result = response.json()
             print(f"Minimum amount API response: {result}")
@@ -226,7 +244,7 @@ class NOWPaymentsService:
             print(f"Bearer headers: {bearer_headers}")
             
             # Try the sub-partner endpoint with Bearer authentication
-            response = requests.post(f"{self.base_url}/sub-partner/balance", json=data, headers=bearer_headers)
+            response = self.request('POST', '/sub-partner/balance', json=data, headers=bearer_headers)
             
             print(f"Response status: {response.status_code}")
             print(f"Response headers: {response.headers}")
@@ -235,14 +253,14 @@ class NOWPaymentsService:
             # If Bearer auth fails, try with API key auth
             if response.status_code == 401:
                 print("Bearer auth failed, trying with API key auth...")
-                response = requests.post(f"{self.base_url}/sub-partner/balance", json=data, headers=self.api_key_headers)
+                response = self.request('POST', '/sub-partner/balance', json=data, headers=self.api_key_headers)
                 print(f"API Key auth response status: {response.status_code}")
                 print(f"API Key auth response content: {response.text}")
                 
                 # If that also fails, try alternative endpoint
                 if response.status_code == 401:
                     print("API key auth also failed, trying alternative endpoint...")
-                    response = requests.post(f"{self.base_url}/sub-partner", json=data, headers=self.api_key_headers)
+                    response = self.request('POST', '/sub-partner', json=data, headers=self.api_key_headers)
                     print(f"Alternative endpoint response status: {response.status_code}")
                     print(f"Alternative endpoint response content: {response.text}")
                     
@@ -252,7 +270,7 @@ class NOWPaymentsService:
                     self.jwt_token = None  # Reset token
                     bearer_headers = self.get_bearer_headers()
                     if bearer_headers:
-                        response = requests.post(f"{self.base_url}/sub-partner/balance", json=data, headers=bearer_headers)
+                        response = self.request('POST', '/sub-partner/balance', json=data, headers=bearer_headers)
                         print(f"New token response status: {response.status_code}")
                         print(f"New token response content: {response.text}")
             
@@ -275,7 +293,7 @@ class NOWPaymentsService:
                 print("Failed to get Bearer headers for sub-partner balance")
                 return None
                 
-            response = requests.get(f"{self.base_url}/sub-partner/balance/{sub_partner_id}", headers=bearer_headers)
+            response = self.request('GET', f"/sub-partner/balance/{sub_partner_id}", endpoint='/sub-partner/balance/{id}', headers=bearer_headers)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -283,30 +301,9 @@ class NOWPaymentsService:
             return None
 
     def generate_qr_code(self, payment_address, amount=None, currency=None):
-        """Generate QR code for payment address"""
+        """Generate QR code for payment address as base64 PNG (the bot uses app_bot.qr directly)"""
         try:
-            # Create QR code data
-            qr_data = payment_address
-            if amount and currency:
-                # Round amount to 8 decimal places for QR code
-                rounded_amount = round(float(amount), 8)
-                qr_data = f"{currency}:{payment_address}?amount={rounded_amount}"
-            
-            # Generate QR code
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-            
-            # Create image
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            img.save(buffer, format='PNG')
-            buffer.seek(0)
-            image_base64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            return image_base64
+            return base64.b64encode(render_qr_png(payment_address, amount, currency)).decode()
         except Exception as e:
             print(f"Error generating QR code: {e}")
             return None
@@ -318,7 +315,7 @@ class NOWPaymentsService:
                 'limit': limit,
                 'offset': offset
             }
-            response = requests.get(f"{self.base_url}/payment", params=params, headers=self.api_key_headers)
+            response = self.request('GET', '/payment', params=params, headers=self.api_key_headers)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -455,6 +452,7 @@ class PaymentProcessor:
                 payment.save()
                 
                 print(f"Payment created successfully: {payment.payment_id} -> NOWPayments ID: {payment.nowpayments_id}")
+                DEPOSITS_CREATED.inc(currency=currency.lower())
                 return payment, payment_data, None
             else:
                 # payment.delete()
@@ -487,7 +485,7 @@ class PaymentProcessor:
                 # Update local payment status
                 payment_status = status_data.get('payment_status', 'pending')
                 payment.status = payment_status.upper()
-                payment.save()
+                payment.save(update_fields=['status', 'updated_at'])
                 
                 return status_data, None
             else:
@@ -530,19 +528,29 @@ class PaymentProcessor:
         try:
             payment = Payment.objects.get(nowpayments_id=payment_id)
             
-            # Update payment status
+            # Update payment status; a full save() would also write back a stale is_processed
+            # and undo a concurrent webhook's claim below
             payment.status = payment_status.upper()
-            payment.save()
+            payment.save(update_fields=['status', 'updated_at'])
             
             # Process completed payments
             if payment_status in ['finished', 'confirmed'] and not payment.is_processed:
-                # Add funds to user wallet
-                wallet = payment.user.wallet
-                wallet.add_funds(payment.amount_usd, "DEPOSIT")
-                
-                # Mark payment as processed
-                payment.is_processed = True
-                payment.save()
+                with transaction.atomic():
+                    # Mark payment as processed; a repeated webhook must not credit it twice
+                    claimed = Payment.objects.filter(pk=payment.pk, is_processed=False).update(is_processed=True)
+                    if not claimed:
+                        return True, payment
+                    payment.is_processed = True
+
+                    # Add funds to user wallet
+                    wallet = payment.user.wallet
+                    wallet.add_funds(payment.amount_usd, "DEPOSIT")
+
+                    # The bot sends the confirmation once this commits
+                    enqueue_deposit_notification(payment, wallet)
+
+                # The user's next /balance should see the credit even if the replica lags
+                pin_to_primary(payment.user.telegram_id)
                 
                 print(f"Payment {payment.payment_id} processed successfully. User wallet topped up with ${payment.amount_usd}")
                 return True, payment
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+from .dispatch import update_owner
+from .throttling import retry_seconds
+
+logger = logging.getLogger(__name__)
+
+# Seconds Telegram holds a getUpdates request open
+POLL_TIMEOUT = 30
+
+
+def shard_for(update, workers):
+    """Worker index for an update: by user, so one user's updates always go to the same worker"""
+    owner = update_owner(update)
+    return owner % workers if owner is not None else 0
+
+
+def run_worker(index, workers, updates):
+    """Entry point of a bot worker process: handle the updates routed to this shard"""
+    # Ctrl-C and supervise's SIGTERM reach the whole process group; the router stops workers
+    # once their queues drain, so they shut down cleanly and flush persisted state
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lottolite.settings')
+    import django
+    django.setup()
+    asyncio.run(serve_shard(index, workers, updates))
+
+
+async def serve_shard(index, workers, updates):
+    from .bot import build_application, post_init, post_shutdown
+    from .persistence import DjangoPersistence
+
+    application = build_application(polling=False, persistence=DjangoPersistence(shard=(index, workers)))
+    async with application:
+        # Only one worker runs the background queues
+        if index == 0:
+            await post_init(application)
+        await application.start()
+        logger.info(f"Bot worker {index + 1}/{workers} started")
+        try:
+            while True:
+                update_data = await asyncio.to_thread(updates.get)
+                if update_data is None:
+                    break
+                await application.update_queue.put(Update.de_json(update_data, application.bot))
+        finally:
+            await application.stop()
+            if index == 0:
+                await post_shutdown(application)
+    logger.info(f"Bot worker {index + 1}/{workers} stopped")
+
+
+class ShardedBot:
+    """
+    Polls Telegram in this process and routes updates by user ID to N worker processes,
+    each running the bot's handlers with persisted conversation state. A worker that
+    dies is restarted and picks up the updates still queued for it.
+    """
+
+    def __init__(self, token, workers):
+        self.token = token
+        self.workers = workers
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [self.context.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+        self.stopping = False
+
+    def start_worker(self, index):
+        process = self.context.Process(
+            target=run_worker, args=(index, self.workers, self.queues[index]), name=f'bot-worker-{index}'
+        )
+        process.start()
+        self.processes[index] = process
+
+    def check_workers(self):
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Bot worker {index + 1} exited with code {process.exitcode}, restarting")
+                self.start_worker(index)
+
+    def stop(self):
+        self.stopping = True
+
+    async def poll(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        offset = None
+        async with Bot(self.token) as bot:
+            # getUpdates does not work while a webhook is set
+            await bot.delete_webhook()
+            while not self.stopping:
+                self.check_workers()
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES
+                    )
+                except RetryAfter as e:
+                    await asyncio.sleep(retry_seconds(e))
+                    continue
+                except (NetworkError, TimedOut) as e:
+                    logger.warning(f"Error polling Telegram updates: {e}")
+                    await asyncio.sleep(1)
+                    continue
+
+                for update in updates:
+                    self.queues[shard_for(update, self.workers)].put(update.to_dict())
+                    offset = update.update_id + 1
+
+            # Confirm the last routed update so Telegram does not resend it
+            if offset is not None:
+                await bot.get_updates(offset=offset, timeout=0)
+
+    def run(self):
+        for index in range(self.workers):
+            self.start_worker(index)
+        try:
+            asyncio.run(self.poll())
+        finally:
+            for updates in self.queues:
+                updates.put(None)
+            for process in self.processes:
+                process.join()
@@ -1,3 +1,1306 @@
-from django.test import TestCase
+import asyncio
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from telegram import Update
+from telegram.error import Forbidden, RetryAfter
+from telegram.ext import TypeHandler
+
+from app_account.models import User
+from .archive import archive_payments, archive_transactions, get_transaction_history
+from .benchmarks import compare, run_benchmarks, select_benchmarks
+from .broadcast import BroadcastRunner
+from .checkpoints import Watermark, save_checkpoint
+from .db import db_sync_to_async, network_sync_to_async, recycle_connections
+from .executors import shutdown_executors
+from .fake_nowpayments import FakeNOWPaymentsServer, FaultInjector
+from .persistence import DjangoPersistence
+from .keyboards import CurrencyKeyboards
+from .metrics import MetricsRegistry
+from .management.commands.supervise import Child, Command as SuperviseCommand
+from .loadtest import (
+    SCENARIO, LoadTest, MeasuredUpdateProcessor, StubTelegramRequest, count_queries, counting_queries,
+    install_query_counter, stub_nowpayments, throwaway_database,
+)
+from .notifications import claim_notifications, mark_failed, mark_sent
+from .pagination import payment_page, transaction_page
+from .qr import QRRenderer, render_qr_png
+from .query_profiler import QueryProfilerMiddleware, install_query_profiler, profile_execute, profile_queries, query_shape
+from .provisioning import drain_sub_partner_jobs, enqueue_sub_partner
+from .routers import replica_reads
+from .services import NOWPaymentsService, PaymentProcessor
+from .sharding import shard_for
+from .throttling import FloodRateLimiter, InboundThrottle, TokenBucket
+from .user_cache import UserCache, user_cache
+from .webhook_capture import WebhookReplayer, read_capture
+from .models import (
+    BotState, Broadcast, CommandCheckpoint, Notification, Payment, PaymentArchive, SubPartnerJob, Transaction,
+    TransactionArchive, Wallet, WalletCheckpoint,
+)
+
+
+class RecordingTelegramRequest(StubTelegramRequest):
+    """StubTelegramRequest keeping the text of every message the bot sends or edits"""
+
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def result(self, endpoint, parameters):
+        if 'text' in parameters:
+            self.texts.append(parameters['text'])
+        return super().result(endpoint, parameters)
+
+
+def create_wallet(telegram_id=1001, balance=Decimal('0.00')):
+    user = User.objects.create(
+        username=f"user_{telegram_id}",
+        telegram_id=telegram_id,
+        telegram_full_name=f"User {telegram_id}",
+    )
+    return Wallet.objects.create(user=user, balance=balance)
+
+
+class WalletCheckpointTests(TestCase):
+    def test_verify_balance_sums_only_after_checkpoint(self):
+        wallet = create_wallet()
+        wallet.add_funds(Decimal('50.00'))
+        wallet.deduct_funds(Decimal('20.00'))
+        checkpoint = wallet.create_checkpoint()
+        self.assertEqual(checkpoint.balance, Decimal('30.00'))
+
+        wallet.add_funds(Decimal('5.00'))
+        # Rows before the checkpoint no longer take part in the audit
+        wallet.transactions.filter(id__lte=checkpoint.last_transaction_id).delete()
+
+        self.assertEqual(wallet.verify_balance(), (True, Decimal('35.00')))
+
+    def test_with_ledger_matches_single_wallet_state(self):
+        wallet = create_wallet()
+        wallet.add_funds(Decimal('10.00'))
+        wallet.create_checkpoint()
+        wallet.add_funds(Decimal('2.50'))
+
+        annotated = Wallet.objects.with_ledger().get(pk=wallet.pk)
+        self.assertEqual((annotated.ledger_balance, annotated.ledger_last_transaction_id), wallet.ledger_state())
+
+    def test_verify_wallets_command_checkpoints_and_reports_mismatch(self):
+        good = create_wallet(1001)
+        good.add_funds(Decimal('10.00'))
+        bad = create_wallet(1002)
+        bad.add_funds(Decimal('10.00'))
+        Wallet.objects.filter(pk=bad.pk).update(balance=Decimal('99.00'))
+
+        with self.assertRaises(CommandError), self.assertLogs('app_bot.management.commands.verify_wallets', 'ERROR'):
+            call_command('verify_wallets', '--checkpoint', '--batch-size', '1', stdout=StringIO())
+
+        self.assertEqual(WalletCheckpoint.objects.filter(wallet=good).count(), 1)
+        self.assertFalse(WalletCheckpoint.objects.filter(wallet=bad).exists())
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.wallet = create_wallet()
+        self.cutoff = timezone.now() - timedelta(days=30)
+        long_ago = self.cutoff - timedelta(days=1)
+        self.wallet.add_funds(Decimal('40.00'))
+        self.wallet.deduct_funds(Decimal('15.00'))
+        self.wallet.add_funds(Decimal('5.00'))
+        Transaction.objects.filter(wallet=self.wallet).update(created_at=long_ago)
+        self.wallet.add_funds(Decimal('1.00'))
+
+    def test_archive_transactions_keeps_ledger_balanced(self):
+        self.assertEqual(archive_transactions(self.cutoff), 3)
+
+        live = list(self.wallet.transactions.order_by('id'))
+        self.assertEqual([t.transaction_type for t in live], ['OPENING', 'DEPOSIT'])
+        self.assertEqual(live[0].amount, Decimal('30.00'))
+        self.assertEqual(TransactionArchive.objects.filter(wallet=self.wallet).count(), 3)
+        self.assertEqual(self.wallet.verify_balance(), (True, Decimal('31.00')))
+        self.assertEqual(len(get_transaction_history(self.wallet, include_archived=True)), 4)
+
+        # A second run has nothing left to fold
+        self.assertEqual(archive_transactions(self.cutoff), 0)
+
+    def test_history_pages_reach_archived_rows_when_asked(self):
+        user = self.wallet.user
+        archived = Payment.objects.create(user=user, amount_usd=Decimal('10.00'), currency='btc',
+                                          status='FINISHED', is_processed=True)
+        Payment.objects.filter(pk=archived.pk).update(created_at=self.cutoff - timedelta(days=1))
+        live = Payment.objects.create(user=user, amount_usd=Decimal('20.00'), currency='btc')
+        with self.assertLogs('app_bot.archive', 'INFO'):
+            archive_payments(self.cutoff)
+        archive_transactions(self.cutoff)
+
+        self.assertEqual([row['id'] for row in payment_page(user)[0]], [live.pk])
+        rows, _, _ = payment_page(user, include_archived=True)
+        self.assertEqual([row['id'] for row in rows], [live.pk, archived.pk])
+
+        # Archived transactions replace the OPENING entry and page like live ones
+        rows, _, next_cursor = transaction_page(user, page_size=2, include_archived=True)
+        older, prev_cursor, last_cursor = transaction_page(user, next_cursor, page_size=2, include_archived=True)
+        amounts = [row['amount'] for row in rows + older]
+        self.assertEqual(amounts, [Decimal('1.00'), Decimal('5.00'), Decimal('-15.00'), Decimal('40.00')])
+        self.assertIsNone(last_cursor)
+        self.assertEqual(transaction_page(user, prev_cursor, 'prev', page_size=2, include_archived=True)[0], rows)
+
+    @override_settings(BOT_DB_WORKERS=0)
+    def test_payments_all_command_lists_archived_payments(self):
+        from .bot import build_application
+
+        archived = Payment.objects.create(user=self.wallet.user, amount_usd=Decimal('12.00'), currency='btc',
+                                          status='FINISHED', is_processed=True)
+        Payment.objects.filter(pk=archived.pk).update(created_at=self.cutoff - timedelta(days=1))
+        with self.assertLogs('app_bot.archive', 'INFO'):
+            archive_payments(self.cutoff)
+
+        request = RecordingTelegramRequest()
+        application = build_application(polling=False, token='123456:TEST', request=request, rate_limits=False)
+
+        def command(update_id, text):
+            return Update.de_json({'update_id': update_id, 'message': {
+                'message_id': update_id, 'date': 0, 'chat': {'id': 1001, 'type': 'private'},
+                'from': {'id': 1001, 'is_bot': False, 'first_name': 'User 1001'}, 'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len('/payments')}],
+            }}, application.bot)
+
+        async def run():
+            async with application:
+                await application.process_update(command(1, '/payments'))
+                await application.process_update(command(2, '/payments all'))
+
+        async_to_sync(run)()
+        self.assertIn('No payment history', request.texts[0])
+        self.assertIn(str(archived.payment_id), request.texts[1])
+
+    def test_archive_payments_moves_only_final_payments(self):
+        user = self.wallet.user
+        old = self.cutoff - timedelta(days=1)
+        finished = Payment.objects.create(user=user, amount_usd=Decimal('10.00'), currency='btc',
+                                          status='FINISHED', is_processed=True)
+        pending = Payment.objects.create(user=user, amount_usd=Decimal('10.00'), currency='btc')
+        Payment.objects.update(created_at=old)
+
+        self.assertEqual(archive_payments(self.cutoff, batch_size=1), 1)
+        self.assertTrue(Payment.objects.filter(pk=pending.pk).exists())
+        self.assertTrue(PaymentArchive.objects.filter(payment_id=finished.payment_id).exists())
+
+        url = reverse('bot:payment_status', args=[finished.payment_id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, {'include_archived': '1'}).json()['status'], 'FINISHED')
+
+
+@override_settings(DATABASE_READ_REPLICA='replica', DATABASE_REPLICA_STICKY_SECONDS=60)
+class ReplicaRouterTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_outside_replica_scope_use_primary(self):
+        create_wallet(1001)
+        self.assertEqual(Payment.objects.all().db, 'default')
+        self.assertTrue(User.objects.filter(telegram_id=1001).exists())
+
+    def test_scoped_reads_hit_replica_database(self):
+        create_wallet(1001)
+        User.objects.using('replica').create(username='replica_only', telegram_id=2002)
+
+        with replica_reads(2002):
+            self.assertEqual(Payment.objects.all().db, 'replica')
+            self.assertFalse(User.objects.filter(telegram_id=1001).exists())
+            self.assertTrue(User.objects.filter(telegram_id=2002).exists())
+
+    def test_reads_after_own_write_stick_to_primary(self):
+        with replica_reads(1001):
+            create_wallet(1001)
+            self.assertTrue(User.objects.filter(telegram_id=1001).exists())
+
+        with replica_reads(1001):
+            self.assertEqual(Payment.objects.all().db, 'default')
+
+        # Other users keep reading from the replica
+        with replica_reads(3003):
+            self.assertFalse(User.objects.filter(telegram_id=1001).exists())
+
+    @override_settings(BOT_DB_WORKERS=0, BOT_NETWORK_WORKERS=0)
+    def test_deposit_pins_following_payments_to_primary(self):
+        from .bot import build_application
+
+        wallet = create_wallet(1001)
+        User.objects.filter(pk=wallet.user.pk).update(nowpayments_sub_partner_id='sp-1001')
+
+        request = RecordingTelegramRequest()
+        application = build_application(
+            polling=False, token='123456:TEST', request=request, rate_limits=False
+        )
+        user = {'id': 1001, 'is_bot': False, 'first_name': 'User 1001'}
+        chat = {'id': 1001, 'type': 'private'}
+
+        def message(update_id, text):
+            entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else []
+            return {'update_id': update_id, 'message': {
+                'message_id': update_id, 'date': 0, 'chat': chat, 'from': user, 'text': text, 'entities': entities
+            }}
+
+        currency = {'update_id': 3, 'callback_query': {
+            'id': '3', 'from': user, 'chat_instance': '1001', 'data': 'currency_btc',
+            'message': {'message_id': 3, 'date': 0, 'chat': chat, 'from': user, 'text': 'Choose a currency'},
+        }}
+
+        async def run():
+            async with application:
+                for data in (message(1, '/deposit'), message(2, '25'), currency, message(4, '/payments')):
+                    await application.process_update(Update.de_json(data, application.bot))
+
+        with stub_nowpayments(), redirect_stdout(StringIO()), \
+                mock.patch('app_bot.bot.qr_renderer.render', mock.AsyncMock(return_value=b'png')):
+            async_to_sync(run)()
+
+        # The replica has no copy of the payment yet, so /payments must have read the primary
+        self.assertFalse(Payment.objects.using('replica').exists())
+        self.assertNotIn('No payment history', request.texts[-1])
+        self.assertIn('25', request.texts[-1])
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+
+    def test_lru_eviction_and_ttl(self):
+        users = UserCache(maxsize=2, ttl=60)
+        users.set(1, 'a')
+        users.set(2, 'b')
+        users.get(1)
+        users.set(3, 'c')
+        self.assertEqual((users.get(1), users.get(2), users.get(3)), ('a', None, 'c'))
+
+        with mock.patch('app_bot.user_cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(users.get(1))
+
+    # Bot DB calls must share the test case's connection to see its transaction
+    @override_settings(BOT_DB_WORKERS=0)
+    def test_save_user_skips_queries_until_profile_changes(self):
+        from .bot import save_user
+
+        create_wallet(1001)
+        telegram_user = SimpleNamespace(id=1001, username=None, full_name='User 1001')
+        first = async_to_sync(save_user)(telegram_user)
+
+        with self.assertNumQueries(0):
+            second = async_to_sync(save_user)(telegram_user)
+        # Each caller gets its own copy, so one handler's changes never leak into another's
+        self.assertEqual(second.pk, first.pk)
+        self.assertIsNot(second, first)
+        second.nowpayments_sub_partner_id = None
+        second.telegram_full_name = 'changed in place'
+        self.assertEqual(user_cache.get(1001).telegram_full_name, 'User 1001')
+
+        renamed = SimpleNamespace(id=1001, username='renamed', full_name='User 1001')
+        with self.assertNumQueries(1):
+            async_to_sync(save_user)(renamed)
+        self.assertEqual(User.objects.get(telegram_id=1001).telegram_username, 'renamed')
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(save_user)(renamed).telegram_username, 'renamed')
+
+
+class StubSubPartnerService:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def create_sub_partner_account(self, user_data):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+class SubPartnerProvisioningTests(TestCase):
+    def test_failed_attempt_is_retried_with_backoff(self):
+        user = create_wallet(1001).user
+        job = enqueue_sub_partner(user)
+        service = StubSubPartnerService([None, {'result': {'id': 555}}])
+
+        with self.assertLogs('app_bot.provisioning', 'WARNING'):
+            self.assertEqual(drain_sub_partner_jobs(service=service), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('PENDING', 1))
+        self.assertGreater(job.next_attempt_at, timezone.now())
+
+        # Not due yet, so the worker leaves it alone
+        self.assertEqual(drain_sub_partner_jobs(service=service), 0)
+
+        SubPartnerJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(drain_sub_partner_jobs(service=service), 1)
+        job.refresh_from_db()
+        user.refresh_from_db()
+        self.assertEqual((job.status, user.nowpayments_sub_partner_id), ('DONE', '555'))
+        self.assertIsNone(enqueue_sub_partner(user))
+
+    def test_found_or_created_id_reaches_the_user_cache(self):
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        first, second = create_wallet(1001).user, create_wallet(1002).user
+        user_cache.set(1001, first)
+        user_cache.set(1002, second)
+
+        # Created by the worker
+        enqueue_sub_partner(first)
+        with self.assertLogs('app_bot.provisioning', 'INFO'):
+            drain_sub_partner_jobs(service=StubSubPartnerService([{'result': {'id': 555}}]))
+        self.assertEqual(user_cache.get(1001).nowpayments_sub_partner_id, '555')
+
+        # Set by another process; found when a stale cached copy is checked
+        User.objects.filter(pk=second.pk).update(nowpayments_sub_partner_id='777')
+        self.assertIsNone(enqueue_sub_partner(user_cache.get(1002)))
+        self.assertEqual(user_cache.get(1002).nowpayments_sub_partner_id, '777')
+
+
+class WalletCounterTests(TestCase):
+    def test_add_and_deduct_maintain_counter(self):
+        wallet = create_wallet()
+        wallet.add_funds(Decimal('10.00'))
+        self.assertFalse(wallet.deduct_funds(Decimal('25.00')))
+        self.assertTrue(wallet.deduct_funds(Decimal('4.00')))
+
+        wallet.refresh_from_db()
+        self.assertEqual((wallet.balance, wallet.transaction_count), (Decimal('6.00'), 2))
+        self.assertEqual(wallet.transactions.first().balance_after, Decimal('6.00'))
+
+    # Bot DB calls must share the test case's connection to see its transaction
+    @override_settings(BOT_DB_WORKERS=0)
+    def test_wallet_summary_is_one_query(self):
+        from .bot import get_wallet_summary
+
+        wallet = create_wallet()
+        for _ in range(5):
+            wallet.add_funds(Decimal('1.00'))
+
+        with self.assertNumQueries(1):
+            summary = async_to_sync(get_wallet_summary)(wallet.user)
+        self.assertEqual(summary, {'balance': Decimal('5.00'), 'transaction_count': 5})
+
+    @override_settings(BOT_DB_WORKERS=0, BOT_NETWORK_WORKERS=0)
+    def test_balance_for_provisioned_user_is_one_query(self):
+        from .bot import build_application
+
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        wallet = create_wallet(1001, balance=Decimal('12.50'))
+        # Cached before the provisioning worker stored the sub-partner ID
+        user_cache.set(1001, wallet.user)
+        User.objects.filter(pk=wallet.user.pk).update(nowpayments_sub_partner_id='sp-1001')
+
+        request = RecordingTelegramRequest()
+        application = build_application(
+            polling=False, token='123456:TEST', request=request, rate_limits=False
+        )
+        balance = {'update_id': 1, 'message': {
+            'message_id': 1, 'date': 0, 'chat': {'id': 1001, 'type': 'private'},
+            'from': {'id': 1001, 'is_bot': False, 'first_name': 'User 1001'}, 'text': '/balance',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 8}],
+        }}
+
+        install_query_counter(connection=connection)
+        self.addCleanup(connection.execute_wrappers.remove, count_queries)
+
+        async def run():
+            async with application:
+                # The first /balance finds the stored ID and refreshes the cached user
+                await application.process_update(Update.de_json(balance, application.bot))
+                with counting_queries() as queries:
+                    await application.process_update(Update.de_json(balance, application.bot))
+            return queries[0]
+
+        self.assertEqual(async_to_sync(run)(), 1)
+        self.assertIn('$12.50', request.texts[-1])
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.wallet = create_wallet()
+        self.user = self.wallet.user
+        self.payments = [
+            Payment.objects.create(user=self.user, amount_usd=Decimal(i + 5), currency='btc')
+            for i in range(7)
+        ]
+        # Two payments share a timestamp so the id tiebreaker is exercised
+        same_time = timezone.now() - timedelta(hours=1)
+        Payment.objects.filter(pk__in=[self.payments[2].pk, self.payments[3].pk]).update(created_at=same_time)
+
+    def test_pages_walk_history_without_gaps_or_repeats(self):
+        expected = list(
+            Payment.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        with self.assertNumQueries(1):
+            first, prev_cursor, next_cursor = payment_page(self.user, page_size=3)
+        self.assertIsNone(prev_cursor)
+
+        seen = [row['id'] for row in first]
+        while next_cursor:
+            with self.assertNumQueries(1):
+                rows, prev_cursor, next_cursor = payment_page(self.user, next_cursor, 'next', page_size=3)
+            seen += [row['id'] for row in rows]
+        self.assertEqual(seen, expected)
+
+        rows, _, _ = payment_page(self.user, prev_cursor, 'prev', page_size=3)
+        self.assertEqual([row['id'] for row in rows], expected[3:6])
+
+    def test_transaction_page_only_loads_displayed_columns(self):
+        self.wallet.add_funds(Decimal('3.00'))
+        rows, prev_cursor, next_cursor = transaction_page(self.user)
+        self.assertEqual(set(rows[0]), {'id', 'amount', 'transaction_type', 'balance_after', 'created_at'})
+        self.assertEqual((prev_cursor, next_cursor), (None, None))
+
+
+class QRRendererTests(SimpleTestCase):
+    def test_renders_png_once_per_key(self):
+        renderer = QRRenderer(max_workers=2, cache_size=2, use_processes=False)
+        self.addCleanup(renderer.shutdown)
+
+        async def render_concurrently():
+            return await asyncio.gather(*[
+                renderer.render('addr1', Decimal('0.00100000'), 'btc') for _ in range(5)
+            ])
+
+        with mock.patch('app_bot.qr.render_qr_png', wraps=render_qr_png) as render:
+            images = async_to_sync(render_concurrently)()
+            self.assertEqual(render.call_count, 1)
+        self.assertTrue(images[0].startswith(b'\x89PNG'))
+        self.assertTrue(all(image == images[0] for image in images))
+
+    def test_cache_is_bounded(self):
+        renderer = QRRenderer(cache_size=2, use_processes=False)
+        self.addCleanup(renderer.shutdown)
+        for address in ('a', 'b', 'c'):
+            async_to_sync(renderer.render)(address)
+        self.assertEqual(len(renderer._cache), 2)
+        self.assertIsNone(renderer.cached(renderer.cache_key('a')))
+
+
+@override_settings(TELEGRAM_WEBHOOK_SECRET='s3cret')
+class TelegramWebhookTests(SimpleTestCase):
+    update = {'update_id': 1, 'message': {
+        'message_id': 1, 'date': 0, 'chat': {'id': 1001, 'type': 'private'}, 'text': '/balance'
+    }}
+
+    def post(self, secret):
+        return self.client.post(
+            reverse('bot:telegram_webhook'), self.update, content_type='application/json',
+            headers={'X-Telegram-Bot-Api-Secret-Token': secret}
+        )
+
+    def test_update_is_queued_for_the_application(self):
+        application = SimpleNamespace(bot=None, update_queue=SimpleNamespace(put=mock.AsyncMock()))
+        with mock.patch('app_bot.views.get_application', mock.AsyncMock(return_value=application)):
+            response = self.post('s3cret')
+        self.assertEqual(response.status_code, 200)
+        update = application.update_queue.put.await_args.args[0]
+        self.assertEqual(update.update_id, 1)
+        self.assertEqual(update.message.text, '/balance')
+
+    def test_wrong_secret_is_rejected(self):
+        with mock.patch('app_bot.views.get_application') as get_application:
+            with self.assertLogs('app_bot.views', 'WARNING'):
+                response = self.post('wrong')
+        self.assertEqual(response.status_code, 403)
+        get_application.assert_not_called()
+
+    def test_server_shutdown_stops_the_application(self):
+        from . import webhook
+
+        application = mock.AsyncMock()
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        lifespan = webhook.WebhookLifespan(mock.AsyncMock())
+        with mock.patch.object(webhook, '_application', application), \
+                mock.patch.object(webhook, 'get_application', mock.AsyncMock()) as get_application, \
+                mock.patch('app_bot.bot.post_shutdown', mock.AsyncMock()) as post_shutdown, \
+                self.assertLogs('app_bot.webhook', 'INFO'):
+            async_to_sync(lifespan)({'type': 'lifespan'}, receive, send)
+            self.assertIsNone(webhook._application)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        # The bot and its background loops start with the server, not on the first update
+        get_application.assert_awaited_once()
+        application.stop.assert_awaited_once()
+        post_shutdown.assert_awaited_once_with(application)
+        application.shutdown.assert_awaited_once()
+
+    def test_second_worker_fails_to_start(self):
+        from . import webhook
+
+        lock_path = os.path.join(tempfile.mkdtemp(), 'webhook.lock')
+        messages = iter([{'type': 'lifespan.startup'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        # Another worker's lock on the same file
+        other_worker = open(lock_path, 'a')
+        self.addCleanup(other_worker.close)
+        fcntl.flock(other_worker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        with override_settings(TELEGRAM_WEBHOOK_LOCK_PATH=lock_path), \
+                mock.patch('app_bot.bot.build_application') as build_application, \
+                self.assertLogs('app_bot.webhook', 'ERROR') as logs:
+            async_to_sync(webhook.WebhookLifespan(mock.AsyncMock()))({'type': 'lifespan'}, receive, send)
+        self.assertEqual(sent, ['lifespan.startup.failed'])
+        self.assertIn('single worker', logs.output[0])
+        build_application.assert_not_called()
+        self.assertIsNone(webhook._worker_lock)
+
+        other_worker.close()
+        with override_settings(TELEGRAM_WEBHOOK_LOCK_PATH=lock_path):
+            webhook.claim_webhook_worker()
+        self.addCleanup(webhook.release_webhook_worker)
+        self.assertIsNotNone(webhook._worker_lock)
+
+
+@skipUnless(connection.vendor == 'sqlite' and settings.SQLITE_TUNED, 'SQLite concurrency profile only')
+class SQLiteProfileTests(SimpleTestCase):
+    def test_new_connection_gets_pragmas_and_immediate_transactions(self):
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        path = os.path.join(tempfile.mkdtemp(), 'pragmas.sqlite3')
+        wrapper = DatabaseWrapper(dict(connection.settings_dict, NAME=path, TEST={}), alias='pragma_check')
+        connections['pragma_check'] = wrapper
+        self.addCleanup(connections.__delitem__, 'pragma_check')
+        self.addCleanup(wrapper.close)
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with wrapper.execute_wrapper(record):
+            with wrapper.cursor() as cursor:
+                pragmas = {}
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'temp_store', 'mmap_size'):
+                    cursor.execute(f"PRAGMA {name}")
+                    pragmas[name] = cursor.fetchone()[0]
+            with transaction.atomic(using='pragma_check'):
+                pass
+
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['synchronous'], 1)  # NORMAL
+        self.assertEqual(pragmas['busy_timeout'], settings.SQLITE_BUSY_TIMEOUT_MS)
+        self.assertEqual(pragmas['cache_size'], -20000)
+        self.assertEqual(pragmas['temp_store'], 2)  # MEMORY
+        self.assertEqual(pragmas['mmap_size'], 128 * 1024 * 1024)
+        self.assertIn('BEGIN IMMEDIATE', statements)
+
+
+class RecycleConnectionsTests(TransactionTestCase):
+    def recycle(self):
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'close') as close:
+            recycle_connections()
+        return close.called
+
+    def test_sqlite_connection_is_kept_until_an_error_or_max_age(self):
+        connection.errors_occurred = False
+        self.assertFalse(self.recycle())
+
+        connection.errors_occurred = True
+        self.addCleanup(setattr, connection, 'errors_occurred', False)
+        self.assertTrue(self.recycle())
+
+        connection.errors_occurred = False
+        with override_settings(BOT_DB_CONN_MAX_AGE=0):
+            self.assertTrue(self.recycle())
+
+
+class ConcurrentUpdatesTests(TestCase):
+    def message(self, update_id, user_id):
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'}, 'text': 'hello'
+        }}
+
+    @override_settings(BOT_DB_WORKERS=0, BOT_CONCURRENT_UPDATES=8)
+    def test_users_overlap_but_each_user_is_handled_in_order(self):
+        from .bot import build_application
+
+        application = build_application(
+            polling=False, token='123456:TEST', request=StubTelegramRequest(), rate_limits=False
+        )
+        self.assertEqual(application.concurrent_updates, 8)
+        events = []
+
+        async def slow(update, context):
+            events.append(('start', update.update_id))
+            # The first update only finishes once another user's update has started
+            while update.update_id == 1 and ('start', 2) not in events:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.01)
+            events.append(('end', update.update_id))
+
+        application.add_handler(TypeHandler(Update, slow), group=-2)
+
+        async def run():
+            async with application:
+                await application.start()
+                for update_id, user_id in ((1, 1001), (2, 1002), (3, 1001)):
+                    await application.update_queue.put(Update.de_json(self.message(update_id, user_id), application.bot))
+                async with asyncio.timeout(5):
+                    while len(events) < 6:
+                        await asyncio.sleep(0.01)
+                await application.stop()
+
+        with self.assertLogs('telegram.ext.Application', 'INFO'):
+            async_to_sync(run)()
+        self.assertLess(events.index(('start', 2)), events.index(('end', 1)))
+        # User 1001's second update waits for the first
+        self.assertLess(events.index(('end', 1)), events.index(('start', 3)))
+
+
+class BotExecutorTests(SimpleTestCase):
+    def test_db_and_network_calls_run_on_separate_pools(self):
+        self.addCleanup(shutdown_executors)
+        thread_name = lambda: threading.current_thread().name
+
+        async def run_both():
+            return await asyncio.gather(db_sync_to_async(thread_name)(), network_sync_to_async(thread_name)())
+
+        db_thread, network_thread = async_to_sync(run_both)()
+        self.assertTrue(db_thread.startswith('bot-db'))
+        self.assertTrue(network_thread.startswith('bot-net'))
+
+    @override_settings(BOT_DB_WORKERS=0)
+    def test_zero_workers_keeps_thread_sensitive_calls(self):
+        thread_name = lambda: threading.current_thread().name
+        self.assertEqual(async_to_sync(db_sync_to_async(thread_name))(), threading.current_thread().name)
+
+
+@override_settings(BOT_DB_WORKERS=0)
+class BotPersistenceTests(TestCase):
+    def test_conversation_and_user_data_survive_a_restart(self):
+        persistence = DjangoPersistence()
+        async_to_sync(persistence.update_conversation)('deposit', (1001, 1001), 1)
+        async_to_sync(persistence.update_user_data)(1001, {'deposit_amount': 25.0})
+        async_to_sync(persistence.update_user_data)(1002, {'deposit_amount': 10.0})
+
+        async_to_sync(persistence.update_conversation)('deposit', (1002, 1002), 2)
+
+        restarted = DjangoPersistence(shard=(1, 2))
+        self.assertEqual(async_to_sync(restarted.get_conversations)('deposit'), {(1001, 1001): 1})
+        self.assertEqual(async_to_sync(restarted.get_user_data)(), {1001: {'deposit_amount': 25.0}})
+        other_shard = DjangoPersistence(shard=(0, 2))
+        self.assertEqual(async_to_sync(other_shard.get_conversations)('deposit'), {(1002, 1002): 2})
+
+    @override_settings(BOT_DB_WORKERS=0)
+    def test_shutdown_writes_changes_of_the_last_interval(self):
+        from .bot import build_application
+
+        application = build_application(
+            polling=False, persistence=DjangoPersistence(update_interval=3600), token='123456:TEST',
+            request=StubTelegramRequest(), rate_limits=False
+        )
+
+        async def run():
+            async with application:
+                application.user_data[1001]['deposit_amount'] = 25.0
+                application.mark_data_for_update_persistence(user_ids=1001)
+                self.assertFalse(await BotState.objects.filter(kind='USER').aexists())
+
+        async_to_sync(run)()
+        self.assertEqual(BotState.objects.get(kind='USER', key='1001').data, {'deposit_amount': 25.0})
+
+    def test_finished_state_is_deleted(self):
+        persistence = DjangoPersistence()
+        async_to_sync(persistence.update_conversation)('deposit', (1001, 1001), 1)
+        async_to_sync(persistence.update_user_data)(1001, {'deposit_amount': 25.0})
+        async_to_sync(persistence.update_conversation)('deposit', (1001, 1001), None)
+        async_to_sync(persistence.update_user_data)(1001, {})
+        self.assertFalse(BotState.objects.exists())
+
+    def test_updates_are_sharded_by_user(self):
+        update = Update.de_json({'update_id': 1, 'message': {
+            'message_id': 1, 'date': 0, 'chat': {'id': -500, 'type': 'group'},
+            'from': {'id': 1003, 'is_bot': False, 'first_name': 'User'}, 'text': '/balance'
+        }}, None)
+        self.assertEqual(shard_for(update, 4), 3)
+
+
+class ThrottlingTests(SimpleTestCase):
+    def test_inbound_coalesces_repeats_and_limits_bursts(self):
+        throttle = InboundThrottle(rate=1, burst=3, coalesce_seconds=2)
+        self.assertEqual(throttle.check(1001, 'text:/balance', 100.0), 'ok')
+        self.assertEqual(throttle.check(1001, 'text:/balance', 100.5), 'duplicate')
+        self.assertEqual(throttle.check(1001, 'text:/status', 100.6), 'ok')
+        self.assertEqual(throttle.check(1001, 'text:/payments', 100.7), 'ok')
+        self.assertEqual(throttle.check(1001, 'text:/help', 100.8), 'warn')
+        self.assertEqual(throttle.check(1001, 'text:/start', 100.9), 'throttled')
+        # Other users have their own bucket, and tokens refill over time
+        self.assertEqual(throttle.check(1002, 'text:/help', 100.9), 'ok')
+        self.assertEqual(throttle.check(1001, 'text:/help', 102.0), 'ok')
+
+    def test_outbound_retries_after_flood_limit(self):
+        limiter = FloodRateLimiter(overall_rate=1000, chat_rate=1000, max_retries=1)
+        send = mock.AsyncMock(side_effect=[RetryAfter(0.01), {'ok': True}])
+
+        with self.assertLogs('app_bot.throttling', 'WARNING'):
+            result = async_to_sync(limiter.process_request)(
+                send, (), {}, 'sendMessage', {'chat_id': 1001, 'text': 'hi'}, None
+            )
+        self.assertEqual(result, {'ok': True})
+        self.assertEqual(send.await_count, 2)
+
+    def test_outbound_spaces_messages_per_chat(self):
+        bucket = TokenBucket(1, burst=2)
+        self.assertEqual([bucket.reserve(10.0) for _ in range(4)], [0, 0, 1.0, 2.0])
+
+
+class DepositNotificationTests(TestCase):
+    def setUp(self):
+        self.wallet = create_wallet()
+        self.payment = Payment.objects.create(
+            user=self.wallet.user, amount_usd=Decimal('25.00'), currency='btc', nowpayments_id='np-1'
+        )
+
+    def process_webhook(self):
+        with redirect_stdout(StringIO()):
+            return PaymentProcessor().process_payment_webhook({'payment_id': 'np-1', 'payment_status': 'finished'})
+
+    def test_repeated_webhook_credits_and_notifies_once(self):
+        self.process_webhook()
+        self.process_webhook()
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('25.00'))
+        notification = Notification.objects.get()
+        self.assertEqual((notification.chat_id, notification.status), ('1001', 'PENDING'))
+        self.assertIn('$25.00', notification.message)
+
+    def test_interleaved_webhooks_credit_once(self):
+        # Webhook B runs to completion after webhook A has read the payment but before A saves it
+        save = Payment.save
+        interleaved = []
+
+        def save_after_other_webhook(payment, *args, **kwargs):
+            if not interleaved:
+                interleaved.append(True)
+                self.process_webhook()
+            return save(payment, *args, **kwargs)
+
+        with mock.patch.object(Payment, 'save', save_after_other_webhook):
+            self.process_webhook()
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(interleaved, [True])
+        self.assertEqual(self.wallet.balance, Decimal('25.00'))
+        self.assertEqual(Transaction.objects.filter(transaction_type='DEPOSIT').count(), 1)
+
+    def test_claimed_batch_is_not_claimed_again(self):
+        self.process_webhook()
+        batch = claim_notifications()
+        self.assertEqual([n['chat_id'] for n in batch], ['1001'])
+        self.assertEqual(claim_notifications(), [])
+
+        with self.assertLogs('app_bot.notifications', 'WARNING'):
+            mark_failed(batch[0]['id'], batch[0]['attempts'], 'Timed out')
+        self.assertEqual(len(claim_notifications()), 1)
+
+        mark_sent([batch[0]['id']])
+        self.assertEqual(Notification.objects.get().status, 'SENT')
+
+
+class CurrencyKeyboardTests(SimpleTestCase):
+    def button_data(self, markup):
+        return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+    def test_long_lists_are_paged_with_popular_coins_first(self):
+        keyboards = CurrencyKeyboards(popular=['btc', 'eth'], page_size=4)
+        currencies = ['ADA', 'BTC', 'DOGE', 'ETH', 'LTC', 'SOL', 'XRP', 'DOT']
+        pages = keyboards.pages(currencies)
+
+        self.assertEqual(self.button_data(pages[0]), ['currency_btc', 'currency_eth', 'curpage_1'])
+        self.assertEqual(
+            self.button_data(pages[1]),
+            ['currency_ada', 'currency_doge', 'currency_ltc', 'currency_sol', 'curpage_0', 'curpage_2']
+        )
+        self.assertEqual(self.button_data(pages[2]), ['currency_xrp', 'currency_dot', 'curpage_1'])
+
+    def test_markup_is_reused_until_the_list_changes(self):
+        keyboards = CurrencyKeyboards(popular=['btc'])
+        first = keyboards.pages(['BTC', 'ETH'])
+        self.assertIs(keyboards.pages(['btc', 'eth']), first)
+        self.assertIs(keyboards.cached_pages(), first)
+        self.assertIsNot(keyboards.pages(['BTC', 'ETH', 'LTC']), first)
+        self.assertEqual(len(keyboards.cached_pages()), 1)
+
+
+class BroadcastTests(TransactionTestCase):
+    def test_broadcast_reaches_every_user_and_checkpoints(self):
+        users = [create_wallet(telegram_id).user for telegram_id in range(2001, 2008)]
+
+        async def send_message(chat_id, text):
+            if chat_id == '2003':
+                raise Forbidden('Forbidden: bot was blocked by the user')
+
+        bot = SimpleNamespace(send_message=mock.AsyncMock(side_effect=send_message))
+        broadcast = Broadcast.objects.create(message='Maintenance tonight', last_user_id=users[0].pk)
+
+        result = async_to_sync(BroadcastRunner(broadcast, bot, concurrency=3).run)()
+
+        chats = sorted(call.kwargs['chat_id'] for call in bot.send_message.await_args_list)
+        self.assertEqual(chats, [str(telegram_id) for telegram_id in range(2002, 2008)])
+        self.assertEqual((result['sent'], result['failed']), (5, 1))
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.last_user_id), ('DONE', users[-1].pk))
+
+    def test_watermark_only_passes_finished_recipients(self):
+        watermark = Watermark(0)
+        for pk in (1, 2, 3):
+            watermark.dispatched(pk)
+        watermark.finished(2)
+        self.assertEqual(watermark.value, 0)
+        watermark.finished(1)
+        self.assertEqual(watermark.value, 2)
+
+
+class MigrateSubPartnersTests(TestCase):
+    def setUp(self):
+        self.users = [create_wallet(telegram_id).user for telegram_id in range(3001, 3006)]
+        self.service = mock.Mock()
+        self.service.create_sub_partner_account.side_effect = lambda data: (
+            None if data['telegram_id'] == '3002' else {'result': {'id': f"sp-{data['telegram_id']}"}}
+        )
+
+    def migrate(self, *args):
+        out = StringIO()
+        with mock.patch('app_bot.management.commands.migrate_subpartners.NOWPaymentsService',
+                        return_value=self.service):
+            call_command('migrate_subpartners', '--workers', '3', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_accounts_are_created_concurrently_and_bulk_saved(self):
+        output = self.migrate()
+        ids = dict(User.objects.values_list('telegram_id', 'nowpayments_sub_partner_id'))
+        self.assertEqual(ids['3001'], 'sp-3001')
+        self.assertIsNone(ids['3002'])
+        self.assertEqual(ids['3005'], 'sp-3005')
+        self.assertIn('Failed migrations: 1', output)
+        self.assertFalse(CommandCheckpoint.objects.exists())
+
+    def test_id_stored_by_the_provisioning_worker_during_the_run_is_kept(self):
+        self.service.create_sub_partner_account.side_effect = lambda data: {'result': {'id': f"sp-{data['telegram_id']}"}}
+        dispatched = Watermark.dispatched
+
+        def worker_stores_id(watermark, pk):
+            # The provisioning worker finishes user 3003 after the migration has read it
+            if pk == self.users[2].pk:
+                User.objects.filter(pk=pk).update(nowpayments_sub_partner_id='worker-3003')
+            return dispatched(watermark, pk)
+
+        with mock.patch.object(Watermark, 'dispatched', worker_stores_id), \
+                self.assertLogs('app_bot.management.commands.migrate_subpartners', 'WARNING'):
+            output = self.migrate()
+        ids = dict(User.objects.values_list('telegram_id', 'nowpayments_sub_partner_id'))
+        self.assertEqual(ids['3003'], 'worker-3003')
+        self.assertEqual(ids['3004'], 'sp-3004')
+        self.assertIn('Successful migrations: 4', output)
+        self.assertIn('Provisioned elsewhere during the run: 1', output)
+
+    def test_each_worker_thread_has_its_own_service(self):
+        services = {}
+
+        def service_for_thread():
+            service = mock.Mock()
+            service.create_sub_partner_account.side_effect = self.service.create_sub_partner_account.side_effect
+            services.setdefault(threading.current_thread().name, []).append(service)
+            return service
+
+        with mock.patch('app_bot.management.commands.migrate_subpartners.NOWPaymentsService',
+                        side_effect=service_for_thread):
+            call_command('migrate_subpartners', '--workers', '3', stdout=StringIO())
+        self.assertTrue(all(name.startswith('subpartner') for name in services))
+        self.assertEqual([len(created) for created in services.values()], [1] * len(services))
+
+    def test_resume_starts_after_checkpoint(self):
+        save_checkpoint('migrate_subpartners', self.users[2].pk)
+        self.migrate('--resume')
+        migrated = set(User.objects.exclude(nowpayments_sub_partner_id=None).values_list('telegram_id', flat=True))
+        self.assertEqual(migrated, {'3004', '3005'})
+
+
+@override_settings(BOT_DB_WORKERS=0, BOT_NETWORK_WORKERS=0)
+class LoadTestHarnessTests(TestCase):
+    def test_virtual_users_run_the_full_scenario(self):
+        from .bot import build_application
+
+        request = StubTelegramRequest()
+        processor = MeasuredUpdateProcessor(4)
+        application = build_application(
+            polling=False, token='123456:TEST', request=request, rate_limits=False, update_processor=processor
+        )
+        load_test = LoadTest(application, users=2)
+        install_query_counter(connection=connection)
+        self.addCleanup(connection.execute_wrappers.remove, count_queries)
+
+        async def run():
+            async with application:
+                await load_test.run()
+
+        with stub_nowpayments(), redirect_stdout(StringIO()), \
+                mock.patch('app_bot.bot.qr_renderer.render', mock.AsyncMock(return_value=b'png')), \
+                mock.patch.object(processor, 'process_update', wraps=processor.process_update) as dispatched, \
+                self.assertLogs('app_bot.provisioning', 'INFO'), self.assertLogs('telegram.ext.Application', 'INFO'):
+            async_to_sync(run)()
+
+        self.assertEqual(load_test.errors, 0)
+        # Every step went through the update queue and the processor's concurrency limit
+        self.assertEqual(dispatched.call_count, 2 * len(SCENARIO))
+        rows = {row['step']: row for row in load_test.report()}
+        self.assertEqual(rows['/balance']['count'], 2)
+        self.assertGreater(rows['/start']['queries'], 0)
+        self.assertEqual(request.calls['sendPhoto'], 2)
+        self.assertEqual(Payment.objects.count(), 2)
+
+    def test_application_without_measured_processor_is_refused(self):
+        from .bot import build_application
+
+        application = build_application(polling=False, token='123456:TEST', request=StubTelegramRequest())
+        with self.assertRaisesMessage(ValueError, 'MeasuredUpdateProcessor'):
+            LoadTest(application)
+
+    @override_settings(NOWPAYMENTS_BASE_URL='https://api.nowpayments.io/v1')
+    def test_live_payments_refused_against_production_api(self):
+        with self.assertRaisesMessage(CommandError, 'real accounts and invoices'):
+            call_command('loadtest', '--live-payments', stdout=StringIO())
+
+
+@mock.patch.dict(os.environ, {'NOWPAYMENTS_API_KEY': 'test-key'})
+class FakeNOWPaymentsTests(TestCase):
+    def start_server(self, **faults):
+        server = FakeNOWPaymentsServer(faults=FaultInjector(**faults)).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_deposit_and_ipn_round_trip(self):
+        server = self.start_server()
+        wallet = create_wallet()
+        sub_partner = server.account.create_sub_partner('test')
+        User.objects.filter(pk=wallet.user.pk).update(nowpayments_sub_partner_id=sub_partner['id'])
+        wallet.user.refresh_from_db()
+
+        with override_settings(NOWPAYMENTS_BASE_URL=server.url), redirect_stdout(StringIO()):
+            payment, payment_data, error = PaymentProcessor().create_deposit_payment(wallet.user, 25.0, 'btc')
+        self.assertIsNone(error)
+        payment.refresh_from_db()
+        self.assertEqual(payment.crypto_amount, Decimal('0.00041667'))
+        self.assertTrue(payment.payment_address.startswith('fakebtc'))
+
+        # Deliver the IPN through the real webhook view
+        def send_ipn(data):
+            return self.client.post(reverse('bot:payment_webhook'), data, content_type='application/json')
+        server.account.ipn_url = 'http://testserver'
+        with mock.patch.object(server.account, 'send_ipn', send_ipn), redirect_stdout(StringIO()), \
+                self.assertLogs('app_bot.views', 'INFO'):
+            server.account.set_status(payment.nowpayments_id, 'finished')
+
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('25.00'))
+
+    def test_rate_limit_and_errors_are_injected(self):
+        server = self.start_server(rate_limit=1)
+        statuses = [requests.get(f"{server.url}/merchant/coins", headers={'x-api-key': 'k'}).status_code
+                    for _ in range(2)]
+        self.assertEqual(statuses, [200, 429])
+
+        server = self.start_server(error_rate=1.0)
+        with override_settings(NOWPAYMENTS_BASE_URL=server.url), redirect_stdout(StringIO()):
+            self.assertIsNone(NOWPaymentsService().get_available_currencies())
+
+
+@override_settings(BOT_DB_WORKERS=0)
+@mock.patch.dict(os.environ, {'NOWPAYMENTS_API_KEY': 'test-key'})
+class BenchmarkTests(TestCase):
+    def test_run_and_compare_with_baseline(self):
+        server = FakeNOWPaymentsServer().start()
+        self.addCleanup(server.stop)
+        install_query_counter(connection=connection)
+        self.addCleanup(connection.execute_wrappers.remove, count_queries)
+        benchmarks = select_benchmarks(['wallet', 'save_user.cached', 'deposit.create', 'views'])
+        self.assertEqual(len(benchmarks), 5)
+
+        with override_settings(NOWPAYMENTS_BASE_URL=server.url), redirect_stdout(StringIO()), \
+                self.assertLogs('app_bot', 'INFO'):
+            results = run_benchmarks(benchmarks, server, iterations=3, warmup=1)
+        stats = results['benchmarks']
+        self.assertEqual(stats['wallet.add_funds']['iterations'], 3)
+        self.assertEqual(stats['save_user.cached']['queries'], 0)
+        self.assertEqual(stats['views.payment_status']['queries'], 1)
+
+        self.assertIn('mad_ms', stats['wallet.add_funds'])
+
+        for name in stats:
+            stats[name]['mad_ms'] = 0.01
+        baseline = json.loads(json.dumps(results))
+        baseline['benchmarks']['wallet.add_funds']['median_ms'] /= 2
+        baseline['benchmarks']['views.payment_status']['queries'] = 0
+        baseline['benchmarks']['save_user.cached']['median_ms'] /= 2
+        # Half the old median is within this run's noise, so it is not a regression
+        stats['save_user.cached']['mad_ms'] = stats['save_user.cached']['median_ms']
+        del baseline['benchmarks']['deposit.create']
+        statuses = {row['name']: row['status'] for row in compare(results, baseline, threshold=0.25)}
+        self.assertEqual(statuses['wallet.add_funds'], 'regressed')
+        self.assertEqual(statuses['views.payment_status'], 'regressed')
+        self.assertEqual(statuses['save_user.cached'], 'ok')
+        self.assertEqual(statuses['deposit.create'], 'new')
+        self.assertEqual(statuses['wallet.deduct_funds'], 'ok')
+
+    def test_throwaway_database_restores_connection_settings(self):
+        settings_dict = connections.settings['default']
+        before = json.dumps(settings_dict, default=str, sort_keys=True)
+        with mock.patch('app_bot.loadtest.setup_databases'), mock.patch('app_bot.loadtest.teardown_databases'), \
+                mock.patch('app_bot.loadtest.connections.close_all'):
+            with override_settings(DATABASE_READ_REPLICA='replica'), throwaway_database('check'):
+                self.assertIsNone(settings.DATABASE_READ_REPLICA)
+                self.assertEqual(settings_dict['CONN_MAX_AGE'], 0)
+                self.assertTrue(settings_dict['TEST']['NAME'].endswith('check.sqlite3'))
+        self.assertEqual(json.dumps(settings_dict, default=str, sort_keys=True), before)
+
+
+class WebhookCaptureTests(TestCase):
+    def test_captured_webhooks_replay_with_headers_and_body(self):
+        path = os.path.join(tempfile.mkdtemp(), 'capture.jsonl')
+        with override_settings(WEBHOOK_CAPTURE_PATH=path), self.assertLogs('app_bot.views', 'INFO'):
+            for i in range(3):
+                self.client.post(
+                    reverse('bot:payment_webhook'), {'payment_id': f"np-{i}", 'payment_status': 'finished'},
+                    content_type='application/json', HTTP_X_NOWPAYMENTS_SIG='sig', HTTP_COOKIE='secret=1'
+                )
+        records = list(read_capture(path))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]['headers']['X-Nowpayments-Sig'], 'sig')
+        self.assertNotIn('Cookie', records[0]['headers'])
+
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append((self.headers['X-Nowpayments-Sig'], self.rfile.read(int(self.headers['Content-Length']))))
+                self.send_response(404 if len(received) == 3 else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        replayer = WebhookReplayer(f"http://127.0.0.1:{server.server_address[1]}/", speed=0, concurrency=1)
+        replayer.run(records)
+        report = replayer.report()
+
+        self.assertEqual(received[0], ('sig', b'{"payment_id": "np-0", "payment_status": "finished"}'))
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['statuses'], {200: 2, 404: 1})
+        self.assertEqual(report['errors'], {'HTTP 404': 1})
+
+
+class MetricsTests(TestCase):
+    def test_render_and_multiprocess_merge(self):
+        directory = tempfile.mkdtemp()
+        registry = MetricsRegistry(prefix='test', multiprocess_dir=directory)
+        requests_total = registry.counter('requests_total', 'Requests', ['path'])
+        in_flight = registry.gauge('in_flight', 'In flight')
+        latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+
+        requests_total.inc(path='/a"b')
+        in_flight.set(2)
+        latency.observe(0.05)
+        latency.observe(0.5)
+
+        # Values left behind by an exited process: its counters count, its gauges do not
+        dead_pid = 2 ** 22 + 1
+        with open(os.path.join(directory, f"{dead_pid}.json"), 'w') as f:
+            json.dump({'test_requests_total': [[['/a"b'], 3]], 'test_in_flight': [[[], 7]]}, f)
+
+        text = registry.render()
+        self.assertIn('# TYPE test_requests_total counter', text)
+        self.assertIn('test_requests_total{path="/a\\"b"} 4', text)
+        self.assertIn('test_in_flight 2', text)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('test_latency_seconds_count 2', text)
+
+    def test_failing_gauge_is_logged_once(self):
+        registry = MetricsRegistry(prefix='test')
+        failures = [RuntimeError('no such table'), RuntimeError('no such table')]
+
+        def depth():
+            if failures:
+                raise failures.pop()
+            return {(): 3}
+
+        registry.gauge('depth', 'Depth', function=depth)
+        with self.assertLogs('app_bot.metrics', 'INFO') as logs:
+            registry.render()
+            registry.render()
+            self.assertIn('test_depth 3', registry.render())
+        self.assertEqual([record.levelname for record in logs.records], ['ERROR', 'INFO'])
+
+    def test_metrics_view_reports_webhooks_and_queues(self):
+        create_wallet()
+        with self.assertLogs('app_bot.views', 'INFO'):
+            self.client.post(
+                reverse('bot:payment_webhook'), {'payment_id': 'missing', 'payment_status': 'finished'},
+                content_type='application/json'
+            )
+        response = self.client.get(reverse('bot:metrics'))
+        text = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('lottolite_payment_webhook_seconds_count{outcome="not_found"}', text)
+        self.assertIn('lottolite_queue_depth{queue="sub_partner_jobs"} 0', text)
+
+        # Without a token only direct local requests are answered
+        self.assertEqual(self.client.get(reverse('bot:metrics'), REMOTE_ADDR='203.0.113.5').status_code, 403)
+        self.assertEqual(self.client.get(reverse('bot:metrics'), HTTP_X_FORWARDED_FOR='203.0.113.5').status_code, 403)
+
+        with override_settings(METRICS_TOKEN='t0ken'):
+            self.assertEqual(self.client.get(reverse('bot:metrics')).status_code, 403)
+            response = self.client.get(reverse('bot:metrics'), HTTP_AUTHORIZATION='Bearer t0ken')
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(QUERY_PROFILER_MAX_QUERIES=20, QUERY_PROFILER_MAX_TIME_MS=0, QUERY_PROFILER_MAX_REPEATS=5)
+class QueryProfilerTests(TestCase):
+    def setUp(self):
+        install_query_profiler(connection=connection)
+        self.addCleanup(connection.execute_wrappers.remove, profile_execute)
+
+    def test_query_shape_collapses_parameter_lists(self):
+        self.assertEqual(
+            query_shape('SELECT *\n  FROM t WHERE id IN (%s, %s, %s)'), query_shape('SELECT * FROM t WHERE id IN (%s)')
+        )
+
+    def test_n_plus_one_is_logged_with_source_line(self):
+        wallet = create_wallet()
+        for _ in range(6):
+            Transaction.objects.create(wallet=wallet, amount=1, transaction_type='DEPOSIT', balance_after=1)
+
+        with self.assertLogs('app_bot.query_profiler', 'WARNING') as logs:
+            with profile_queries('test') as profile:
+                lines = [str(transaction) for transaction in Transaction.objects.all()]
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(profile.count, 13)
+        self.assertIn('repeated queries', logs.output[0])
+        self.assertIn('6x SELECT ... FROM "app_bot_wallet"', logs.output[0])
+        self.assertIn('models.py', logs.output[0])
+        self.assertIn('in __str__', logs.output[0])
+
+        with self.assertNoLogs('app_bot.query_profiler', 'WARNING'):
+            with profile_queries('test') as profile:
+                lines = [str(transaction) for transaction in Transaction.objects.select_related('wallet__user')]
+        self.assertEqual(profile.count, 1)
+
+    def test_middleware_profiles_requests(self):
+        create_wallet()
+        def get_response(request):
+            return list(Wallet.objects.all())
+
+        middleware = QueryProfilerMiddleware(get_response)
+        request = SimpleNamespace(method='GET', path='/wallets/')
+        with override_settings(QUERY_PROFILER_MAX_QUERIES=0, QUERY_PROFILER_MAX_TIME_MS=0.000001):
+            with self.assertLogs('app_bot.query_profiler', 'WARNING') as logs:
+                middleware(request)
+        self.assertIn('Query budget exceeded for GET /wallets/: ', logs.output[0])
+
+
+def process_alive(pid):
+    """True unless pid has exited (zombies waiting to be reaped count as exited)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class SuperviseTests(SimpleTestCase):
+    def setUp(self):
+        self.lines = []
+        self.command = SuperviseCommand(stdout=StringIO())
+        self.command.output_lock = threading.Lock()
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('Timed out waiting for the supervised process')
+            time.sleep(0.05)
+
+    @override_settings(TELEGRAM_WEBHOOK_SECRET='s3cret')
+    def test_several_web_workers_are_refused_in_webhook_mode(self):
+        with self.assertRaisesMessage(CommandError, '--web-workers 1'):
+            call_command('supervise', '--web-workers', '2', stdout=StringIO())
+
+    def test_exited_child_is_restarted(self):
+        child = Child('quick', [sys.executable, '-c', 'pass'], self.lines.append)
+        child.start()
+        first_pid = child.process.pid
+        child.process.wait()
+
+        self.command.check_children([child], max_backoff=0)
+        self.assertIsNotNone(child.restart_at)
+        self.command.check_children([child], max_backoff=0)
+        self.addCleanup(child.process.wait)
+        self.assertNotEqual(child.process.pid, first_pid)
+        self.assertEqual(child.failures, 1)
+        self.assertIn('exited with code 0', self.command.stdout.getvalue())
+
+    def test_shutdown_kills_the_whole_process_group(self):
+        # Both processes ignore SIGTERM, like a bot stuck in a long poll with a shard worker
+        script = (
+            "import signal, subprocess, sys, time\n"
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+            "worker = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+            "print(worker.pid, flush=True)\n"
+            "time.sleep(60)\n"
+        )
+        child = Child('bot', [sys.executable, '-c', script], self.lines.append)
+        child.start()
+        self.wait_for(lambda: self.lines[1:])
+        worker_pid = int(self.lines[1].split()[-1])
+
+        self.command.shutdown([child], grace=0.2)
+        self.assertIn('did not stop', self.command.stdout.getvalue())
+        self.assertIsNotNone(child.process.returncode)
+        self.wait_for(lambda: not process_alive(worker_pid))
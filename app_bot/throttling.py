@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from telegram.error import RetryAfter
+from telegram.ext import ApplicationHandlerStop, BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def retry_seconds(error):
+    """Seconds to wait after a RetryAfter (an int or a timedelta depending on the PTB version)"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return retry_after
+
+
+class TokenBucket:
+    """Token bucket (as GCRA): rate tokens per period, with bursts of up to burst tokens"""
+
+    def __init__(self, rate, period=1.0, burst=1):
+        self.interval = period / rate
+        self.tolerance = self.interval * (burst - 1)
+        self.tat = 0.0  # theoretical arrival time of the next token
+
+    def try_take(self, now):
+        """Take a token if one is available"""
+        tat = max(self.tat, now)
+        if tat - self.tolerance > now:
+            return False
+        self.tat = tat + self.interval
+        return True
+
+    def reserve(self, now):
+        """Reserve the next token; returns seconds to wait before using it"""
+        tat = max(self.tat, now)
+        self.tat = tat + self.interval
+        return max(tat - self.tolerance - now, 0)
+
+    def idle(self, now):
+        return self.tat <= now
+
+
+class BlockingRateLimiter:
+    """Thread-safe limiter for worker threads calling a rate-limited API"""
+
+    def __init__(self, rate, burst=1):
+        self.bucket = TokenBucket(rate, burst=burst)
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the caller may make its next call"""
+        with self._lock:
+            delay = self.bucket.reserve(time.monotonic())
+        if delay:
+            time.sleep(delay)
+
+
+class InboundThrottle:
+    """
+    Per-user token bucket run before all other handlers (group -1).
+    A repeat of the same command or button within coalesce_seconds is dropped, and a
+    user out of tokens is told once to slow down; further updates are dropped until
+    the bucket refills.
+    """
+
+    def __init__(self, rate=1.0, burst=5, coalesce_seconds=2.0, maxsize=10000):
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_seconds = coalesce_seconds
+        self.maxsize = maxsize
+        self._users = OrderedDict()
+
+    @staticmethod
+    def signature(update):
+        """What a repeated update would look like: the message text or button data"""
+        if update.callback_query:
+            return f"callback:{update.callback_query.data}"
+        if update.effective_message and update.effective_message.text:
+            return f"text:{update.effective_message.text}"
+        return None
+
+    def entry(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = {
+                'bucket': TokenBucket(self.rate, burst=self.burst),
+                'last_signature': None,
+                'last_at': 0.0,
+                'warned': False,
+            }
+            while len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return entry
+
+    def check(self, user_id, signature, now):
+        """'ok', 'duplicate' or 'throttled' ('warn' the first time in a streak)"""
+        entry = self.entry(user_id)
+        if signature and signature == entry['last_signature'] and now - entry['last_at'] < self.coalesce_seconds:
+            return 'duplicate'
+        if not entry['bucket'].try_take(now):
+            if entry['warned']:
+                return 'throttled'
+            entry['warned'] = True
+            return 'warn'
+        entry['warned'] = False
+        entry['last_signature'] = signature
+        entry['last_at'] = now
+        return 'ok'
+
+    async def __call__(self, update, context):
+        user = update.effective_user
+        if user is None:
+            return
+        outcome = self.check(user.id, self.signature(update), time.monotonic())
+        if outcome == 'ok':
+            return
+
+        if outcome == 'warn':
+            logger.warning(f"Throttling updates from user {user.id}")
+        if update.callback_query:
+            # Stop the button's loading spinner either way
+            await update.callback_query.answer(
+                "⏳ Too many requests, please slow down." if outcome == 'warn' else None
+            )
+        elif outcome == 'warn' and update.effective_message:
+            await update.effective_message.reply_text("⏳ Too many requests, please wait a few seconds.")
+        raise ApplicationHandlerStop
+
+
+class FloodRateLimiter(BaseRateLimiter):
+    """
+    Outbound rate limiter for Telegram's flood limits: queues requests per chat
+    (private chats and groups have separate limits) and globally. On a 429 every
+    send pauses for the requested time and the request is retried.
+    """
+
+    def __init__(self, overall_rate=30, chat_rate=1, chat_burst=3, group_rate_per_minute=20, max_retries=3,
+                 maxsize=10000):
+        self.overall = TokenBucket(overall_rate, burst=overall_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate_per_minute = group_rate_per_minute
+        self.max_retries = max_retries
+        self.maxsize = maxsize
+        self._chats = {}
+        self._paused_until = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    def chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.maxsize:
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate_per_minute, period=60, burst=3)
+            else:
+                bucket = TokenBucket(self.chat_rate, burst=self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def wait_for_slot(self, chat_id):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._paused_until > now:
+            await asyncio.sleep(self._paused_until - now)
+            now = loop.time()
+
+        delay = self.chat_bucket(chat_id, now).reserve(now) if chat_id is not None else 0
+        # Take the global slot only once this chat's turn comes, so a busy chat does not hold it
+        if delay:
+            await asyncio.sleep(delay)
+            now = loop.time()
+        delay = self.overall.reserve(now)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery, getMe... are not flood limited
+            return await callback(*args, **kwargs)
+
+        for attempt in range(self.max_retries + 1):
+            await self.wait_for_slot(chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                pause = retry_seconds(e)
+                logger.warning(f"Telegram flood limit hit on {endpoint}, pausing sends for {pause}s")
+                loop = asyncio.get_running_loop()
+                self._paused_until = max(self._paused_until, loop.time() + pause)
+
+
+def build_inbound_throttle():
+    """InboundThrottle configured from settings"""
+    return InboundThrottle(
+        rate=settings.BOT_THROTTLE_RATE,
+        burst=settings.BOT_THROTTLE_BURST,
+        coalesce_seconds=settings.BOT_THROTTLE_COALESCE_SECONDS,
+    )
+
+
+def build_rate_limiter():
+    """FloodRateLimiter configured from settings"""
+    return FloodRateLimiter(
+        overall_rate=settings.BOT_OUTBOUND_RATE,
+        chat_rate=settings.BOT_OUTBOUND_CHAT_RATE,
+        group_rate_per_minute=settings.BOT_OUTBOUND_GROUP_RATE_PER_MINUTE,
+        max_retries=settings.BOT_OUTBOUND_MAX_RETRIES,
+    )
@@ -7,9 +7,15 @@ urlpatterns = [
     # Payment webhook endpoint
     path('api/payment/webhook/', views.payment_webhook, name='payment_webhook'),
     
+    # Telegram updates in webhook mode
+    path('telegram/webhook/', views.telegram_webhook, name='telegram_webhook'),
+    
     # Payment status endpoint
     path('api/payment/status/<uuid:payment_id>/', views.PaymentStatusView.as_view(), name='payment_status'),
     
+    # Prometheus metrics
+    path('metrics', views.metrics, name='metrics'),
+    
     # Payment result pages
     path('payment/success/<uuid:payment_id>/', views.payment_success, name='payment_success'),
     path('payment/error/<uuid:payment_id>/', views.payment_error, name='payment_error'),
@@ -0,0 +1,72 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class UserCache:
+    """
+    Thread-safe LRU cache of Telegram ID -> User with a size limit and TTL.
+    Users are copied in and out, so handlers on different DB worker threads never share
+    (and modify) one model instance; write changes back with set().
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id):
+        """Return a copy of the cached user, or None if missing or expired"""
+        key = str(telegram_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.copy(user)
+
+    def set(self, telegram_id, user):
+        key = str(telegram_id)
+        user = copy.copy(user)
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def update(self, telegram_id, **fields):
+        """Change fields of the cached user, if there is one, keeping its expiry"""
+        key = str(telegram_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            user = copy.copy(entry[0])
+            for name, value in fields.items():
+                setattr(user, name, value)
+            self._entries[key] = (user, entry[1])
+
+    def invalidate(self, telegram_id):
+        with self._lock:
+            self._entries.pop(str(telegram_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache(
+    maxsize=getattr(settings, 'BOT_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'BOT_USER_CACHE_TTL', 300),
+)
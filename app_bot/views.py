@@ -4,20 +4,48 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 from django.views import View
+from django.conf import settings
+from telegram import Update
+import functools
+import hmac
 import json
 import logging
+import time
 from .services import PaymentProcessor
 from .models import Payment
+from .archive import get_payment
+from .metrics import WEBHOOK_SECONDS, registry
+from .routers import replica_reads
+from .webhook import get_application, webhook_secret_matches
+from .webhook_capture import capture_webhook
 
 logger = logging.getLogger(__name__)
 
+# Metric label for each payment webhook response status
+WEBHOOK_OUTCOMES = {200: 'success', 400: 'invalid_json', 404: 'not_found'}
+
+
+def observe_webhook(view):
+    """Record the payment webhook's latency in WEBHOOK_SECONDS, labelled by outcome"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        started = time.perf_counter()
+        response = view(request, *args, **kwargs)
+        WEBHOOK_SECONDS.observe(
+            time.perf_counter() - started, outcome=WEBHOOK_OUTCOMES.get(response.status_code, 'error')
+        )
+        return response
+    return wrapper
+
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@observe_webhook
 def payment_webhook(request):
     """
     Webhook endpoint for NOWPayments payment notifications
     """
+    capture_webhook(request)
     try:
         # Parse the webhook data
         webhook_data = json.loads(request.body)
@@ -42,6 +70,30 @@ def payment_webhook(request):
         return JsonResponse({"status": "error", "message": "Internal server error"}, status=500)
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+async def telegram_webhook(request):
+    """
+    Webhook endpoint for Telegram updates, fed to the bot's handlers in this process
+    """
+    if not settings.TELEGRAM_WEBHOOK_SECRET:
+        return JsonResponse({"status": "error", "message": "Webhook mode is disabled"}, status=404)
+    if not webhook_secret_matches(request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+        logger.warning("Rejected Telegram webhook with an invalid secret token")
+        return JsonResponse({"status": "error", "message": "Forbidden"}, status=403)
+
+    try:
+        update_data = json.loads(request.body)
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON in Telegram webhook")
+        return JsonResponse({"status": "error", "message": "Invalid JSON"}, status=400)
+
+    # Acknowledge right away; the Application processes the queue in the background
+    application = await get_application()
+    await application.update_queue.put(Update.de_json(update_data, application.bot))
+    return JsonResponse({"status": "success"}, status=200)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class PaymentStatusView(View):
     """
@@ -50,10 +102,12 @@ class PaymentStatusView(View):
     
     def get(self, request, payment_id):
         """
-        Get payment status by payment ID
+        Get payment status by payment ID (pass ?include_archived=1 to search archived payments)
         """
         try:
-            payment = Payment.objects.get(payment_id=payment_id)
+            include_archived = request.GET.get('include_archived') in ('1', 'true')
+            with replica_reads():
+                payment = get_payment(include_archived=include_archived, payment_id=payment_id)
             return JsonResponse({
                 "payment_id": str(payment.payment_id),
                 "status": payment.status,
@@ -71,6 +125,26 @@ class PaymentStatusView(View):
             return JsonResponse({"error": "Internal server error"}, status=500)
 
 
+# Scrapers allowed on /metrics when no METRICS_TOKEN is set
+LOCAL_ADDRESSES = {'127.0.0.1', '::1'}
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """
+    Prometheus metrics for this process, or for every process sharing METRICS_MULTIPROC_DIR.
+    Requires the METRICS_TOKEN bearer token; without one configured, only direct (not
+    proxied) requests from the local machine are answered.
+    """
+    if settings.METRICS_TOKEN:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}")
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in LOCAL_ADDRESSES and 'X-Forwarded-For' not in request.headers
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def payment_success(request, payment_id):
     """
     Payment success page
@@ -0,0 +1,131 @@
+import asyncio
+import fcntl
+import hmac
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+_application = None
+_application_loop = None
+_lock = asyncio.Lock()
+# Open TELEGRAM_WEBHOOK_LOCK_PATH, flock-ed while this process serves webhook updates
+_worker_lock = None
+
+
+def webhook_secret_matches(token):
+    """Check the X-Telegram-Bot-Api-Secret-Token header against TELEGRAM_WEBHOOK_SECRET"""
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    return bool(secret and token) and hmac.compare_digest(secret.encode(), token.encode())
+
+
+def claim_webhook_worker():
+    """
+    Make this process the only one on the host serving Telegram webhook updates.
+    Each process keeps the deposit conversation state it loaded at startup, so a second
+    worker would answer a user's amount without knowing they started /deposit.
+    """
+    global _worker_lock
+    if _worker_lock is not None:
+        return
+    lock_file = open(settings.TELEGRAM_WEBHOOK_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise ImproperlyConfigured(
+            "Another worker already serves Telegram webhook updates; webhook mode needs a single "
+            "worker (uvicorn --workers 1, supervise --web-workers 1)"
+        )
+    _worker_lock = lock_file
+
+
+def release_webhook_worker():
+    global _worker_lock
+    if _worker_lock is not None:
+        _worker_lock.close()
+        _worker_lock = None
+
+
+async def get_application():
+    """
+    The bot Application serving webhook updates in this worker. WebhookLifespan starts
+    it at server startup; without lifespan events it starts on the first update.
+    It lives on the server's event loop, so the web server must be ASGI with one
+    long-lived loop (uvicorn, daphne); runserver gives each request its own loop.
+    """
+    global _application, _application_loop
+    loop = asyncio.get_running_loop()
+    if _application is None:
+        async with _lock:
+            if _application is None:
+                claim_webhook_worker()
+                from .bot import build_application, post_init
+                try:
+                    application = build_application(polling=False)
+                    await application.initialize()
+                    await post_init(application)
+                    await application.start()
+                except Exception:
+                    release_webhook_worker()
+                    raise
+                _application, _application_loop = application, loop
+                logger.info("Telegram bot started in webhook mode")
+    if loop is not _application_loop:
+        raise ImproperlyConfigured("Telegram webhook mode requires an ASGI server such as uvicorn")
+    return _application
+
+
+async def shutdown_application():
+    """Stop the webhook Application if this worker started one"""
+    global _application, _application_loop
+    if _application is None:
+        return
+    from .bot import post_shutdown
+    application, _application, _application_loop = _application, None, None
+    try:
+        await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+    finally:
+        release_webhook_worker()
+    logger.info("Telegram bot stopped in webhook mode")
+
+
+class WebhookLifespan:
+    """
+    ASGI wrapper answering lifespan events. With TELEGRAM_WEBHOOK_SECRET set, server startup
+    starts the bot Application and its notification and sub-partner loops (failing if another
+    worker already serves webhooks), and server shutdown (SIGTERM) stops it: background tasks
+    are cancelled and persistence is flushed. Run the server with lifespan enabled
+    (uvicorn's default "auto" or "on").
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await self.app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if settings.TELEGRAM_WEBHOOK_SECRET:
+                        await get_application()
+                except Exception as e:
+                    logger.error(f"Error starting the webhook bot: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await shutdown_application()
+                except Exception as e:
+                    logger.error(f"Error stopping the webhook bot: {e}")
+                    await send({'type': 'lifespan.shutdown.failed', 'message': str(e)})
+                else:
+                    await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,156 @@
+import base64
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+
+from .loadtest import percentile
+
+logger = logging.getLogger(__name__)
+
+# Never written to a capture file
+SENSITIVE_HEADERS = {'authorization', 'cookie', 'x-api-key'}
+
+_capture_lock = threading.Lock()
+_capture_files = {}
+
+
+def capture_record(request, received_at=None):
+    """Compact JSON-able record of a webhook request's headers and raw body"""
+    record = {
+        'ts': round(received_at or time.time(), 6),
+        'headers': {name: value for name, value in request.headers.items() if name.lower() not in SENSITIVE_HEADERS},
+    }
+    try:
+        record['body'] = request.body.decode()
+    except UnicodeDecodeError:
+        record['body_b64'] = base64.b64encode(request.body).decode()
+    return record
+
+
+def capture_webhook(request):
+    """Append the request to settings.WEBHOOK_CAPTURE_PATH as one JSON line, if capture is on"""
+    path = settings.WEBHOOK_CAPTURE_PATH
+    if not path:
+        return
+    line = json.dumps(capture_record(request), separators=(',', ':')) + '\n'
+    try:
+        with _capture_lock:
+            capture_file = _capture_files.get(path)
+            if capture_file is None:
+                # Append mode keeps whole lines intact when several workers share the file
+                capture_file = _capture_files[path] = open(path, 'a', buffering=1)
+            capture_file.write(line)
+    except OSError as e:
+        logger.error(f"Could not capture webhook to {path}: {e}")
+
+
+def read_capture(path, limit=None):
+    """Records from a capture file in the order they were received"""
+    with open(path) as f:
+        for count, line in enumerate(f):
+            if limit is not None and count >= limit:
+                return
+            if line.strip():
+                yield json.loads(line)
+
+
+def record_body(record):
+    if 'body_b64' in record:
+        return base64.b64decode(record['body_b64'])
+    return record['body'].encode()
+
+
+class WebhookReplayer:
+    """
+    Re-send captured webhooks to url, keeping their original spacing divided by speed
+    (speed 0 sends as fast as concurrency allows).
+    For each request it records the acceptance latency (send to response) and the lag:
+    how long after its scheduled time the response arrived, including time spent
+    waiting for a free sender.
+    """
+
+    def __init__(self, url, speed=1.0, concurrency=8, timeout=30):
+        self.url = url
+        self.speed = speed
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.latencies = []
+        self.lags = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def send(self, record, scheduled_at):
+        # Hop-by-hop and length headers are recomputed for the new request
+        headers = {
+            name: value for name, value in record['headers'].items()
+            if name.lower() not in ('host', 'content-length', 'connection', 'transfer-encoding')
+        }
+        started = time.perf_counter()
+        try:
+            response = self.session().post(self.url, data=record_body(record), headers=headers, timeout=self.timeout)
+            finished = time.perf_counter()
+            with self._lock:
+                self.statuses[response.status_code] += 1
+                if response.status_code >= 400:
+                    self.errors[f"HTTP {response.status_code}"] += 1
+        except requests.RequestException as e:
+            finished = time.perf_counter()
+            with self._lock:
+                self.errors[type(e).__name__] += 1
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.latencies.append(finished - started)
+            self.lags.append(finished - scheduled_at)
+
+    def run(self, records):
+        """
+        Replay records, waiting for every response
+        Returns: seconds taken
+        """
+        started = time.perf_counter()
+        first_ts = None
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='replay') as executor:
+            for record in records:
+                if first_ts is None:
+                    first_ts = record['ts']
+                scheduled_at = started
+                if self.speed:
+                    scheduled_at += (record['ts'] - first_ts) / self.speed
+                    delay = scheduled_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self._slots.acquire()
+                executor.submit(self.send, record, scheduled_at)
+        return time.perf_counter() - started
+
+    def report(self):
+        """Latency and lag percentiles in milliseconds"""
+        latencies = sorted(self.latencies)
+        lags = sorted(self.lags)
+        return {
+            'requests': len(latencies),
+            'latency_p50': percentile(latencies, 50) * 1000,
+            'latency_p95': percentile(latencies, 95) * 1000,
+            'latency_p99': percentile(latencies, 99) * 1000,
+            'latency_max': (latencies[-1] if latencies else 0.0) * 1000,
+            'lag_p50': percentile(lags, 50) * 1000,
+            'lag_p95': percentile(lags, 95) * 1000,
+            'lag_max': (lags[-1] if lags else 0.0) * 1000,
+            'statuses': dict(self.statuses),
+            'errors': dict(self.errors),
+        }
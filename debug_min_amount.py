@@ -31,7 +31,7 @@ def debug_min_amount_api():
     is_fixed_rate = getattr(settings, 'is_fixed_rate', False)
     is_fee_paid_by_user = getattr(settings, 'is_fee_paid_by_user', False)
     
-    base_url = 'https://api.nowpayments.io/v1'
+    base_url = settings.NOWPAYMENTS_BASE_URL
     headers = {
         'x-api-key': api_key,
         'Content-Type': 'application/json'
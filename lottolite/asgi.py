@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lottolite.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from app_bot.webhook import WebhookLifespan  # noqa: E402  (needs the app registry loaded above)
+
+# Stops the webhook bot cleanly when the server shuts down
+application = WebhookLifespan(django_application)
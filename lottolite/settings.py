@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -78,13 +79,88 @@ AUTH_USER_MODEL = 'app_account.User'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite concurrency profile. The bot and the web server write to the same file from
+# separate processes, so use WAL with a busy timeout instead of failing with
+# "database is locked". Set SQLITE_TUNED=False to fall back to SQLite defaults.
+SQLITE_TUNED = os.getenv('SQLITE_TUNED', 'True') == 'True'
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '20000'))
+
+# Applied to every new connection by app_bot.db.configure_sqlite_connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -20000,  # negative means KiB, i.e. ~20 MB page cache
+    'temp_store': 'MEMORY',
+} if SQLITE_TUNED else {}
+
+# DATABASE_ENGINE=postgresql selects the PostgreSQL profile below; anything else uses SQLite
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'sqlite3')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+            # Take the write lock at BEGIN so read-then-write transactions wait on the
+            # busy timeout instead of failing on lock upgrade
+            'transaction_mode': 'IMMEDIATE',
+        } if SQLITE_TUNED else {},
     }
 }
 
+if DATABASE_ENGINE == 'postgresql':
+    # Requires psycopg[pool] >= 3. Django's pool keeps connections open between requests,
+    # so it replaces CONN_MAX_AGE; set DATABASE_POOL=False to use plain persistent
+    # connections (e.g. behind PgBouncer) instead.
+    DATABASE_POOL = os.getenv('DATABASE_POOL', 'True') == 'True'
+
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB', 'lottolite'),
+        'USER': os.getenv('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.getenv('DATABASE_CONN_MAX_AGE', '600')),
+        # Validates reused connections (and pooled ones, via the pool's check callback)
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', '10')),
+                'timeout': int(os.getenv('DATABASE_POOL_TIMEOUT', '10')),
+                'max_lifetime': int(os.getenv('DATABASE_POOL_MAX_LIFETIME', '1800')),
+            },
+        } if DATABASE_POOL else {},
+        'TEST': {
+            'NAME': os.getenv('POSTGRES_TEST_DB', 'test_lottolite'),
+        },
+    }
+
+# Read replica for read-heavy bot history and status queries (app_bot.routers). The alias
+# always exists so routing can be tested against two local databases, but reads only go to
+# it when DATABASE_REPLICA_ENABLED=True. Point it at the replica with SQLITE_REPLICA_PATH
+# or POSTGRES_REPLICA_HOST / POSTGRES_REPLICA_PORT.
+DATABASES['replica'] = dict(DATABASES['default'])
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES['replica'].update({
+        'HOST': os.getenv('POSTGRES_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {
+            'NAME': os.getenv('POSTGRES_TEST_DB', 'test_lottolite') + '_replica',
+        },
+    })
+else:
+    DATABASES['replica']['NAME'] = os.getenv('SQLITE_REPLICA_PATH', DATABASES['default']['NAME'])
+
+DATABASE_ROUTERS = ['app_bot.routers.PrimaryReplicaRouter']
+DATABASE_READ_REPLICA = 'replica' if os.getenv('DATABASE_REPLICA_ENABLED', 'False') == 'True' else None
+# Seconds a user's reads stay on the primary after their own write, to hide replication lag
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', '15'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -131,7 +207,115 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 #NOWPAYMENTS SETTINGS
+# API root; point at a local fake (python manage.py fake_nowpayments) to run without network access
+NOWPAYMENTS_BASE_URL = os.getenv('NOWPAYMENTS_BASE_URL', 'https://api.nowpayments.io/v1').rstrip('/')
+# Append every payment webhook request (headers and raw body) to this JSONL file for
+# replay_webhooks; empty disables capture
+WEBHOOK_CAPTURE_PATH = os.getenv('WEBHOOK_CAPTURE_PATH', '')
 currency_to='BNBBSC'
 fiat_to='USD'
 is_fixed_rate = False
 is_fee_paid_by_user = False
+
+
+#BOT SETTINGS
+# Webhook mode: Telegram posts updates to /telegram/webhook/ (see the setwebhook command).
+# Requests must carry this secret in X-Telegram-Bot-Api-Secret-Token; empty disables the route.
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '')
+# Held by the one web worker serving webhook updates; a second worker fails at startup
+TELEGRAM_WEBHOOK_LOCK_PATH = (
+    os.getenv('TELEGRAM_WEBHOOK_LOCK_PATH') or os.path.join(tempfile.gettempdir(), 'lottolite-telegram-webhook.lock')
+)
+
+# Thread pools for the bot's blocking work (app_bot.executors): ORM calls and NOWPayments
+# requests. 0 runs that kind of work on asgiref's single thread-sensitive thread.
+# With DATABASE_POOL, size DATABASE_POOL_MAX_SIZE for BOT_DB_WORKERS + BOT_NETWORK_WORKERS or calls wait for a connection.
+BOT_DB_WORKERS = int(os.getenv('BOT_DB_WORKERS', '8'))
+BOT_NETWORK_WORKERS = int(os.getenv('BOT_NETWORK_WORKERS', '16'))
+# Updates handled at once (app_bot.dispatch): different users run in parallel on the pools
+# above, each user's updates still one at a time in order. 1 handles every update in turn.
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '32'))
+# Seconds a bot thread keeps an unpooled CONN_MAX_AGE=0 connection (the SQLite profile)
+# open between calls. Web requests still close theirs, as Django advises under ASGI.
+BOT_DB_CONN_MAX_AGE = int(os.getenv('BOT_DB_CONN_MAX_AGE', '600'))
+
+# In-process LRU cache of Telegram ID -> User used by save_user
+BOT_USER_CACHE_SIZE = int(os.getenv('BOT_USER_CACHE_SIZE', '10000'))
+BOT_USER_CACHE_TTL = int(os.getenv('BOT_USER_CACHE_TTL', '300'))
+
+# Background NOWPayments sub-partner provisioning (app_bot.provisioning)
+SUB_PARTNER_MAX_ATTEMPTS = int(os.getenv('SUB_PARTNER_MAX_ATTEMPTS', '8'))
+SUB_PARTNER_RETRY_BASE_SECONDS = int(os.getenv('SUB_PARTNER_RETRY_BASE_SECONDS', '30'))
+SUB_PARTNER_RETRY_MAX_SECONDS = int(os.getenv('SUB_PARTNER_RETRY_MAX_SECONDS', '3600'))
+# How often the bot drains the queue itself; 0 leaves it to run_provisioning_worker
+SUB_PARTNER_WORKER_INTERVAL = int(os.getenv('SUB_PARTNER_WORKER_INTERVAL', '5'))
+# How long a deposit waits for a sub-partner account that another worker is creating
+SUB_PARTNER_WAIT_TIMEOUT = int(os.getenv('SUB_PARTNER_WAIT_TIMEOUT', '30'))
+
+# Inbound throttling per Telegram user (app_bot.throttling): updates per second, burst size,
+# and the window in which a repeat of the same command or button is dropped
+BOT_THROTTLE_RATE = float(os.getenv('BOT_THROTTLE_RATE', '1'))
+BOT_THROTTLE_BURST = int(os.getenv('BOT_THROTTLE_BURST', '5'))
+BOT_THROTTLE_COALESCE_SECONDS = float(os.getenv('BOT_THROTTLE_COALESCE_SECONDS', '2'))
+
+# Telegram allows about 30 messages per second per bot token in total. The live bot and the
+# broadcast command run in separate processes with separate limiters, so they split that
+# budget: broadcasts get BOT_BROADCAST_RATE and the live bot the remainder. Each limiter is
+# per process, so with several bot processes (runbot --workers, webhook workers) lower
+# BOT_OUTBOUND_RATE to their share.
+TELEGRAM_GLOBAL_RATE = int(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+BOT_BROADCAST_RATE = int(os.getenv('BOT_BROADCAST_RATE', '20'))
+
+# Outbound limits below Telegram's flood limits: messages per second overall and per
+# private chat, messages per minute per group, and retries after a 429
+BOT_OUTBOUND_RATE = int(os.getenv('BOT_OUTBOUND_RATE', str(max(TELEGRAM_GLOBAL_RATE - BOT_BROADCAST_RATE, 1))))
+BOT_OUTBOUND_CHAT_RATE = float(os.getenv('BOT_OUTBOUND_CHAT_RATE', '1'))
+BOT_OUTBOUND_GROUP_RATE_PER_MINUTE = int(os.getenv('BOT_OUTBOUND_GROUP_RATE_PER_MINUTE', '20'))
+BOT_OUTBOUND_MAX_RETRIES = int(os.getenv('BOT_OUTBOUND_MAX_RETRIES', '3'))
+
+# Outbound notification queue (deposit confirmations): seconds between polls when idle
+# (0 disables sending from this process), messages per batch, and send attempts
+BOT_NOTIFICATION_INTERVAL = float(os.getenv('BOT_NOTIFICATION_INTERVAL', '2'))
+BOT_NOTIFICATION_BATCH_SIZE = int(os.getenv('BOT_NOTIFICATION_BATCH_SIZE', '50'))
+BOT_NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('BOT_NOTIFICATION_MAX_ATTEMPTS', '5'))
+
+# Seconds between writes of changed conversation/user data to the BotState table
+# (also written on shutdown); this is what a crashed bot worker can lose
+BOT_PERSISTENCE_INTERVAL = int(os.getenv('BOT_PERSISTENCE_INTERVAL', '5'))
+
+# Deposit currency keyboard (app_bot.keyboards): coins pinned on the first page, coins per
+# page, and seconds the merchant coin list is cached before it is fetched again
+BOT_POPULAR_CURRENCIES = os.getenv('BOT_POPULAR_CURRENCIES', 'btc,eth,usdt,usdc,ltc,bnbbsc').split(',')
+BOT_CURRENCY_PAGE_SIZE = int(os.getenv('BOT_CURRENCY_PAGE_SIZE', '24'))
+BOT_CURRENCY_CACHE_TTL = int(os.getenv('BOT_CURRENCY_CACHE_TTL', '300'))
+
+# Rows per page for /payments and /transactions
+BOT_HISTORY_PAGE_SIZE = int(os.getenv('BOT_HISTORY_PAGE_SIZE', '5'))
+
+# QR codes are rendered off the event loop (app_bot.qr)
+BOT_QR_WORKERS = int(os.getenv('BOT_QR_WORKERS', '2'))
+BOT_QR_CACHE_SIZE = int(os.getenv('BOT_QR_CACHE_SIZE', '256'))
+BOT_QR_USE_PROCESSES = os.getenv('BOT_QR_USE_PROCESSES', 'True') == 'True'
+
+
+#METRICS SETTINGS
+# Prometheus-style metrics on /metrics (app_bot.metrics). When several processes run (web
+# workers, bot), give them a shared directory: each writes its values there every
+# METRICS_FLUSH_INTERVAL seconds and /metrics merges them. Empty reports this process only.
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+# Require "Authorization: Bearer <token>" on /metrics; empty only answers direct requests from localhost
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+#QUERY PROFILER SETTINGS
+# Opt-in ORM profiling of each web request and bot update (app_bot.query_profiler). Requests
+# or updates over any budget are logged with their repeated queries and a stack to the source
+# line; a budget of 0 disables that check.
+QUERY_PROFILER_ENABLED = os.getenv('QUERY_PROFILER_ENABLED', 'False') == 'True'
+QUERY_PROFILER_MAX_QUERIES = int(os.getenv('QUERY_PROFILER_MAX_QUERIES', '20'))
+QUERY_PROFILER_MAX_TIME_MS = float(os.getenv('QUERY_PROFILER_MAX_TIME_MS', '200'))
+# More runs than this of one query shape per request or update is reported as a likely N+1
+QUERY_PROFILER_MAX_REPEATS = int(os.getenv('QUERY_PROFILER_MAX_REPEATS', '5'))
+if QUERY_PROFILER_ENABLED:
+    MIDDLEWARE.insert(0, 'app_bot.query_profiler.QueryProfilerMiddleware')
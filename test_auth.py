@@ -15,7 +15,7 @@ def test_auth():
     api_key = os.getenv('NOWPAYMENTS_API_KEY')
     email = os.getenv('NOWPAYMENTS_EMAIL')
     password = os.getenv('NOWPAYMENTS_PASSWORD')
-    base_url = 'https://api.nowpayments.io/v1'
+    base_url = os.getenv('NOWPAYMENTS_BASE_URL', 'https://api.nowpayments.io/v1').rstrip('/')
     
     if not api_key:
         print("❌ NOWPAYMENTS_API_KEY not found")
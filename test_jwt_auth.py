@@ -15,7 +15,7 @@ def test_jwt_auth():
     """Test JWT authentication and sub-partner creation"""
     email = os.getenv('NOWPAYMENTS_EMAIL')
     password = os.getenv('NOWPAYMENTS_PASSWORD')
-    base_url = 'https://api.nowpayments.io/v1'
+    base_url = os.getenv('NOWPAYMENTS_BASE_URL', 'https://api.nowpayments.io/v1').rstrip('/')
     
     if not email or not password:
         print("❌ NOWPAYMENTS_EMAIL or NOWPAYMENTS_PASSWORD not found")